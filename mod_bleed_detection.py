@@ -0,0 +1,191 @@
+# |-- Finding the start of the next song in the tail of a recording
+# on a song change spotrec pauses the player, keeps recording N for _recording_time_after_song and only then
+# starts recording N+1 (after a pre-roll, from the start of the song). until the pause takes effect, N captures
+# the first moments of N+1, which N+1 captures again. the offset is found by FFT cross-correlation of decimated
+# PCM (trailing silence of N and leading silence of N+1 left out) and refined at the full rate; N is cut there.
+# the head of N+1 is only complete once N+1 stopped, see RecordingChain
+
+# |--- Internal Imports
+from mod_boundary_detection import iter_pcm_chunks,silence_threshold_in_db
+
+# |--- External Imports
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NamedTuple
+import threading
+import numpy as np
+
+# |--- Variables
+# longer than _recording_time_after_song plus the startup of the next recording
+tail_in_s:float = 6.0
+head_in_s:float = 6.0
+decimation:int = 8
+# normalized correlation at the offset, same audio scores close to 1
+min_score:float = 0.8
+# the leak before the pause takes effect can be short
+min_overlap_in_s:float = 0.1
+
+
+class Bleed(NamedTuple):
+    # first sample of recording N holding audio of N+1
+    start_sample:int
+    sample_rate:int
+    # where the first sample of recording N+1 would lie in N (negative behind the pre-roll)
+    offset_sample:int
+    score:float
+
+    @property
+    def start_in_ms(self) -> float:
+        return self.start_sample * 1000 / self.sample_rate
+
+
+# |--- Reading PCM
+def _mono(chunk:np.ndarray) -> np.ndarray:
+    return chunk.astype(np.float32).mean(axis=1)
+
+def read_tail(path:str,length_in_s:float=tail_in_s) -> tuple[int,int,np.ndarray]:
+    '''
+    (sample rate, total samples, mono samples of the last length_in_s); the file is streamed,
+    only chunks overlapping the tail are kept
+    '''
+    sample_rate,chunks = iter_pcm_chunks(path,chunk_in_s=min(length_in_s,10.0))
+    tail_samples = int(length_in_s * sample_rate)
+    kept:list[np.ndarray] = []
+    kept_samples,total_samples = 0,0
+    for chunk in chunks:
+        kept.append(_mono(chunk))
+        kept_samples += len(chunk)
+        total_samples += len(chunk)
+        while kept_samples - len(kept[0]) >= tail_samples:
+            kept_samples -= len(kept.pop(0))
+    tail = np.concatenate(kept)[-tail_samples:] if kept else np.zeros(0,dtype=np.float32)
+    return sample_rate,total_samples,tail
+
+def read_head(path:str,length_in_s:float=head_in_s) -> tuple[int,np.ndarray]:
+    '''
+    (sample rate, mono samples of the first length_in_s)
+    '''
+    sample_rate,chunks = iter_pcm_chunks(path,chunk_in_s=length_in_s,length_in_s=length_in_s)
+    head = [_mono(chunk) for chunk in chunks]
+    return sample_rate,np.concatenate(head) if head else np.zeros(0,dtype=np.float32)
+
+
+# |--- Correlation
+def _decimate(samples:np.ndarray,factor:int) -> np.ndarray:
+    # mean of factor samples, enough of a low-pass for finding the offset
+    return samples[:len(samples) // factor * factor].reshape(-1,factor).mean(axis=1)
+
+def _normalized_scores(tail:np.ndarray,head:np.ndarray,min_overlap:int) -> np.ndarray:
+    '''
+    correlation of head placed at each offset of tail, over their overlap,
+    normalized by the energy of both overlapping parts (1 for identical audio)
+    '''
+    size = 1 << (len(tail) + len(head) - 1).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(tail,size) * np.conj(np.fft.rfft(head,size)),size)[:len(tail)]
+    offsets = np.arange(len(tail))
+    overlaps = np.minimum(len(head),len(tail) - offsets)
+    tail_energy = np.concatenate(([0.0],np.cumsum(tail.astype(np.float64) ** 2)))
+    head_energy = np.concatenate(([0.0],np.cumsum(head.astype(np.float64) ** 2)))
+    energy = (tail_energy[offsets + overlaps] - tail_energy[offsets]) * head_energy[overlaps]
+    with np.errstate(divide="ignore",invalid="ignore"):
+        scores = np.where(energy > 0,correlation / np.sqrt(energy),0.0)
+    scores[overlaps < min_overlap] = 0.0
+    return scores
+
+def find_offset(tail:np.ndarray,head:np.ndarray,sample_rate:int,decimation:int=decimation,
+                min_score:float=min_score,min_overlap_in_s:float=min_overlap_in_s) -> tuple[int,float]|None:
+    '''
+    (offset in tail where head starts, score), found on the decimated signals and refined
+    at the full rate within one decimation step; None without a match scoring min_score
+    '''
+    min_overlap = int(min_overlap_in_s * sample_rate)
+    if len(tail) < min_overlap or len(head) < min_overlap:
+        return None
+    scores = _normalized_scores(_decimate(tail,decimation),_decimate(head,decimation),min_overlap // decimation)
+    coarse = int(scores.argmax())
+    if scores[coarse] < min_score:
+        return None
+    best = None
+    for offset in range(max(0,(coarse - 1) * decimation),min(len(tail) - min_overlap,(coarse + 1) * decimation) + 1):
+        overlap = min(len(head),len(tail) - offset)
+        tail_part,head_part = tail[offset:offset + overlap],head[:overlap]
+        energy = float(np.dot(tail_part,tail_part)) * float(np.dot(head_part,head_part))
+        score = float(np.dot(tail_part,head_part)) / energy ** 0.5 if energy > 0 else 0.0
+        if best is None or score > best[1]:
+            best = (offset,score)
+    return best if best[1] >= min_score else None
+
+def find_bleed(tail:np.ndarray,total_samples:int,head:np.ndarray,sample_rate:int) -> Bleed|None:
+    '''
+    where the audio of the next recording (head) begins in the recording ending with tail.
+    only the sound of both takes part: the tail up to its last loud sample (the player is paused after the leak),
+    the head from its first loud sample (the pre-roll of the next recording is silent)
+    '''
+    threshold = 32768 * 10 ** (silence_threshold_in_db / 20)
+    loud_in_tail = np.flatnonzero(np.abs(tail) > threshold)
+    loud_in_head = np.flatnonzero(np.abs(head) > threshold)
+    if len(loud_in_tail) == 0 or len(loud_in_head) == 0:
+        return None
+    sound_in_tail = tail[:int(loud_in_tail[-1]) + 1]
+    match = find_offset(sound_in_tail,head[int(loud_in_head[0]):],sample_rate)
+    if match is None:
+        return None
+    offset,score = match
+    start_sample = total_samples - len(tail) + offset
+    return Bleed(start_sample,sample_rate,start_sample - int(loud_in_head[0]),score)
+
+
+# |--- Recordings
+# decodes tail and head at the same time, shared by the post processing threads
+_decode_pool = ThreadPoolExecutor(max_workers=4,thread_name_prefix="bleed-decode")
+
+def find_bleed_in_recordings(path:str,next_path:str) -> Bleed|None:
+    '''
+    where the audio of the recording at next_path begins in the recording at path,
+    None if it is not found (different sample rates, no overlap, or silence only)
+    '''
+    tail_future = _decode_pool.submit(read_tail,path)
+    head_future = _decode_pool.submit(read_head,next_path)
+    sample_rate,total_samples,tail = tail_future.result()
+    next_sample_rate,head = head_future.result()
+    if sample_rate != next_sample_rate:
+        return None
+    return find_bleed(tail,total_samples,head,sample_rate)
+
+def find_bleed_in_session(paths:list[str],jobs:int=4) -> list[Bleed|None]:
+    '''
+    bleed of each recording of a session (ordered by time) into the next, pairs are processed on a pool;
+    nothing is written, so trimming may follow in any order. the last recording has no successor (None)
+    '''
+    with ThreadPoolExecutor(max_workers=max(jobs,1)) as pool:
+        bleeds = list(pool.map(find_bleed_in_recordings,paths[:-1],paths[1:]))
+    return bleeds + [None] if paths else []
+
+
+class RecordingChain:
+    '''
+    holds back the post processing of each recording until the next one of the session has finished,
+    so its tail can be compared with the complete head of the next one. process(path, payload, next_path)
+    is called with next_path None for the last recording (flush)
+
+    usage:
+        chain = RecordingChain(start_post_processing)
+        chain.add(finished_path,expected_length)   # processes the recording before
+        chain.flush()                              # at the end of the session
+    '''
+    def __init__(self,process:Callable[[str,Any,str|None],Any]):
+        self.process = process
+        self._lock = threading.Lock()
+        self._pending:tuple[str,Any]|None = None
+
+    def add(self,path:str,payload:Any=None) -> Any:
+        '''
+        queues the finished recording at path, returns the result of processing the one before (or None)
+        '''
+        with self._lock:
+            pending,self._pending = self._pending,(path,payload)
+        return self.process(*pending,path) if pending is not None else None
+
+    def flush(self) -> Any:
+        with self._lock:
+            pending,self._pending = self._pending,None
+        return self.process(*pending,None) if pending is not None else None
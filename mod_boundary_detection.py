@@ -0,0 +1,242 @@
+# |-- Locating where the music of a recording starts and ends
+# recordings start _recording_time_before_song early and stop _recording_time_after_song late,
+# so they carry silence or the neighbouring tracks around the song.
+# PCM is read in chunks and judged by the RMS of short windows (numpy); gaps of silence
+# near the head and the tail mark the song, their edges are refined to the sample
+
+# |--- External Imports
+from typing import Iterator, NamedTuple
+import subprocess
+import shutil
+import wave
+import os
+
+import mutagen
+import numpy as np
+
+# |--- Variables
+# RMS below this (dB relative to full scale) counts as silence
+silence_threshold_in_db:float = -60.0
+window_in_ms:float = 10.0
+# silence shorter than this is a pause within the song
+min_gap_in_ms:float = 150.0
+# the song starts within this of the recording start and ends within this of the recording end
+head_in_s:float = 3.0
+tail_in_s:float = 4.0
+chunk_in_s:float = 10.0
+
+
+class BoundaryDetectionError(Exception):
+    pass
+
+
+class MusicBoundaries(NamedTuple):
+    # samples per channel; end is exclusive
+    start_sample:int
+    end_sample:int
+    total_samples:int
+    sample_rate:int
+    # the end is the edge of a gap in the tail (the next song follows), not trailing silence
+    end_at_gap:bool
+
+    @property
+    def start_in_ms(self) -> float:
+        return self.start_sample * 1000 / self.sample_rate
+
+    @property
+    def end_in_ms(self) -> float:
+        return self.end_sample * 1000 / self.sample_rate
+
+
+# |--- Reading PCM
+def iter_pcm_chunks(path:str,chunk_in_s:float=chunk_in_s,length_in_s:float|None=None) -> tuple[int,Iterator[np.ndarray]]:
+    '''
+    returns (sample rate, chunks of int16 samples shaped (samples, channels)), of the first length_in_s if given.
+    WAV is read directly, everything else is decoded by an ffmpeg pipe.
+    raises BoundaryDetectionError if the stream info can not be read
+    '''
+    if os.path.splitext(path)[1].lower() == ".wav":
+        try:
+            with wave.open(path,"rb") as file:
+                sample_width,sample_rate,channels = file.getsampwidth(),file.getframerate(),file.getnchannels()
+        except (wave.Error,EOFError) as error:
+            raise BoundaryDetectionError(f"can not read {path}: {error}") from error
+        if sample_width != 2:
+            raise BoundaryDetectionError(f"only 16 bit WAV supported, {path} has {8 * sample_width} bit")
+
+        def read_wav() -> Iterator[np.ndarray]:
+            with wave.open(path,"rb") as file:
+                samples_left = file.getnframes() if length_in_s is None else int(length_in_s * sample_rate)
+                while samples_left > 0 and (frames := file.readframes(min(samples_left,int(chunk_in_s * sample_rate)))):
+                    samples_left -= len(frames) // (2 * channels)
+                    yield np.frombuffer(frames,dtype="<i2").reshape(-1,channels)
+        return sample_rate,read_wav()
+
+    try:
+        info = getattr(mutagen.File(path),"info",None)
+    except mutagen.MutagenError as error:
+        raise BoundaryDetectionError(f"can not read the stream info of {path}: {error}") from error
+    if info is None or not getattr(info,"sample_rate",None):
+        raise BoundaryDetectionError(f"can not read the stream info of {path}")
+    if shutil.which("ffmpeg") is None:
+        raise BoundaryDetectionError("ffmpeg is required to decode " + os.path.basename(path))
+    sample_rate,channels = info.sample_rate,getattr(info,"channels",2)
+
+    def read_ffmpeg() -> Iterator[np.ndarray]:
+        duration = ["-t",str(length_in_s)] if length_in_s is not None else []
+        process = subprocess.Popen(["ffmpeg","-v","error","-i",path,*duration,"-f","s16le","-acodec","pcm_s16le","-"],
+                                   stdin=subprocess.DEVNULL,stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+        chunk_bytes = int(chunk_in_s * sample_rate) * channels * 2
+        try:
+            while data := process.stdout.read(chunk_bytes):
+                # a pipe can end on a partial sample
+                yield np.frombuffer(data[:len(data) - len(data) % (2 * channels)],dtype="<i2").reshape(-1,channels)
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
+    return sample_rate,read_ffmpeg()
+
+
+# |--- Detection
+class BoundaryDetector:
+    '''
+    streaming detector, fed chunk by chunk; memory stays at one chunk and the gaps of the last tail_in_s.
+
+    a gap (silence of min_gap_in_ms) in the head only marks the song start if the sound before it
+    started with the recording (the previous song), likewise a gap in the tail only marks the end if
+    the sound behind it lasts until the recording ends (the next song). otherwise leading and trailing
+    silence is cut. edges are refined to the first / last sample above the threshold
+
+    usage:
+        detector = BoundaryDetector(44100)
+        for chunk in chunks:
+            detector.feed(chunk)
+        boundaries = detector.finish()
+    '''
+    def __init__(self,sample_rate:int,threshold_in_db:float=silence_threshold_in_db,window_in_ms:float=window_in_ms,
+                 min_gap_in_ms:float=min_gap_in_ms,head_in_s:float=head_in_s,tail_in_s:float=tail_in_s):
+        self.sample_rate = sample_rate
+        self.window = max(1,round(sample_rate * window_in_ms / 1000))
+        # compared against the mean square of samples scaled to [-1, 1)
+        self.threshold_power = 10 ** (threshold_in_db / 10)
+        self.threshold_amplitude = 32768 * 10 ** (threshold_in_db / 20)
+        self.min_gap_windows = max(1,round(min_gap_in_ms / window_in_ms))
+        self.min_gap_samples = self.min_gap_windows * self.window
+        self.head_samples = int(head_in_s * sample_rate)
+        self.tail_samples = int(tail_in_s * sample_rate)
+
+        # samples not filling a window yet
+        self._rest:np.ndarray|None = None
+        self._previous_window:np.ndarray|None = None
+        self.samples_seen = 0
+        self.quiet_windows = 0
+        self.first_sound:int|None = None
+        self.song_start:int|None = None
+        # exclusive end of the last sound
+        self.last_sound_end = 0
+        # (sound end, next sound start) of the gaps within the last tail_samples
+        self.tail_gaps:list[tuple[int,int]] = []
+
+    def _loud_samples(self,samples:np.ndarray) -> np.ndarray:
+        return np.abs(samples.astype(np.int32)).max(axis=1) > self.threshold_amplitude
+
+    def _sound_start(self,before:np.ndarray|None,window:np.ndarray) -> int:
+        # first loud sample relative to the start of window; an onset may begin in the quiet window before
+        if before is not None:
+            loud_samples = self._loud_samples(before)
+            if loud_samples.any():
+                return int(loud_samples.argmax()) - len(before)
+        return int(self._loud_samples(window).argmax())
+
+    def _sound_end(self,window:np.ndarray,after:np.ndarray|None) -> int:
+        # end of the last loud sample relative to the start of window; a release may reach into the quiet window after
+        if after is not None:
+            loud_samples = self._loud_samples(after)
+            if loud_samples.any():
+                return len(window) + len(after) - int(loud_samples[::-1].argmax())
+        return len(window) - int(self._loud_samples(window)[::-1].argmax())
+
+    def _add_sound(self,start:int,end:int,quiet_samples:int):
+        '''
+        sound from start to end (exclusive) behind quiet_samples of silence
+        '''
+        if self.first_sound is None:
+            self.first_sound = self.song_start = start
+        elif quiet_samples >= self.min_gap_samples:
+            if start < self.head_samples and self.first_sound < self.min_gap_samples:
+                self.song_start = start
+            self.tail_gaps.append((self.last_sound_end,start))
+        self.last_sound_end = end
+
+    def feed(self,chunk:np.ndarray):
+        if self._rest is not None:
+            chunk = np.concatenate((self._rest,chunk))
+        amount_windows = len(chunk) // self.window
+        self._rest = chunk[amount_windows * self.window:] if len(chunk) % self.window else None
+        if amount_windows == 0:
+            return
+        windows = chunk[:amount_windows * self.window].reshape(amount_windows,self.window,-1)
+        samples = windows.astype(np.float32)
+        power = np.einsum("wsc,wsc->w",samples,samples) / (self.window * samples.shape[2] * 32768.0 ** 2)
+        loud_windows = np.flatnonzero(power > self.threshold_power)
+        offset = self.samples_seen
+        self.samples_seen += amount_windows * self.window
+        previous_window,self._previous_window = self._previous_window,windows[-1].copy()
+        if self.first_sound is not None and self.quiet_windows == 0 and (len(loud_windows) == 0 or loud_windows[0] > 0):
+            # the sound at the end of the last chunk may fade out in the first window of this one
+            loud_samples = self._loud_samples(windows[0])
+            if loud_samples.any():
+                self.last_sound_end = offset + self.window - int(loud_samples[::-1].argmax())
+        if len(loud_windows) == 0:
+            self.quiet_windows += amount_windows
+            return
+
+        # runs of loud windows, only their edges are looked at sample by sample
+        breaks = np.flatnonzero(np.diff(loud_windows) > 1)
+        run_starts = np.concatenate((loud_windows[:1],loud_windows[breaks + 1]))
+        run_ends = np.concatenate((loud_windows[breaks],loud_windows[-1:]))
+        quiet_before = run_starts - np.concatenate(([-1],run_ends[:-1])) - 1
+        quiet_before[0] += self.quiet_windows
+        self.quiet_windows = amount_windows - 1 - int(loud_windows[-1])
+        for run_start,run_end,quiet in zip(run_starts.tolist(),run_ends.tolist(),quiet_before.tolist()):
+            start = offset + run_start * self.window
+            if quiet > 0 or self.first_sound is None:
+                start += self._sound_start(windows[run_start - 1] if run_start > 0 else previous_window,windows[run_start])
+            end = offset + run_end * self.window \
+                + self._sound_end(windows[run_end],windows[run_end + 1] if run_end + 1 < amount_windows else None)
+            self._add_sound(start,end,start - self.last_sound_end)
+        self.tail_gaps = [gap for gap in self.tail_gaps if gap[0] >= self.samples_seen - self.tail_samples]
+
+    def finish(self) -> MusicBoundaries|None:
+        '''
+        boundaries of the music, None for a silent recording
+        '''
+        total_samples = self.samples_seen
+        if self._rest is not None:
+            loud_samples = self._loud_samples(self._rest)
+            total_samples += len(self._rest)
+            if loud_samples.any():
+                start = self.samples_seen + int(loud_samples.argmax())
+                self._add_sound(start,total_samples - int(loud_samples[::-1].argmax()),start - self.last_sound_end)
+            self._rest = None
+        if self.first_sound is None:
+            return None
+        if total_samples - self.last_sound_end < self.min_gap_samples:
+            # sound until the end: the next song, cut at the first gap of the tail
+            for sound_end,_ in self.tail_gaps:
+                if sound_end >= total_samples - self.tail_samples and sound_end > self.song_start:
+                    return MusicBoundaries(self.song_start,sound_end,total_samples,self.sample_rate,True)
+        return MusicBoundaries(self.song_start,self.last_sound_end,total_samples,self.sample_rate,False)
+
+
+def detect_music_boundaries(path:str,**detector_options) -> MusicBoundaries|None:
+    '''
+    boundaries of the music in the recording at path, None if it is silent.
+    raises BoundaryDetectionError if it can not be decoded
+    '''
+    sample_rate,chunks = iter_pcm_chunks(path)
+    detector = BoundaryDetector(sample_rate,**detector_options)
+    for chunk in chunks:
+        detector.feed(chunk)
+    return detector.finish()
@@ -2,6 +2,8 @@
 
 # External Imports
 from typing import NamedTuple
+import unicodedata
+import re
 
 
 class song_metadata(NamedTuple):
@@ -11,3 +13,63 @@ class song_metadata(NamedTuple):
     album:str
     song_length_in_ms:int
     source:str|None
+
+
+# |-- Match Key
+# reduces artist, title and album to a key that is equal for the usual variants
+# of one song, e.g. "Song - Remastered 2011" / "Song" or "A feat. B" / "A"
+
+# only suffixes that name the same recording are dropped
+_VERSION_WORDS = re.compile(r"\b(remaster(ed)?|radio edit|single version|album version|original mix|mono|stereo|deluxe|expanded|anniversary|edition|bonus track|explicit|clean)\b")
+# a suffix naming any of these is another recording, even next to a version word ("Live / Remastered 2011")
+_DISTINCT_WORDS = re.compile(r"\b(live|remix(ed)?|rmx|acoustic|demo|instrumental|unplugged|karaoke|a ?cappella|reprise|rehearsal|session|extended|dub|vip|bootleg|mashup|cover|sped up|slowed)\b")
+_BRACKETED = re.compile(r"[\(\[]([^\)\]]*)[\)\]]")
+_BRACKETED_FEATURING = re.compile(r"[\(\[]\s*(feat\.?|ft\.?|featuring|with)\s[^\)\]]*[\)\]]")
+_TRAILING_FEATURING = re.compile(r"\s(feat\.?|ft\.?|featuring)\s.*$")
+# everything after the first explicitly featured artist is dropped; "AC/DC", "Simon & Garfunkel" stay whole.
+# ", " separates the artist list of MPRIS (joined so by spotrec): "A, B" is keyed like "A feat. B"
+_ARTIST_FEATURING = re.compile(r",\s|\s[\(\[]?(feat\.?|ft\.?|featuring|with)\s")
+_NON_WORD = re.compile(r"[\W_]+")
+
+def _fold(text:str) -> str:
+    # casefolded, accents stripped: "Beyoncé" -> "beyonce"
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize("NFKD",text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def _is_version(suffix:str) -> bool:
+    return _VERSION_WORDS.search(suffix) is not None and _DISTINCT_WORDS.search(suffix) is None
+
+def _strip_bracketed_version(match:re.Match) -> str:
+    return " " if _is_version(match.group(1)) else match.group(0)
+
+def _strip_versions(text:str) -> str:
+    # substring checks skip the regexes for plain titles
+    if "(" in text or "[" in text:
+        text = _BRACKETED_FEATURING.sub(" ",text)
+        text = _BRACKETED.sub(_strip_bracketed_version,text)
+    if " - " in text:
+        # "Song - Part 2 - Remastered": only trailing parts naming the same recording go
+        parts = text.split(" - ")
+        while len(parts) > 1 and _is_version(parts[-1]):
+            parts.pop()
+        text = " - ".join(parts)
+    if "f" in text:
+        text = _TRAILING_FEATURING.sub("",text)
+    return text
+
+def _collapse(text:str) -> str:
+    return _NON_WORD.sub(" ",text).strip()
+
+def song_match_key(artist:str,title:str,album:str|None) -> str:
+    '''
+    normalized key used for dedupe;
+    casefolded, accent-stripped, without version suffixes and featured artists
+    '''
+    main_artist = _ARTIST_FEATURING.split(_fold(artist),maxsplit=1)[0]
+    return "\x1f".join((
+        _collapse(main_artist),
+        _collapse(_strip_versions(_fold(title))),
+        _collapse(_strip_versions(_fold(album or ""))),
+    ))
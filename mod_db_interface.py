@@ -1,10 +1,19 @@
 # Database Management for tracking songs that were recorded.
 
 # |--- Internal Imports
-from mod_data_representation import song_metadata
+from mod_data_representation import song_metadata,song_match_key
 
 # |--- External Imports
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+from itertools import islice
+import threading
+import queue
+import time
+import hashlib
 import sqlite3
+import math
+import sys
 import os
 
 # |--- Variables
@@ -15,16 +24,339 @@ SOURCES:list[str] = [
     "Soundcloud"
 ]
 
-def initialize_database(path_to_db:str) -> sqlite3.Connection:
+# pragmas applied to long-lived connections
+# WAL lets readers proceed while a song is being committed,
+# synchronous=NORMAL only fsyncs on checkpoints in WAL mode
+# negative cache_size is given in KiB -> 16 MiB page cache
+CONNECTION_PRAGMAS:dict[str,str] = {
+    "journal_mode":"WAL",
+    "synchronous":"NORMAL",
+    "cache_size":"-16000",
+    "temp_store":"MEMORY",
+}
+
+def initialize_database(path_to_db:str,check_same_thread:bool=True) -> sqlite3.Connection:
     if not os.path.isfile(path_to_db):
         # creating new db at given location
-        print(f"|- [DB Initialization] No Db found, creating new at {path_to_db}")
-        connection = sqlite3.connect(path_to_db)
+        print(f"|- [DB Initialization] No Db found, creating new at {path_to_db}",file=sys.stderr)
+        connection = sqlite3.connect(path_to_db,check_same_thread=check_same_thread)
         create_tables(connection)
     else:
-        connection = sqlite3.connect(path_to_db)
+        connection = sqlite3.connect(path_to_db,check_same_thread=check_same_thread)
+    migrate_database(connection)
     return connection
 
+def apply_pragmas(db:sqlite3.Connection,pragmas:dict[str,str]=CONNECTION_PRAGMAS):
+    cursor = db.cursor()
+    for name,value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value};")
+
+class ConnectionManager:
+    '''
+    process-wide owner of the connection to the recording-db.
+    opens the database once, applies CONNECTION_PRAGMAS
+    and hands out the connection to any thread (GLib-loop, RecordThreads)
+    while holding a lock, so statements of different threads do not interleave.
+
+    usage:
+        manager = ConnectionManager("songs.db")
+        with manager.connection() as db:
+            song_is_in_db(db,song)
+        manager.close()
+    '''
+    def __init__(self,path_to_db:str,recorded_songs:"RecordedSongSet|None"=None):
+        self.path_to_db = path_to_db
+        self._lock = threading.RLock()
+        self._connection:sqlite3.Connection|None = None
+        # optional background writer, see start_writer()
+        self.writer:SongWriter|None = None
+        # optional in-memory membership cache of songs
+        self.recorded_songs = recorded_songs
+        if self.recorded_songs is not None:
+            with self.connection() as db:
+                self.recorded_songs.load(db)
+
+    def _open(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = initialize_database(self.path_to_db,check_same_thread=False)
+            apply_pragmas(self._connection)
+        return self._connection
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            yield self._open()
+
+    def start_writer(self,batch_size:int=32,max_delay_ms:int=500):
+        '''
+        moves record_song() off the calling thread:
+        songs are queued and committed in groups by a SongWriter
+        '''
+        if self.writer is None:
+            self.writer = SongWriter(self,batch_size,max_delay_ms)
+            self.writer.start()
+
+    def close(self) -> list[tuple[song_metadata,str]]:
+        '''
+        flushes pending songs before closing the connection
+
+        returns the songs the writer failed to write, with their errors
+        '''
+        failed:list[tuple[song_metadata,str]] = []
+        if self.writer is not None:
+            failed = self.writer.stop()
+            self.writer = None
+            if failed:
+                print(f"|- [DB Writer] WARNING: {len(failed)} songs were not written")
+        with self._lock:
+            if self._connection is None:
+                return failed
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+        return failed
+
+    def song_is_recorded(self,song:song_metadata) -> bool:
+        '''
+        answers from recorded_songs if available,
+        only consulting the db for probabilistic positives.
+        songs queued in the writer count as recorded
+        '''
+        if self.writer is not None and self.writer.is_pending(song):
+            return True
+        if self.recorded_songs is None:
+            with self.connection() as db:
+                return song_is_in_db(db,song)
+        if not self.recorded_songs.might_contain(song):
+            return False
+        if not self.recorded_songs.is_probabilistic:
+            return True
+        with self.connection() as db:
+            return song_is_in_db(db,song)
+
+    def record_song(self,song:song_metadata):
+        if self.writer is not None:
+            self.writer.submit(song)
+            return
+        with self.connection() as db:
+            insert_new_song(db,song,self.recorded_songs)
+
+    def record_file(self,song:song_metadata,path:str,codec:str|None,duration_in_ms:float|None=None):
+        # recordings are rare (one per song), written directly; the hash follows with update_file
+        with self.connection() as db:
+            insert_recording(db,song,path,codec,duration_in_ms)
+
+    def update_file(self,path:str):
+        '''
+        stores size and content hash of a registered file once it is final (post processed);
+        the file is read before taking the lock
+        '''
+        row = (os.path.realpath(path),os.path.getsize(path),hash_file(path))
+        with self.connection() as db:
+            update_recording_files(db,[row])
+
+    def move_file(self,old_path:str,new_path:str):
+        with self.connection() as db:
+            move_recording(db,old_path,new_path)
+
+# |----------
+# |------ BACKGROUND WRITER
+
+class SongWriter(threading.Thread):
+    '''
+    commits queued songs in groups: one transaction per batch_size songs
+    or after max_delay_ms, whichever comes first. a failing group is written song by song,
+    songs failing on their own are kept in `failed` and returned by stop().
+    keeps track of queued songs, so lookups can see them before they are committed
+    '''
+    _stop_marker = None
+
+    def __init__(self,manager:ConnectionManager,batch_size:int=32,max_delay_ms:int=500):
+        threading.Thread.__init__(self,name="SongWriter",daemon=True)
+        self.manager = manager
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._queue:queue.Queue[song_metadata|None] = queue.Queue()
+        self._pending:dict[tuple,int] = {}
+        self._pending_lock = threading.Lock()
+        # (song, error) of songs that could not be written
+        self.failed:list[tuple[song_metadata,str]] = []
+
+    @staticmethod
+    def _keys(song:song_metadata) -> list[tuple]:
+        # same equalities song_is_in_db uses
+        keys:list[tuple] = [("match_key",song_match_key(song.artist,song.title,song.album))]
+        if song.track_id is not None:
+            keys.append(("uri",song.track_id))
+        return keys
+
+    def submit(self,song:song_metadata):
+        with self._pending_lock:
+            for key in self._keys(song):
+                self._pending[key] = self._pending.get(key,0) + 1
+        self._queue.put(song)
+
+    def is_pending(self,song:song_metadata) -> bool:
+        with self._pending_lock:
+            return any(key in self._pending for key in self._keys(song))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self) -> list[tuple[song_metadata,str]]:
+        '''
+        writes the queued songs and ends the thread
+
+        returns the songs that could not be written, with their errors
+        '''
+        self._queue.put(self._stop_marker)
+        self.join()
+        # left behind if the thread ended before reaching the marker
+        leftover = []
+        while True:
+            try:
+                song = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if song is not self._stop_marker:
+                leftover.append(song)
+        if leftover:
+            self._flush(leftover)
+        return list(self.failed)
+
+    def run(self):
+        is_stopping = False
+        while not is_stopping:
+            first_song = self._queue.get()
+            if first_song is self._stop_marker:
+                break
+            batch = [first_song]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.batch_size:
+                try:
+                    song = self._queue.get(timeout=max(0,deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if song is self._stop_marker:
+                    is_stopping = True
+                    break
+                batch.append(song)
+            self._flush(batch)
+
+    def _flush(self,batch:list[song_metadata]):
+        try:
+            self._write(batch)
+        except Exception as e:
+            # the writer has to outlive any batch, otherwise queued songs are never written
+            print(f"|- [DB Writer] WARNING: failed writing {len(batch)} songs: {e}")
+            self.failed.extend((song,str(e)) for song in batch)
+        finally:
+            with self._pending_lock:
+                for song in batch:
+                    for key in self._keys(song):
+                        self._pending[key] -= 1
+                        if self._pending[key] == 0:
+                            del self._pending[key]
+
+    def _write_each(self,batch:list[song_metadata]) -> list[song_metadata]:
+        # one transaction per song, a bad song only costs itself
+        written = []
+        for song in batch:
+            try:
+                with self.manager.connection() as db:
+                    try:
+                        insert_new_song(db,song)
+                    except Exception:
+                        db.rollback()
+                        raise
+                written.append(song)
+            except Exception as e:
+                print(f"|- [DB Writer] WARNING: failed writing {song.artist} - {song.title}: {e}")
+                self.failed.append((song,str(e)))
+        return written
+
+    def _write(self,batch:list[song_metadata]):
+        try:
+            with self.manager.connection() as db:
+                insert_songs_bulk(db,batch)
+            written = batch
+        except Exception as e:
+            print(f"|- [DB Writer] WARNING: failed writing {len(batch)} songs at once ({e}), writing them one by one")
+            written = self._write_each(batch)
+        if self.manager.recorded_songs is not None:
+            for song in written:
+                self.manager.recorded_songs.add(song)
+
+# |----------
+# |------ IN-MEMORY DEDUPE
+
+def _song_keys(match_key:str,track_uri:str|None) -> list[str]:
+    keys = [match_key]
+    if track_uri is not None:
+        keys.append(f"uri\x1e{track_uri}")
+    return keys
+
+class BloomFilter:
+    '''
+    fixed size bloom filter over strings;
+    sized for expected_items at the given false_positive_rate
+    '''
+    def __init__(self,expected_items:int,false_positive_rate:float=0.001):
+        expected_items = max(expected_items,1)
+        self.size_in_bits = max(8,int(-expected_items * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.amount_hashes = max(1,round(self.size_in_bits / expected_items * math.log(2)))
+        self.bits = bytearray((self.size_in_bits + 7) // 8)
+
+    def _positions(self,key:str) -> Iterator[int]:
+        # double hashing: h1 + i*h2 derived from one 128 bit digest
+        digest = hashlib.blake2b(key.encode(),digest_size=16).digest()
+        hash_1 = int.from_bytes(digest[:8],"little")
+        hash_2 = int.from_bytes(digest[8:],"little") | 1
+        for index in range(self.amount_hashes):
+            yield (hash_1 + index * hash_2) % self.size_in_bits
+
+    def add(self,key:str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self,key:str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RecordedSongSet:
+    '''
+    in-process membership structure of recorded songs keyed by
+    match_key and track_uri, bulk-loaded from `songs` and updated on insertion.
+    with use_bloom_filter positives have to be confirmed by the db.
+    '''
+    def __init__(self,use_bloom_filter:bool=False,false_positive_rate:float=0.001):
+        self.is_probabilistic = use_bloom_filter
+        self.false_positive_rate = false_positive_rate
+        self._keys:set[str]|BloomFilter = set()
+        self._lock = threading.Lock()
+
+    def load(self,db:sqlite3.Connection):
+        cursor = db.cursor()
+        cursor.execute("SELECT match_key, track_uri FROM songs;")
+        if self.is_probabilistic:
+            amount_keys = db.execute("SELECT COUNT(*) + COUNT(track_uri) FROM songs;").fetchone()[0]
+            # leave room for songs recorded during the session
+            keys = BloomFilter(max(2 * amount_keys,100_000),self.false_positive_rate)
+            for row in cursor:
+                for key in _song_keys(*row):
+                    keys.add(key)
+        else:
+            keys = {key for row in cursor for key in _song_keys(*row)}
+        with self._lock:
+            self._keys = keys
+
+    def add(self,song:song_metadata):
+        with self._lock:
+            for key in _song_keys(song_match_key(song.artist,song.title,song.album),song.track_id):
+                self._keys.add(key)
+
+    def might_contain(self,song:song_metadata) -> bool:
+        return any(key in self._keys for key in _song_keys(song_match_key(song.artist,song.title,song.album),song.track_id))
+
         
 def insert_sources(db:sqlite3.Connection):
     cursor = db.cursor()
@@ -36,7 +368,7 @@ def insert_sources(db:sqlite3.Connection):
 def create_tables(connection:sqlite3.Connection):
     cursor = connection.cursor()
     # creating table for artists 
-    print("|-  [DB Initialization] adding artists")
+    print("|-  [DB Initialization] adding artists",file=sys.stderr)
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS artists (
                    id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,7 +377,7 @@ def create_tables(connection:sqlite3.Connection):
                    """)
     
     # creating table for download-source
-    print("|-  [DB Initialization] adding sources")
+    print("|-  [DB Initialization] adding sources",file=sys.stderr)
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS sources (
                    id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -53,7 +385,7 @@ def create_tables(connection:sqlite3.Connection):
                    );
                    """)
     insert_sources(connection)
-    print("|-  [DB Initialization] adding songs")
+    print("|-  [DB Initialization] adding songs",file=sys.stderr)
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS songs (
                    id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -67,6 +399,188 @@ def create_tables(connection:sqlite3.Connection):
                    """)
     connection.commit()
 
+# |----------
+# |------ MIGRATIONS
+# each entry upgrades the schema by one version, the current version
+# is stored in `PRAGMA user_version`; entries are only ever appended
+
+def _migration_songs_lookup_index(db:sqlite3.Connection):
+    # backed song_is_in_db before it looked up match_key, dropped again in version 10
+    db.execute("CREATE INDEX IF NOT EXISTS idx_songs_artist_title_album ON songs (artist_id, title, album);")
+
+def _migration_songs_track_uri(db:sqlite3.Connection):
+    # identifier given by the source, e.g. the MPRIS trackid of Spotify
+    columns = [row[1] for row in db.execute("PRAGMA table_info(songs);")]
+    if "track_uri" not in columns:
+        db.execute("ALTER TABLE songs ADD COLUMN track_uri TEXT;")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_songs_track_uri ON songs (track_uri);")
+
+def _migration_songs_match_key(db:sqlite3.Connection):
+    # see mod_data_representation.song_match_key
+    columns = [row[1] for row in db.execute("PRAGMA table_info(songs);")]
+    if "match_key" not in columns:
+        db.execute("ALTER TABLE songs ADD COLUMN match_key TEXT;")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_songs_match_key ON songs (match_key);")
+    backfill_match_keys(db)
+
+def _migration_songs_fts(db:sqlite3.Connection):
+    # full text index over title, album and artist name, rowid = songs.id
+    # kept in sync by triggers on songs and artists
+    try:
+        db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(
+                   title, album, artist,
+                   tokenize = 'unicode61 remove_diacritics 2'
+                   );
+                   """)
+    except sqlite3.OperationalError as e:
+        print(f"|-  [DB Migration] WARNING: full text search unavailable ({e}), skipping",file=sys.stderr)
+        return
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS songs_fts_insert AFTER INSERT ON songs BEGIN
+        INSERT INTO songs_fts (rowid, title, album, artist)
+        VALUES (new.id, new.title, new.album, (SELECT name FROM artists WHERE id = new.artist_id));
+    END;
+               """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS songs_fts_delete AFTER DELETE ON songs BEGIN
+        DELETE FROM songs_fts WHERE rowid = old.id;
+    END;
+               """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS songs_fts_update AFTER UPDATE OF title, album, artist_id ON songs BEGIN
+        DELETE FROM songs_fts WHERE rowid = old.id;
+        INSERT INTO songs_fts (rowid, title, album, artist)
+        VALUES (new.id, new.title, new.album, (SELECT name FROM artists WHERE id = new.artist_id));
+    END;
+               """)
+    db.execute("""
+    CREATE TRIGGER IF NOT EXISTS artists_fts_update AFTER UPDATE OF name ON artists BEGIN
+        UPDATE songs_fts SET artist = new.name
+        WHERE rowid IN (SELECT id FROM songs WHERE artist_id = new.id);
+    END;
+               """)
+    db.execute("DELETE FROM songs_fts;")
+    db.execute("""
+    INSERT INTO songs_fts (rowid, title, album, artist)
+    SELECT songs.id, songs.title, songs.album, artists.name FROM songs
+    JOIN artists ON artists.id = songs.artist_id;
+               """)
+
+def _migration_scan_cache(db:sqlite3.Connection):
+    # files of the music collection parsed before, see update_scan_cache
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS scan_cache (
+                   path TEXT PRIMARY KEY,
+                   mtime_ns INTEGER NOT NULL,
+                   size INTEGER NOT NULL,
+                   inode INTEGER NOT NULL,
+                   artist TEXT,
+                   title TEXT,
+                   album TEXT,
+                   track_id TEXT,
+                   song_length_in_ms REAL
+                   ) WITHOUT ROWID;
+                   """)
+
+def _migration_scan_cache_match_key(db:sqlite3.Connection):
+    # finds songs that no file of the collection holds anymore, see remove_orphaned_songs
+    columns = [row[1] for row in db.execute("PRAGMA table_info(scan_cache);")]
+    if "match_key" not in columns:
+        db.execute("ALTER TABLE scan_cache ADD COLUMN match_key TEXT;")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_scan_cache_match_key ON scan_cache (match_key);")
+    rows = db.execute("SELECT path, artist, title, album FROM scan_cache WHERE title IS NOT NULL AND artist IS NOT NULL;").fetchall()
+    db.executemany("UPDATE scan_cache SET match_key = ? WHERE path = ?;",
+                   ((song_match_key(artist,title,album),path) for path,artist,title,album in rows))
+
+def _migration_recordings(db:sqlite3.Connection):
+    # files written by SpotRec; song_id may stay NULL until the song is inserted,
+    # link_recordings resolves it through match_key
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS recordings (
+                   id INTEGER PRIMARY KEY AUTOINCREMENT,
+                   song_id INTEGER REFERENCES songs(id),
+                   match_key TEXT,
+                   path TEXT NOT NULL UNIQUE,
+                   size INTEGER NOT NULL,
+                   duration_in_ms REAL,
+                   codec TEXT,
+                   content_hash TEXT,
+                   recorded_at INTEGER NOT NULL
+                   );
+                   """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recordings_song_id ON recordings (song_id);")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_recordings_match_key ON recordings (match_key);")
+
+def _migration_songs_duration(db:sqlite3.Connection):
+    # length of the track as reported by the player (mpris:length) or read from the file
+    columns = [row[1] for row in db.execute("PRAGMA table_info(songs);")]
+    if "duration_in_ms" not in columns:
+        db.execute("ALTER TABLE songs ADD COLUMN duration_in_ms INTEGER;")
+    db.execute("""
+    UPDATE songs SET duration_in_ms = (
+        SELECT CAST(ROUND(song_length_in_ms) AS INTEGER) FROM scan_cache
+        WHERE scan_cache.match_key = songs.match_key AND song_length_in_ms IS NOT NULL LIMIT 1)
+    WHERE duration_in_ms IS NULL;
+               """)
+
+def _migration_rekey_match_keys(db:sqlite3.Connection):
+    # song_match_key keeps live / remix suffixes and splits artists only on featuring markers and ", " now,
+    # keys stored before are recomputed; recordings of a known song follow its key
+    backfill_match_keys(db,only_missing=False)
+    rows = db.execute("SELECT path, artist, title, album FROM scan_cache WHERE title IS NOT NULL AND artist IS NOT NULL;").fetchall()
+    db.executemany("UPDATE scan_cache SET match_key = ? WHERE path = ?;",
+                   ((song_match_key(artist,title,album),path) for path,artist,title,album in rows))
+    db.execute("""
+    UPDATE recordings SET match_key = (SELECT match_key FROM songs WHERE songs.id = recordings.song_id)
+    WHERE song_id IS NOT NULL;
+               """)
+
+def _migration_drop_songs_lookup_index(db:sqlite3.Connection):
+    # lookups go through idx_songs_match_key / idx_songs_track_uri, the index only cost time on every insert
+    db.execute("DROP INDEX IF EXISTS idx_songs_artist_title_album;")
+
+SCHEMA_MIGRATIONS = [
+    _migration_songs_lookup_index,
+    _migration_songs_track_uri,
+    _migration_songs_match_key,
+    _migration_songs_fts,
+    _migration_scan_cache,
+    _migration_scan_cache_match_key,
+    _migration_recordings,
+    _migration_songs_duration,
+    _migration_rekey_match_keys,
+    _migration_drop_songs_lookup_index,
+]
+
+def migrate_database(db:sqlite3.Connection):
+    current_version = db.execute("PRAGMA user_version;").fetchone()[0]
+    for version in range(current_version,len(SCHEMA_MIGRATIONS)):
+        print(f"|-  [DB Migration] upgrading schema to version {version + 1}",file=sys.stderr)
+        with db:
+            SCHEMA_MIGRATIONS[version](db)
+            db.execute(f"PRAGMA user_version = {version + 1};")
+
+def backfill_match_keys(db:sqlite3.Connection,only_missing:bool=True,chunk_size:int=5000) -> int:
+    '''
+    computes songs.match_key for rows that lack one,
+    or for all rows (e.g. after song_match_key changed)
+
+    returns amount of updated rows
+    '''
+    query = """SELECT songs.id, artists.name, songs.title, songs.album FROM songs
+               JOIN artists ON artists.id = songs.artist_id"""
+    if only_missing:
+        query += " WHERE songs.match_key IS NULL"
+    # rows are fetched completely first, updating while iterating the same table is unsafe
+    rows = db.execute(query + ";").fetchall()
+    cursor = db.cursor()
+    for offset in range(0,len(rows),chunk_size):
+        cursor.executemany("UPDATE songs SET match_key = ? WHERE id = ?;",
+                           ((song_match_key(artist,title,album),song_id) for song_id,artist,title,album in rows[offset:offset + chunk_size]))
+    db.commit()
+    return len(rows)
+
 def query_artist_id(db:sqlite3.Connection,artist:str) -> int|None:
     cursor = db.cursor()
     cursor.execute("SELECT id FROM artists WHERE name = ?;",(artist,))
@@ -105,15 +619,32 @@ def query_source_name(db:sqlite3.Connection,source_id:int) -> str|None:
     return result[0] if result else None
 
 def song_is_in_db(db:sqlite3.Connection,song:song_metadata) -> bool:
-    maybe_artist_id = query_artist_id(db,song.artist)
-    if maybe_artist_id is None: 
-        # assumes no song has been saved then
-        return False
     cursor = db.cursor()
-    cursor.execute("SELECT artist_id,title,album,source_id  FROM songs WHERE title = ? AND album = ? AND artist_id = ?;",(song.title,song.album,maybe_artist_id,))
+    if song.track_id is not None:
+        # exact match on idx_songs_track_uri, unaffected by changed titles
+        cursor.execute("SELECT 1 FROM songs WHERE track_uri = ?;",(song.track_id,))
+        if cursor.fetchone():
+            return True
+    # songs stored without id (e.g. before track_uri existed) are matched by text,
+    # normalized to song_match_key -> single lookup on idx_songs_match_key
+    cursor.execute("SELECT 1 FROM songs WHERE match_key = ? LIMIT 1;",
+                   (song_match_key(song.artist,song.title,song.album),))
     result = cursor.fetchone()
     return True if result else False
 
+def search_songs(db:sqlite3.Connection,fts_query:str) -> sqlite3.Cursor:
+    '''
+    full text search over songs_fts, fts_query uses the FTS5 query syntax.
+    returns a cursor yielding (title,artist,album,source) ordered by rank
+    '''
+    cursor = db.cursor()
+    cursor.execute("""SELECT songs_fts.title, songs_fts.artist, songs_fts.album, sources.name FROM songs_fts
+                   JOIN songs ON songs.id = songs_fts.rowid
+                   JOIN sources ON sources.id = songs.source_id
+                   WHERE songs_fts MATCH ?
+                   ORDER BY rank;""",(fts_query,))
+    return cursor
+
 
 # |----------
 # |------ INSERTION 
@@ -123,10 +654,16 @@ def insert_new_artist(db:sqlite3.Connection, artist_name:str):
     cursor.execute("INSERT OR IGNORE INTO artists (name) VALUES (?);",(artist_name,))
     db.commit()
 
-def insert_new_song(db:sqlite3.Connection,song:song_metadata):
+def _duration(song:song_metadata) -> int|None:
+    # lengths read from files are fractional
+    return round(song.song_length_in_ms) if song.song_length_in_ms is not None else None
+
+def insert_new_song(db:sqlite3.Connection,song:song_metadata,recorded_songs:RecordedSongSet|None=None):
     if song_is_in_db(db,song):
         # aborting 
         print("|- [entry, already exists, skipping]")
+        if recorded_songs is not None:
+            recorded_songs.add(song)
         return
     maybe_artist = query_artist_id(db,song.artist)
     if maybe_artist is None:
@@ -141,14 +678,399 @@ def insert_new_song(db:sqlite3.Connection,song:song_metadata):
 
     cursor = db.cursor()
     cursor.execute("""
-    INSERT INTO songs (artist_id, title, album, source_id) VALUES (?,?,?,?);
+    INSERT INTO songs (artist_id, title, album, source_id, track_uri, match_key, duration_in_ms) VALUES (?,?,?,?,?,?,?);
                    """, (
                        maybe_artist,
                        song.title,
                        song.album,
                        maybe_source,
+                       song.track_id,
+                       song_match_key(song.artist,song.title,song.album),
+                       _duration(song),
                    ))
     db.commit()
+    if recorded_songs is not None:
+        recorded_songs.add(song)
+
+def insert_songs_bulk(db:sqlite3.Connection,songs:Iterable[song_metadata],chunk_size:int=5000) -> tuple[int,int]:
+    '''
+    inserts many songs within one transaction using set-based statements:
+    songs are staged chunk-wise in a temp table, artists are upserted in one
+    statement per chunk and only songs missing in `songs` are copied over.
+    songs without artist, title or album are skipped.
+
+    returns (inserted,skipped)
+    '''
+    source_ids:dict[str,int] = dict(db.execute("SELECT name, id FROM sources;").fetchall())
+    default_source_id = source_ids[SOURCES[1]]
+    amount_inserted = 0
+    amount_skipped = 0
+    song_iterator = iter(songs)
+
+    cursor = db.cursor()
+    cursor.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS bulk_songs (
+                   artist TEXT NOT NULL,
+                   title TEXT NOT NULL,
+                   album TEXT NOT NULL,
+                   source_id INTEGER NOT NULL,
+                   track_uri TEXT,
+                   match_key TEXT NOT NULL,
+                   duration_in_ms INTEGER
+                   );
+                   """)
+    try:
+        while chunk := list(islice(song_iterator,chunk_size)):
+            staged = []
+            for song in chunk:
+                if not song.artist or not song.title or song.album is None:
+                    amount_skipped += 1
+                    continue
+                source_id = source_ids.get(song.source)
+                if source_id is None:
+                    print(f"|- [DB Insertion] WARNING: unknown Source {song.source}; defaulting to 'YouTube'")
+                    # warn only once per unknown source
+                    source_id = source_ids[song.source] = default_source_id
+                staged.append((song.artist,song.title,song.album,source_id,song.track_id,
+                               song_match_key(song.artist,song.title,song.album),_duration(song)))
+
+            cursor.execute("DELETE FROM bulk_songs;")
+            cursor.executemany("INSERT INTO bulk_songs (artist, title, album, source_id, track_uri, match_key, duration_in_ms) VALUES (?,?,?,?,?,?,?);",staged)
+            cursor.execute("INSERT OR IGNORE INTO artists (name) SELECT DISTINCT artist FROM bulk_songs;")
+            # first occurrence of a match_key within the chunk wins,
+            # OR IGNORE drops rows whose track_uri is taken within the chunk
+            cursor.execute("""
+            INSERT OR IGNORE INTO songs (artist_id, title, album, source_id, track_uri, match_key, duration_in_ms)
+            SELECT artists.id, bulk_songs.title, bulk_songs.album, bulk_songs.source_id, bulk_songs.track_uri, bulk_songs.match_key, bulk_songs.duration_in_ms
+            FROM bulk_songs JOIN artists ON artists.name = bulk_songs.artist
+            WHERE bulk_songs.rowid IN (SELECT MIN(rowid) FROM bulk_songs GROUP BY match_key)
+            AND NOT EXISTS (
+                SELECT 1 FROM songs WHERE songs.match_key = bulk_songs.match_key
+            ) AND (bulk_songs.track_uri IS NULL OR NOT EXISTS (
+                SELECT 1 FROM songs WHERE songs.track_uri = bulk_songs.track_uri
+            ));
+                           """)
+            amount_inserted += cursor.rowcount
+            amount_skipped += len(staged) - cursor.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.bulk_songs;")
+    return amount_inserted,amount_skipped
+
+def _end_temp_transaction(db:sqlite3.Connection,was_in_transaction:bool):
+    # writing to a temp table opens an implicit transaction; ended here unless the caller had one open
+    if not was_in_transaction and db.in_transaction:
+        db.commit()
+
+def diff_songs_against_db(db:sqlite3.Connection,songs:Iterable[song_metadata]) -> tuple[list[song_metadata],list[song_metadata]]:
+    '''
+    splits songs into (new, known) with one set-based query instead of a lookup per song:
+    a song is known if its match_key or track_uri is in `songs` already,
+    repeated songs of the input count as known after their first occurrence.
+    songs without artist, title or album are left out, like in insert_songs_bulk.
+    '''
+    candidates = [song for song in songs if song.artist and song.title and song.album is not None]
+    was_in_transaction = db.in_transaction
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS diff_songs (match_key TEXT NOT NULL, track_uri TEXT);")
+    try:
+        cursor.execute("DELETE FROM diff_songs;")
+        # rowid - 1 is the position in candidates
+        cursor.executemany("INSERT INTO diff_songs (rowid, match_key, track_uri) VALUES (?,?,?);",
+                           ((position + 1,song_match_key(song.artist,song.title,song.album),song.track_id)
+                            for position,song in enumerate(candidates)))
+        new_rows = {row[0] for row in cursor.execute("""
+        SELECT diff_songs.rowid FROM diff_songs
+        WHERE diff_songs.rowid IN (SELECT MIN(rowid) FROM diff_songs GROUP BY match_key)
+        AND NOT EXISTS (
+            SELECT 1 FROM songs WHERE songs.match_key = diff_songs.match_key
+        ) AND (diff_songs.track_uri IS NULL OR NOT EXISTS (
+            SELECT 1 FROM songs WHERE songs.track_uri = diff_songs.track_uri
+        ));
+                                                     """)}
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.diff_songs;")
+        _end_temp_transaction(db,was_in_transaction)
+    new_songs = [song for position,song in enumerate(candidates) if position + 1 in new_rows]
+    known_songs = [song for position,song in enumerate(candidates) if position + 1 not in new_rows]
+    return new_songs,known_songs
+
+
+# |----------
+# |------ RECORDINGS
+# links songs to the files SpotRec wrote, see tool_reconcile_recordings
+
+def hash_file(path:str,chunk_size:int=1 << 20) -> str:
+    '''
+    blake2b of the file content (hex, 128 bit)
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path,"rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def insert_recording(db:sqlite3.Connection,song:song_metadata|None,path:str,codec:str|None,
+                     duration_in_ms:float|None=None,content_hash:str|None=None,recorded_at:int|None=None):
+    '''
+    registers the file at path; size and time are taken from the file if not given.
+    the content hash stays NULL unless given (reading the file would block the db),
+    see ConnectionManager.update_file and hash_missing_recordings.
+    song_id is set if the song is in the db already (by track_uri or match_key)
+    '''
+    # resolved like the paths of the collection walk, so both compare equal
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    match_key = song_match_key(song.artist,song.title,song.album) if song is not None and song.artist and song.title else None
+    track_uri = song.track_id if song is not None else None
+    db.execute("""
+    INSERT OR REPLACE INTO recordings (song_id, match_key, path, size, duration_in_ms, codec, content_hash, recorded_at)
+    VALUES (COALESCE((SELECT id FROM songs WHERE track_uri = ?1),(SELECT id FROM songs WHERE match_key = ?2 LIMIT 1)),
+            ?2,?3,?4,?5,?6,?7,?8);
+               """,(track_uri,match_key,path,stat.st_size,duration_in_ms,codec,content_hash,
+                     recorded_at if recorded_at is not None else int(stat.st_mtime)))
+    db.commit()
+
+def move_recording(db:sqlite3.Connection,old_path:str,new_path:str):
+    db.execute("UPDATE recordings SET path = ? WHERE path = ?;",(os.path.realpath(new_path),os.path.realpath(old_path)))
+    db.commit()
+
+def link_recordings(db:sqlite3.Connection) -> int:
+    '''
+    sets song_id of recordings that were registered before their song was inserted
+
+    returns amount of linked recordings
+    '''
+    cursor = db.execute("""
+    UPDATE recordings SET song_id = (SELECT id FROM songs WHERE songs.match_key = recordings.match_key LIMIT 1)
+    WHERE song_id IS NULL AND match_key IS NOT NULL
+    AND EXISTS (SELECT 1 FROM songs WHERE songs.match_key = recordings.match_key);
+                        """)
+    db.commit()
+    return cursor.rowcount
+
+def diff_recordings(db:sqlite3.Connection,file_stats:Iterable[tuple[str,int|None]]) -> tuple[list[str],list[str]]:
+    '''
+    compares (path,size) of registered files with the recordings, size None for missing files.
+
+    returns (paths of missing files, paths of files whose size changed)
+    '''
+    was_in_transaction = db.in_transaction
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS recording_files (path TEXT PRIMARY KEY, size INTEGER) WITHOUT ROWID;")
+    try:
+        cursor.execute("DELETE FROM recording_files;")
+        cursor.executemany("INSERT OR REPLACE INTO recording_files (path, size) VALUES (?,?);",file_stats)
+        missing = [row[0] for row in cursor.execute("""
+        SELECT recordings.path FROM recordings
+        LEFT JOIN recording_files ON recording_files.path = recordings.path
+        WHERE recording_files.size IS NULL ORDER BY recordings.path;
+                                                   """)]
+        changed = [row[0] for row in cursor.execute("""
+        SELECT recordings.path FROM recordings
+        JOIN recording_files ON recording_files.path = recordings.path
+        WHERE recording_files.size != recordings.size ORDER BY recordings.path;
+                                                   """)]
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.recording_files;")
+        _end_temp_transaction(db,was_in_transaction)
+    return missing,changed
+
+def unregistered_files(db:sqlite3.Connection,paths:Iterable[str]) -> list[str]:
+    '''
+    paths without a recording
+    '''
+    was_in_transaction = db.in_transaction
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS found_files (path TEXT PRIMARY KEY) WITHOUT ROWID;")
+    try:
+        cursor.execute("DELETE FROM found_files;")
+        cursor.executemany("INSERT OR IGNORE INTO found_files (path) VALUES (?);",((path,) for path in paths))
+        unregistered = [row[0] for row in cursor.execute("""
+        SELECT path FROM found_files WHERE path NOT IN (SELECT path FROM recordings) ORDER BY path;
+                                                        """)]
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.found_files;")
+        _end_temp_transaction(db,was_in_transaction)
+    return unregistered
+
+def remove_recordings(db:sqlite3.Connection,paths:Iterable[str]) -> list[str]:
+    '''
+    drops the recordings of paths in one transaction
+
+    returns their match keys
+    '''
+    was_in_transaction = db.in_transaction
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS removed_files (path TEXT PRIMARY KEY) WITHOUT ROWID;")
+    try:
+        cursor.execute("DELETE FROM removed_files;")
+        cursor.executemany("INSERT OR IGNORE INTO removed_files (path) VALUES (?);",((path,) for path in paths))
+        removed_keys = [row[0] for row in cursor.execute("""
+        SELECT match_key FROM recordings WHERE path IN (SELECT path FROM removed_files) AND match_key IS NOT NULL;
+                                                        """)]
+        cursor.execute("DELETE FROM recordings WHERE path IN (SELECT path FROM removed_files);")
+        db.commit()
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.removed_files;")
+        _end_temp_transaction(db,was_in_transaction)
+    return removed_keys
+
+def update_recording_files(db:sqlite3.Connection,rows:Iterable[tuple[str,int,str|None]]):
+    '''
+    stores (path,size,content_hash) of changed files
+    '''
+    db.executemany("UPDATE recordings SET size = ?2, content_hash = ?3 WHERE path = ?1;",rows)
+    db.commit()
+
+
+# |----------
+# |------ SCAN CACHE
+# remembers (path, mtime_ns, size, inode) and the extracted metadata of collection files,
+# so re-scans only parse new or changed files
+
+def _prefix_range(dir_path:str) -> tuple[str,str]:
+    # all paths below dir_path sort between "dir/" and "dir0" ("0" follows "/"), lets the primary key seek
+    prefix = os.path.join(dir_path,"")
+    return prefix,prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def count_scan_cache(db:sqlite3.Connection,root_path:str) -> int:
+    '''
+    amount of cached files below root_path
+    '''
+    return db.execute("SELECT COUNT(*) FROM scan_cache WHERE path > ? AND path < ?;",_prefix_range(root_path)).fetchone()[0]
+
+def diff_scan_cache(db:sqlite3.Connection,file_stats:Iterable[tuple[str,int,int,int]],root_path:str|None) -> tuple[list[str],int,list[str]]:
+    '''
+    compares the (path,mtime_ns,size,inode) of all files found below root_path
+    with the cache and drops cache entries of files that no longer exist.
+    without root_path only the given files are compared, nothing is dropped.
+
+    returns (new or changed paths, amount of unchanged files, match keys of removed entries)
+    '''
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS scan_files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, inode INTEGER) WITHOUT ROWID;")
+    try:
+        cursor.execute("DELETE FROM scan_files;")
+        cursor.executemany("INSERT OR REPLACE INTO scan_files (path, mtime_ns, size, inode) VALUES (?,?,?,?);",file_stats)
+        changed = [row[0] for row in cursor.execute("""
+        SELECT scan_files.path FROM scan_files
+        LEFT JOIN scan_cache ON scan_cache.path = scan_files.path
+        WHERE scan_cache.path IS NULL
+        OR scan_cache.mtime_ns != scan_files.mtime_ns
+        OR scan_cache.size != scan_files.size
+        OR scan_cache.inode != scan_files.inode
+        ORDER BY scan_files.path;
+                                                   """)]
+        amount_files = cursor.execute("SELECT COUNT(*) FROM scan_files;").fetchone()[0]
+        removed_keys = []
+        if root_path is not None:
+            gone = """FROM scan_cache
+            WHERE path > ? AND path < ? AND path NOT IN (SELECT path FROM scan_files)"""
+            removed_keys = [row[0] for row in cursor.execute(f"SELECT match_key {gone};",_prefix_range(root_path))]
+            cursor.execute(f"DELETE {gone};",_prefix_range(root_path))
+        db.commit()
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.scan_files;")
+    return changed,amount_files - len(changed),[key for key in removed_keys if key is not None]
+
+def update_scan_cache(db:sqlite3.Connection,entries:Iterable[tuple[tuple[str,int,int,int],song_metadata|None]]) -> list[str]:
+    '''
+    stores ((path,mtime_ns,size,inode),metadata) of parsed files,
+    files without usable metadata are cached as well so they are not parsed again
+
+    returns match keys the updated files held before, if they changed (e.g. retagged files)
+    '''
+    rows = [
+        (*file_stat,*((metadata.artist,metadata.title,metadata.album,metadata.track_id,metadata.song_length_in_ms,
+                       song_match_key(metadata.artist,metadata.title,metadata.album))
+                      if metadata else (None,) * 6))
+        for file_stat,metadata in entries
+    ]
+    was_in_transaction = db.in_transaction
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS updated_files (path TEXT PRIMARY KEY, match_key TEXT) WITHOUT ROWID;")
+    try:
+        cursor.execute("DELETE FROM updated_files;")
+        cursor.executemany("INSERT OR REPLACE INTO updated_files (path, match_key) VALUES (?,?);",((row[0],row[-1]) for row in rows))
+        replaced_keys = [row[0] for row in cursor.execute("""
+        SELECT scan_cache.match_key FROM scan_cache
+        JOIN updated_files ON updated_files.path = scan_cache.path
+        WHERE scan_cache.match_key IS NOT NULL AND scan_cache.match_key IS NOT updated_files.match_key;
+                                                          """)]
+        cursor.executemany("""
+        INSERT OR REPLACE INTO scan_cache (path, mtime_ns, size, inode, artist, title, album, track_id, song_length_in_ms, match_key)
+        VALUES (?,?,?,?,?,?,?,?,?,?);
+                       """,rows)
+        db.commit()
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.updated_files;")
+        _end_temp_transaction(db,was_in_transaction)
+    return replaced_keys
+
+def rename_in_scan_cache(db:sqlite3.Connection,renames:Iterable[tuple[str,str]]) -> list[str]:
+    '''
+    moves the cache entries of renamed files or folders (old_path,new_path) in order,
+    in one transaction; no file is parsed again.
+
+    returns match keys of entries that were overwritten by the moves
+    '''
+    cursor = db.cursor()
+    replaced_keys = []
+    for old_path,new_path in renames:
+        old_prefix,old_upper = _prefix_range(old_path)
+        replaced_keys += [row[0] for row in cursor.execute("SELECT match_key FROM scan_cache WHERE path = ?;",(new_path,))]
+        cursor.execute("DELETE FROM scan_cache WHERE path = ?;",(new_path,))
+        cursor.execute("UPDATE scan_cache SET path = ? WHERE path = ?;",(new_path,old_path))
+        cursor.execute("UPDATE scan_cache SET path = ? || substr(path, ?) WHERE path > ? AND path < ?;",
+                       (os.path.join(new_path,""),len(old_prefix) + 1,old_prefix,old_upper))
+    db.commit()
+    return [key for key in replaced_keys if key is not None]
+
+def remove_from_scan_cache(db:sqlite3.Connection,paths:Iterable[str]) -> list[str]:
+    '''
+    drops the cache entries of files and of everything below folders, in one transaction
+
+    returns their match keys
+    '''
+    cursor = db.cursor()
+    removed_keys = []
+    for path in paths:
+        below = (path,*_prefix_range(path))
+        removed_keys += [row[0] for row in cursor.execute("SELECT match_key FROM scan_cache WHERE path = ? OR (path > ? AND path < ?);",below)]
+        cursor.execute("DELETE FROM scan_cache WHERE path = ? OR (path > ? AND path < ?);",below)
+    db.commit()
+    return [key for key in removed_keys if key is not None]
+
+def remove_orphaned_songs(db:sqlite3.Connection,match_keys:Iterable[str]) -> int:
+    '''
+    deletes songs with one of match_keys that neither a cached collection file
+    nor a recording holds anymore, e.g. after files were deleted or retagged
+
+    returns amount of deleted songs
+    '''
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS orphan_keys (match_key TEXT PRIMARY KEY) WITHOUT ROWID;")
+    try:
+        cursor.execute("DELETE FROM orphan_keys;")
+        cursor.executemany("INSERT OR IGNORE INTO orphan_keys (match_key) VALUES (?);",((key,) for key in match_keys))
+        cursor.execute("""
+        DELETE FROM songs WHERE match_key IN (
+            SELECT match_key FROM orphan_keys
+            WHERE NOT EXISTS (SELECT 1 FROM scan_cache WHERE scan_cache.match_key = orphan_keys.match_key)
+            AND NOT EXISTS (SELECT 1 FROM recordings WHERE recordings.match_key = orphan_keys.match_key));
+                       """)
+        amount_deleted = cursor.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.orphan_keys;")
+    return amount_deleted
 
 
 # --- EXTRACT TO MODULE 
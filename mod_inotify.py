@@ -0,0 +1,90 @@
+# |-- Minimal inotify binding (Linux) via ctypes, no dependencies
+# used to follow changes of the music collection, see tool_watch_library
+
+# External Imports
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from typing import NamedTuple
+
+# |--- event masks, see inotify(7)
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR       = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC  = os.O_CLOEXEC
+
+# wd, mask, cookie, length of name
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class inotify_event(NamedTuple):
+    wd:int
+    mask:int
+    cookie:int
+    name:str
+
+
+class Inotify:
+    '''
+    one inotify instance; watches are added per directory (inotify is not recursive)
+    '''
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"),use_errno=True)
+        self._libc.inotify_add_watch.argtypes = (ctypes.c_int,ctypes.c_char_p,ctypes.c_uint32)
+        self._libc.inotify_rm_watch.argtypes = (ctypes.c_int,ctypes.c_int)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno,f"inotify_init1: {os.strerror(errno)}")
+
+    def add_watch(self,path:str,mask:int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd,os.fsencode(path),mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno,f"inotify_add_watch: {os.strerror(errno)}",path)
+        return wd
+
+    def rm_watch(self,wd:int):
+        # fails if the kernel dropped the watch already (IN_IGNORED)
+        self._libc.inotify_rm_watch(self.fd,wd)
+
+    def read_events(self,timeout_s:float|None) -> list[inotify_event]:
+        '''
+        waits up to timeout_s for events and returns everything queued,
+        the kernel queue is drained completely so it does not overflow during bursts
+        '''
+        readable,_,_ = select.select([self.fd],[],[],timeout_s)
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd,64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd,mask,cookie,name_length = _EVENT_HEADER.unpack_from(buffer,offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + name_length].rstrip(b"\x00")
+                offset += name_length
+                events.append(inotify_event(wd,mask,cookie,os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,223 @@
+# |-- Persistent cache of MusicBrainz track-length lookups
+# answers (including "nothing found") are kept in a small sqlite file,
+# so reprocessing songs does not repeat requests under MusicBrainz's limit of 1 req/s
+
+# |--- Internal Imports
+from mod_data_representation import song_metadata
+
+# |--- External Imports
+from typing import Callable
+import threading
+import sqlite3
+import time
+import sys
+
+# |--- Variables
+DAY_IN_S:int = 24 * 60 * 60
+
+
+def normalize_name(text:str|None) -> str:
+    return " ".join(text.casefold().split()) if text else ""
+
+def id_key(track_id:str) -> str:
+    return f"id:{track_id.strip().lower()}"
+
+def search_key(song:song_metadata) -> str:
+    # exact query modulo case and whitespace; versions ("Remastered") stay distinct, their lengths differ
+    return "search:" + "\x1f".join(normalize_name(part) for part in (song.artist,song.title,song.album))
+
+
+class MusicBrainzCache:
+    '''
+    on-disk cache of track lengths by lookup key (id_key / search_key).
+    found lengths are kept for ttl_s, "not found" for negative_ttl_s;
+    beyond max_entries the least recently used entries are evicted.
+    hits and misses are counted per session and in the file.
+
+    usage:
+        cache = MusicBrainzCache("musicbrainz_cache.db")
+        length = cache.lookup(id_key(track_id),lambda: fetch_length(track_id))
+    '''
+    def __init__(self,path_to_db:str,ttl_s:float=30 * DAY_IN_S,negative_ttl_s:float=DAY_IN_S,max_entries:int=50_000):
+        self.ttl_s = ttl_s
+        self.negative_ttl_s = negative_ttl_s
+        self.max_entries = max_entries
+        # used by PostProcessThreads
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path_to_db,check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL;")
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS lookups (
+                        key TEXT PRIMARY KEY,
+                        length_in_ms INTEGER,
+                        fetched_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                        ) WITHOUT ROWID;
+                        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_lookups_last_used ON lookups (last_used);")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID;")
+        self.db.commit()
+        self.amount_entries:int = self.db.execute("SELECT COUNT(*) FROM lookups;").fetchone()[0]
+        self.counters:dict[str,int] = {"hits":0,"negative_hits":0,"misses":0,"expired":0,"evicted":0}
+
+    def _count(self,name:str,amount:int=1):
+        self.counters[name] += amount
+        self.db.execute("INSERT INTO counters (name, value) VALUES (?,?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;",
+                        (name,amount))
+
+    def get(self,key:str) -> tuple[bool,int|None]:
+        '''
+        returns (found, length in ms); a found length of None is a cached "not found"
+        '''
+        now = time.time()
+        with self._lock:
+            row = self.db.execute("SELECT length_in_ms, fetched_at FROM lookups WHERE key = ?;",(key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                self.db.commit()
+                return False,None
+            length_in_ms,fetched_at = row
+            if now - fetched_at > (self.ttl_s if length_in_ms is not None else self.negative_ttl_s):
+                self._count("misses")
+                self._count("expired")
+                self.db.commit()
+                return False,None
+            self._count("hits" if length_in_ms is not None else "negative_hits")
+            self.db.execute("UPDATE lookups SET last_used = ? WHERE key = ?;",(now,key))
+            self.db.commit()
+            return True,length_in_ms
+
+    def put(self,key:str,length_in_ms:int|None):
+        now = time.time()
+        with self._lock:
+            is_new = self.db.execute("SELECT 1 FROM lookups WHERE key = ?;",(key,)).fetchone() is None
+            self.db.execute("INSERT OR REPLACE INTO lookups (key, length_in_ms, fetched_at, last_used) VALUES (?,?,?,?);",
+                            (key,length_in_ms,now,now))
+            self.amount_entries += is_new
+            if self.amount_entries > self.max_entries:
+                self._evict(self.amount_entries - self.max_entries)
+            self.db.commit()
+
+    def _evict(self,amount:int):
+        # expired entries go first, then the least recently used
+        now = time.time()
+        cursor = self.db.execute("""
+        DELETE FROM lookups WHERE key IN (
+            SELECT key FROM lookups
+            ORDER BY (fetched_at < ? - CASE WHEN length_in_ms IS NULL THEN ? ELSE ? END) DESC, last_used
+            LIMIT ?);
+                                 """,(now,self.negative_ttl_s,self.ttl_s,amount))
+        self.amount_entries -= cursor.rowcount
+        self._count("evicted",cursor.rowcount)
+
+    def lookup(self,key:str,fetch:Callable[[],int|None]) -> int|None:
+        '''
+        cached length of key, calls fetch on a miss and stores its result (None included).
+        exceptions of fetch (e.g. network errors) are not cached
+        '''
+        found,length_in_ms = self.get(key)
+        if found:
+            return length_in_ms
+        # fetched without holding the lock, other threads keep answering from the cache
+        length_in_ms = fetch()
+        self.put(key,length_in_ms)
+        return length_in_ms
+
+    def statistics(self) -> dict[str,int]:
+        '''
+        counters of this session, with totals of the cache file prefixed by "total_"
+        '''
+        with self._lock:
+            totals = dict(self.db.execute("SELECT name, value FROM counters;").fetchall())
+        return {**self.counters,**{f"total_{name}":value for name,value in totals.items()},"entries":self.amount_entries}
+
+    def close(self):
+        with self._lock:
+            self.db.commit()
+            self.db.close()
+
+
+class ReleaseTracklists:
+    '''
+    in-memory tracklists (with lengths) of releases songs were matched to.
+    once the first track of an album resolved to a release, its tracklist is fetched
+    and the remaining tracks are answered without a request; hits and misses are counted.
+    albums are told apart by artist, so a "Greatest Hits" of one artist never answers for another.
+    the most recently added max_releases releases are kept
+    '''
+    def __init__(self,max_releases:int=64):
+        self.max_releases = max_releases
+        self._lock = threading.Lock()
+        # (normalized artist, normalized album title) -> release id of the first match
+        self.release_of_album:dict[tuple[str,str],str] = {}
+        # release id -> ((normalized artist, normalized album), {recording id: length}, {normalized title: length}), oldest first
+        self.tracklists:dict[str,tuple[tuple[str,str],dict[str,int],dict[str,int]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def album_key(artist:str|None,album:str|None) -> tuple[str,str]:
+        return normalize_name(artist),normalize_name(album)
+
+    def remember_release(self,artist:str|None,album:str|None,release_id:str):
+        if not album:
+            return
+        with self._lock:
+            self.release_of_album.setdefault(self.album_key(artist,album),release_id)
+
+    def release_to_fetch(self,artist:str|None,album:str|None) -> str|None:
+        '''
+        release id matched for the album of artist whose tracklist was not fetched yet
+        '''
+        with self._lock:
+            release_id = self.release_of_album.get(self.album_key(artist,album))
+            return release_id if release_id is not None and release_id not in self.tracklists else None
+
+    def add(self,release_id:str,artist:str|None,album:str|None,tracks:list[tuple[str|None,list[str],int]]):
+        '''
+        stores tracks (recording id, titles, length in ms) of a release of artist
+        '''
+        by_id = {recording_id.lower():length for recording_id,_,length in tracks if recording_id}
+        by_title = {normalize_name(title):length for _,titles,length in tracks for title in titles if title}
+        with self._lock:
+            self.tracklists[release_id] = (self.album_key(artist,album),by_id,by_title)
+            while len(self.tracklists) > self.max_releases:
+                del self.tracklists[next(iter(self.tracklists))]
+
+    def forget(self,artist:str|None,album:str|None):
+        # release could not be fetched, the next match of album may name another one
+        with self._lock:
+            self.release_of_album.pop(self.album_key(artist,album),None)
+
+    def length_by_id(self,recording_id:str) -> int|None:
+        with self._lock:
+            for _,by_id,_ in self.tracklists.values():
+                if recording_id.strip().lower() in by_id:
+                    self.hits += 1
+                    return by_id[recording_id.strip().lower()]
+            self.misses += 1
+            return None
+
+    def length_by_title(self,artist:str|None,album:str|None,title:str) -> int|None:
+        key,title = self.album_key(artist,album),normalize_name(title)
+        with self._lock:
+            for release_key,_,by_title in self.tracklists.values():
+                if release_key == key and title in by_title:
+                    self.hits += 1
+                    return by_title[title]
+            self.misses += 1
+            return None
+
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python mod_musicbrainz_cache.py <cache.db>")
+        sys.exit(1)
+    cache = MusicBrainzCache(sys.argv[1])
+    for name,value in cache.statistics().items():
+        if name.startswith("total_") or name == "entries":
+            print(f"|- {name}: {value}")
+    cache.close()
@@ -0,0 +1,69 @@
+# |-- Local MusicBrainz mirror for track-length lookups
+# answers song_track_length_by_id / song_track_length_by_artist from an sqlite index
+# built by tool_import_musicbrainz_dump, no request leaves the machine
+
+# |--- Internal Imports
+from mod_data_representation import song_metadata
+from mod_musicbrainz_cache import normalize_name
+
+# |--- External Imports
+import threading
+import sqlite3
+import os
+
+
+def create_mirror_tables(db:sqlite3.Connection):
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS recordings (
+                    mbid TEXT PRIMARY KEY,
+                    length_in_ms INTEGER
+                    ) WITHOUT ROWID;
+                    """)
+    # one row per track of a release, names normalized by normalize_name
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS tracks (
+                    artist TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    release TEXT NOT NULL,
+                    length_in_ms INTEGER NOT NULL
+                    );
+                    """)
+
+def create_mirror_indexes(db:sqlite3.Connection):
+    # created after the import, filling indexed tables row by row is much slower
+    db.execute("CREATE INDEX IF NOT EXISTS idx_tracks_artist_title_release ON tracks (artist, title, release);")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_tracks_title_release ON tracks (title, release);")
+
+
+class MusicBrainzMirror:
+    '''
+    read-only lookups in a mirror index; matches like song_track_length_by_artist:
+    artist and title first (preferring the release named like the album), then title and album
+    '''
+    def __init__(self,path_to_index:str):
+        if not os.path.isfile(path_to_index):
+            raise FileNotFoundError(f"no MusicBrainz mirror index at {path_to_index}")
+        self.db = sqlite3.connect(f"file:{path_to_index}?mode=ro",uri=True,check_same_thread=False)
+        # used by PostProcessThreads
+        self._lock = threading.Lock()
+
+    def length_by_id(self,track_id:str) -> int|None:
+        with self._lock:
+            row = self.db.execute("SELECT length_in_ms FROM recordings WHERE mbid = ?;",(track_id.strip().lower(),)).fetchone()
+        return row[0] if row is not None else None
+
+    def length_by_song(self,song:song_metadata) -> int|None:
+        artist,title,album = normalize_name(song.artist),normalize_name(song.title),normalize_name(song.album)
+        with self._lock:
+            row = self.db.execute("""
+            SELECT length_in_ms FROM tracks WHERE artist = ? AND title = ?
+            ORDER BY release != ? LIMIT 1;
+                                  """,(artist,title,album)).fetchone()
+            if row is None and album:
+                row = self.db.execute("SELECT length_in_ms FROM tracks WHERE title = ? AND release = ? LIMIT 1;",
+                                      (title,album)).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self):
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,158 @@
+# |-- Shared scheduler for MusicBrainz requests
+# one thread issues all requests at the allowed rate; PostProcessThreads only wait for their result
+
+# |--- External Imports
+from concurrent.futures import Future
+from typing import Any, Callable, NamedTuple
+import threading
+import queue
+import time
+import musicbrainzngs
+
+# |--- Variables
+# lower is more urgent
+PRIORITY_RECORDING:int = 0
+PRIORITY_BACKLOG:int = 10
+
+
+class TokenBucket:
+    '''
+    allows rate_per_s acquisitions per second on average and bursts of up to capacity
+    '''
+    def __init__(self,rate_per_s:float=1.0,capacity:int=1):
+        self.rate_per_s = rate_per_s
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,self.tokens + (now - self.updated_at) * self.rate_per_s)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate_per_s)
+
+
+class _Request(NamedTuple):
+    future:Future
+    fetch:Callable[[],Any]
+    submitted_at:float
+
+
+class MusicBrainzScheduler(threading.Thread):
+    '''
+    issues queued MusicBrainz requests one at a time, limited by a TokenBucket.
+    requests with the same key (see mod_musicbrainz_cache) that are queued or running
+    share one call and one Future; the most urgent priority of the waiters counts.
+
+    usage:
+        scheduler = MusicBrainzScheduler(user_agent=("SpotRec","1.0","mail"))
+        scheduler.start()
+        length = scheduler.request(key,lambda: fetch_length(track_id),PRIORITY_RECORDING)
+        scheduler.stop()
+    '''
+    _stop_marker = (float("inf"),0,None)
+
+    def __init__(self,rate_per_s:float=1.0,burst:int=1,user_agent:tuple[str,str,str]|None=None):
+        threading.Thread.__init__(self,name="MusicBrainzScheduler",daemon=True)
+        self.bucket = TokenBucket(rate_per_s,burst)
+        if user_agent is not None:
+            musicbrainzngs.set_useragent(*user_agent)
+        # the bucket limits requests, musicbrainzngs' own limiter would only add a second wait
+        musicbrainzngs.set_rate_limit(False)
+        self._queue:queue.PriorityQueue[tuple[float,int,str|None]] = queue.PriorityQueue()
+        self._sequence = 0
+        # queued or running requests by key, with the priority they are queued at
+        self._pending:dict[str,tuple[_Request,int]] = {}
+        self._running:set[str] = set()
+        self._lock = threading.Lock()
+        self.statistics_lock = threading.Lock()
+        self.amount_requests = 0
+        self.amount_coalesced = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def submit(self,key:str,fetch:Callable[[],Any],priority:int=PRIORITY_BACKLOG) -> Future:
+        '''
+        queues fetch under key, unless a request with key is queued or running already
+        '''
+        with self._lock:
+            if key in self._pending:
+                request,queued_priority = self._pending[key]
+                with self.statistics_lock:
+                    self.amount_coalesced += 1
+                if priority < queued_priority and key not in self._running:
+                    # queued again at the higher priority, the older entry is skipped when popped
+                    self._pending[key] = (request,priority)
+                    self._put(priority,key)
+                return request.future
+            request = _Request(Future(),fetch,time.monotonic())
+            self._pending[key] = (request,priority)
+            self._put(priority,key)
+            return request.future
+
+    def request(self,key:str,fetch:Callable[[],Any],priority:int=PRIORITY_BACKLOG,timeout_s:float|None=None) -> Any:
+        '''
+        result of fetch, raises its exceptions in the calling thread
+        '''
+        return self.submit(key,fetch,priority).result(timeout_s)
+
+    def _put(self,priority:int,key:str):
+        # sequence keeps the order of equal priorities
+        self._sequence += 1
+        self._queue.put((priority,self._sequence,key))
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._pending) - len(self._running)
+
+    def statistics(self) -> dict[str,float]:
+        queue_depth = self.queue_depth()
+        with self.statistics_lock:
+            return {
+                "queue_depth":queue_depth,
+                "requests":self.amount_requests,
+                "coalesced":self.amount_coalesced,
+                "average_wait_ms":1000 * self.total_wait_s / self.amount_requests if self.amount_requests else 0.0,
+                "max_wait_ms":1000 * self.max_wait_s,
+            }
+
+    def stop(self):
+        # queued requests are still answered before the thread ends
+        self._queue.put(self._stop_marker)
+        self.join()
+
+    def run(self):
+        while True:
+            priority,_,key = self._queue.get()
+            if key is None:
+                break
+            with self._lock:
+                entry = self._pending.get(key)
+                if entry is None or entry[1] != priority or key in self._running:
+                    # answered already or queued again at another priority
+                    continue
+                request = entry[0]
+                self._running.add(key)
+            self.bucket.acquire()
+            wait_s = time.monotonic() - request.submitted_at
+            with self.statistics_lock:
+                self.amount_requests += 1
+                self.total_wait_s += wait_s
+                self.max_wait_s = max(self.max_wait_s,wait_s)
+            try:
+                result = request.fetch()
+            except Exception as error:
+                result,exception = None,error
+            else:
+                exception = None
+            with self._lock:
+                del self._pending[key]
+                self._running.discard(key)
+            if exception is not None:
+                request.future.set_exception(exception)
+            else:
+                request.future.set_result(result)
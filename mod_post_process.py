@@ -3,14 +3,15 @@
 
 #./spotrec.py -o ./spotify --skip-intro -a -ac mp3 --filename-pattern "{artist}/{album}/{artist} - {title}"')
 
-import subprocess
 import os
 from pathlib import Path
-import shlex
 import multiprocessing
 import eyed3
 import shutil
 
+from mod_boundary_detection import detect_music_boundaries, BoundaryDetectionError
+from mod_trim import trim_file, TrimNotSupported
+
 def getFiles(rootDir):
     gottenFiles = []
     for item in os.scandir(rootDir):
@@ -47,22 +48,16 @@ def run_pooled(func, args):
 
 def trimSilence(mp3):
     print("Trimming silence on", mp3)
-    encoding = "utf-8"
     trimmedMp3 = getTrimmedMp3(mp3)
-    cmd = "sox {} {} silence " \
-            "1 0.1 0.1% " \
-            "reverse silence 1 0.1 0.% " \
-            "reverse".format(
-                shlex.quote(mp3),
-                shlex.quote(trimmedMp3)
-            )
-    with open("/dev/null", "w") as devnull:
-        subprocess.run(cmd.encode(encoding),
-                       stdin=None,
-                       stdout=devnull,
-                       stderr=devnull,
-                       shell=True,
-                       encoding=encoding)
+    shutil.copyfile(mp3, trimmedMp3)
+    try:
+        boundaries = detect_music_boundaries(mp3)
+        if boundaries is not None:
+            # frames before and behind the music are dropped, tags stay in place
+            trim_file(trimmedMp3, boundaries.end_in_ms, boundaries.start_in_ms)
+    except (BoundaryDetectionError, TrimNotSupported) as e:
+        # both are raised before anything is written, cleanUp moves the unchanged copy back
+        print("Not trimming", mp3, "because", e)
     return trimmedMp3
 
 def copyOverArtwork(mp3):
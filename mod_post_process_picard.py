@@ -7,46 +7,167 @@
 
 # |--- external imports 
 import os 
+import mmap
+from typing import Any, Callable
 from pydub import AudioSegment
-from mutagen import flac,mp3,wave
+import mutagen
+from mutagen import flac,mp3,wave,id3
 import shutil
 import pprint
 import musicbrainzngs
 
 # |--- internal imports 
 from mod_data_representation import song_metadata
+from mod_musicbrainz_cache import MusicBrainzCache,ReleaseTracklists,id_key,search_key
+from mod_musicbrainz_scheduler import MusicBrainzScheduler,PRIORITY_BACKLOG
+from mod_musicbrainz_mirror import MusicBrainzMirror
+from mod_trim import trim_file,TrimNotSupported
+from mod_boundary_detection import detect_music_boundaries,BoundaryDetectionError
+from mod_bleed_detection import find_bleed_in_recordings
 
 # variables
 user_mail:str = "yourmail"
+user_agent:tuple[str,str,str] = ("QueryForCorrectTrackLength", "1.0", user_mail)
 
 unchecked_file_prefix:str="[UNCHECKED]_"
+# tag holding the track length the player reported (mpris:length), written by spotrec
+expected_length_tag:str = "spotrec_length_ms"
+# MusicBrainz lengths further off than this are reported by the cross-check
+cross_check_tolerance_in_ms:int = 2000
 
 
-def song_track_length_by_id(track_id) -> int | None:
+# optional local mirror answering instead of the MusicBrainz API, see set_mirror
+_mirror:MusicBrainzMirror|None = None
+
+def set_mirror(mirror:MusicBrainzMirror|None):
+    global _mirror
+    _mirror = mirror
+
+# optional persistent cache of lookups, see set_lookup_cache
+_lookup_cache:MusicBrainzCache|None = None
+
+def set_lookup_cache(cache:MusicBrainzCache|None):
+    global _lookup_cache
+    _lookup_cache = cache
+
+# optional shared request thread, see set_request_scheduler
+_request_scheduler:MusicBrainzScheduler|None = None
+_has_useragent = False
+# tracklists of albums being recorded, see _prefetch_release
+release_tracklists = ReleaseTracklists()
+
+def set_request_scheduler(scheduler:MusicBrainzScheduler|None):
+    global _request_scheduler
+    _request_scheduler = scheduler
+
+def _set_useragent():
+    # once per process; the scheduler sets it itself
+    global _has_useragent
+    if not _has_useragent:
+        musicbrainzngs.set_useragent(*user_agent)
+        _has_useragent = True
+
+def _request(key:str,fetch:Callable[[],Any],priority:int) -> Any:
+    if _request_scheduler is not None:
+        return _request_scheduler.request(key,fetch,priority)
+    _set_useragent()
+    return fetch()
+
+def _cached_lookup(key:str,fetch:Callable[[],int|None],priority:int,local:Callable[[],int|None]) -> int|None:
+    '''
+    answers from the lookup cache, then from prefetched tracklists (local), requests fetch otherwise
+    '''
+    def answer() -> int|None:
+        length = local()
+        if length is None:
+            return _request(key,fetch,priority)
+        print_info(f"length from album tracklist ({release_tracklists.hits}/{release_tracklists.hits + release_tracklists.misses} "
+                   f"lookups answered without request)")
+        return length
+    if _lookup_cache is None:
+        return answer()
+    return _lookup_cache.lookup(key,answer)
+
+def _remember_matching_release(artist:str|None,album:str|None,releases:list[dict]):
+    # only a release named like the album answers for its other tracks
+    if not album:
+        return
+    for release in releases:
+        if release.get('title','').strip().lower() == album.strip().lower() and 'id' in release:
+            release_tracklists.remember_release(artist,album,release['id'])
+            return
+
+def _fetch_release_tracks(release_id:str) -> list[tuple[str|None,list[str],int]]:
+    result = musicbrainzngs.get_release_by_id(release_id,includes=["recordings"])
+    tracks = []
+    for medium in result.get('release',{}).get('medium-list',[]):
+        for track in medium.get('track-list',[]):
+            recording = track.get('recording',{})
+            length = recording.get('length') or track.get('length')
+            if length is not None:
+                tracks.append((recording.get('id'),[track.get('title'),recording.get('title')],int(length)))
+    return tracks
+
+def _prefetch_release(artist:str|None,album:str|None,priority:int):
+    '''
+    fetches the tracklist of the release the album of artist was matched to, once per album;
+    the remaining tracks of the album are answered from it
+    '''
+    release_id = release_tracklists.release_to_fetch(artist,album)
+    if release_id is None:
+        return
+    try:
+        tracks = _request(f"release:{release_id}",lambda: _fetch_release_tracks(release_id),priority)
+    except musicbrainzngs.WebServiceError as error:
+        print_warning(f"could not fetch tracklist of release {release_id}: {error}")
+        release_tracklists.forget(artist,album)
+        return
+    release_tracklists.add(release_id,artist,album,tracks)
+    print_info(f"prefetched {len(tracks)} track lengths of {album}")
+
+def song_track_length_by_id(track_id,priority:int=PRIORITY_BACKLOG,album:str|None=None,artist:str|None=None) -> int | None:
     '''
     utilize the track-ids used by Musicbrainz
     to find the appropriate track-length
     '''
-    musicbrainzngs.set_useragent("QueryForCorrectTrackLength", "1.0", user_mail)
-    result = musicbrainzngs.get_recording_by_id(track_id)
-    pprint.pprint(result)
+    if _mirror is not None:
+        return _mirror.length_by_id(track_id)
+    length = _cached_lookup(id_key(track_id),lambda: _fetch_track_length_by_id(track_id,album,artist),priority,
+                            lambda: release_tracklists.length_by_id(track_id))
+    _prefetch_release(artist,album,priority)
+    return length
+
+def _fetch_track_length_by_id(track_id,album:str|None=None,artist:str|None=None) -> int | None:
+    try:
+        result = musicbrainzngs.get_recording_by_id(track_id,includes=["releases"])
+    except musicbrainzngs.ResponseError:
+        # unknown or malformed id, cached as not found
+        return None
     # result = musicbrainzngs.search_recordings(artist=artist, recording=title, limit=1)
     recording = result.get('recording', [])
     if recording:
-        print(recording)
+        _remember_matching_release(artist,album,recording.get('release-list',[]))
+    if recording and recording.get('length') is not None:
         length_ms = int(recording.get('length'))
         print(f"length from id {length_ms}")
         return length_ms
     return None
 
-def song_track_length_by_artist(song_info:song_metadata) -> int | None:
+def song_track_length_by_artist(song_info:song_metadata,priority:int=PRIORITY_BACKLOG) -> int | None:
     '''
     from song-information query musicbrainz
     to find a matching track and obtain its track length
 
     (warning: is not guaranteed to find a match)
     '''
-    musicbrainzngs.set_useragent("QueryForCorrectTrackLength", "1.0", user_mail)
+    if _mirror is not None:
+        return _mirror.length_by_song(song_info)
+    length = _cached_lookup(search_key(song_info),lambda: _search_track_length_by_artist(song_info),priority,
+                            lambda: release_tracklists.length_by_title(song_info.artist,song_info.album,song_info.title))
+    _prefetch_release(song_info.artist,song_info.album,priority)
+    return length
+
+def _search_track_length_by_artist(song_info:song_metadata) -> int | None:
     # result = musicbrainzngs.get_recording_by_id(track_id)
     query = {
         "artist":song_info.artist,
@@ -75,22 +196,34 @@ def song_track_length_by_artist(song_info:song_metadata) -> int | None:
         # yet cases exist where the artist is relevant
         if rec_artist == song_info.artist.strip().lower() and rec_title == song_info.title.strip().lower():
             # highest priority match
+            _remember_matching_release(song_info.artist,song_info.album,rec.get('release-list',[]))
             return int(rec.get('length',0))
         elif rec_title == song_info.title.strip().lower() and rec_album == song_info.album.strip().lower():
+            _remember_matching_release(song_info.artist,song_info.album,rec.get('release-list',[]))
             return int(rec.get('length', 0))
     return None
 
+# ID3 frames (by mutagen hash key) read from MP3 files
+ID3_FRAMES:tuple[str,...] = ("TIT2","TPE1","TALB","UFID:http://musicbrainz.org","TXXX:MusicBrainz Release Track Id")
+
 def receive_metadata_from_flac(audio_ref:flac.FLAC) -> song_metadata|None:
     '''
     requires FLAC-File; obtains song-metadata:
     title,artist,album,track_id and song-length
     may return nothing, if no information could be obtained
     '''
-    maybe_title = audio_ref.get("title")
-    maybe_artist = audio_ref.get("artist")
-    maybe_album = audio_ref.get("album")
-    maybe_track_id = audio_ref.get("musicbrainz_trackid")
-    maybe_song_length = audio_ref.info.length
+    return metadata_from_vorbis_comments(audio_ref.get,audio_ref.info.length)
+
+def metadata_from_vorbis_comments(get_comment:Callable[[str],list[str]|None],length_in_s:float) -> song_metadata|None:
+    '''
+    builds song-metadata from the values of a vorbis comment,
+    shared by mutagen and the header-only reader
+    '''
+    maybe_title = get_comment("title")
+    maybe_artist = get_comment("artist")
+    maybe_album = get_comment("album")
+    maybe_track_id = get_comment("musicbrainz_trackid")
+    maybe_song_length = length_in_s
     print_info(f"found artist in metadata:: {maybe_artist}")
     # print(audio_ref.info.length)
     if (maybe_title is None)  and (maybe_artist is None): 
@@ -122,30 +255,42 @@ def receive_metadata_from_mp3(audio_ref:mp3.MP3) -> song_metadata|None:
         print_warning("MP3 file does not contain any tags")
         return None
     
+    frames:dict[str,str] = {}
+    for key in ID3_FRAMES:
+        if key in tags:
+            frame = tags[key]
+            frames[key] = frame.data.decode('utf-8') if key.startswith("UFID:") else str(frame)
+    return metadata_from_id3_frames(frames,audio_ref.info.length)
+
+def metadata_from_id3_frames(frames:dict[str,str],length_in_s:float) -> song_metadata|None:
+    '''
+    builds song-metadata from the text of the ID3_FRAMES found in a tag,
+    shared by mutagen and the header-only reader
+    '''
     # Extract metadata from ID3 tags
     maybe_title = None
     maybe_artist = None
     maybe_album = None
     maybe_track_id = None
-    maybe_song_length = audio_ref.info.length  # Length in seconds
+    maybe_song_length = length_in_s  # Length in seconds
     
     # Get title (TIT2)
-    if 'TIT2' in tags:
-        maybe_title = [str(tags['TIT2'])]
+    if 'TIT2' in frames:
+        maybe_title = [frames['TIT2']]
     
     # Get artist (TPE1)
-    if 'TPE1' in tags:
-        maybe_artist = [str(tags['TPE1'])]
+    if 'TPE1' in frames:
+        maybe_artist = [frames['TPE1']]
     
     # Get album (TALB)
-    if 'TALB' in tags:
-        maybe_album = [str(tags['TALB'])]
+    if 'TALB' in frames:
+        maybe_album = [frames['TALB']]
     
     # Get MusicBrainz track ID (UFID:http://musicbrainz.org)
-    if 'UFID:http://musicbrainz.org' in tags:
-        maybe_track_id = [tags['UFID:http://musicbrainz.org'].data.decode('utf-8')]
-    elif 'TXXX:MusicBrainz Release Track Id' in tags:
-        maybe_track_id = [str(tags['TXXX:MusicBrainz Release Track Id'])]
+    if 'UFID:http://musicbrainz.org' in frames:
+        maybe_track_id = [frames['UFID:http://musicbrainz.org']]
+    elif 'TXXX:MusicBrainz Release Track Id' in frames:
+        maybe_track_id = [frames['TXXX:MusicBrainz Release Track Id']]
     
     print_info(f"found artist in metadata:: {maybe_artist}")
     
@@ -233,29 +378,364 @@ def get_metadata_from_file(audio_path: str) -> song_metadata | None:
         print_warning(f"Error reading metadata from {audio_path}: {str(e)}")
         return None
 
-def open_and_shorten_song(audio_path:str):
+# |--- header-only reader
+# reads FLAC/MP3 tags straight from a memory map, touching only the metadata blocks
+# (FLAC) or the ID3v2 tag and the first MPEG frame (MP3) instead of the whole file.
+# anything the readers do not cover raises _UnusualHeader and is parsed by mutagen.
+
+class _UnusualHeader(Exception):
+    pass
+
+def _read_flac_header(data:mmap.mmap) -> song_metadata|None:
+    if data[:4] != b"fLaC":
+        # e.g. leading ID3 tags
+        raise _UnusualHeader("no FLAC marker")
+    offset = 4
+    stream_info = None
+    comments:dict[str,list[str]]|None = None
+    is_last = False
+    # only the 4 byte block headers are read to skip pictures, seektables, padding
+    while not is_last:
+        header = data[offset:offset + 4]
+        if len(header) != 4:
+            raise _UnusualHeader("truncated metadata block")
+        is_last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7F
+        block_length = int.from_bytes(header[1:4],"big")
+        offset += 4
+        if offset + block_length > len(data):
+            raise _UnusualHeader("truncated metadata block")
+        if block_type == 0 and stream_info is None:
+            stream_info = data[offset:offset + block_length]
+        elif block_type == 4:
+            if comments is not None:
+                raise _UnusualHeader("more than one VORBIS_COMMENT block")
+            comments = _parse_vorbis_comment(data[offset:offset + block_length])
+        offset += block_length
+    if stream_info is None or len(stream_info) < 18:
+        raise _UnusualHeader("no STREAMINFO")
+    # sample rate (20 bit) and total samples (36 bit) at byte 10
+    packed = int.from_bytes(stream_info[10:18],"big")
+    sample_rate = packed >> 44
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate:
+        raise _UnusualHeader("invalid sample rate")
+    if comments is None:
+        raise _UnusualHeader("no VORBIS_COMMENT")
+    return metadata_from_vorbis_comments(comments.get,total_samples / float(sample_rate))
+
+def _parse_vorbis_comment(block:bytes) -> dict[str,list[str]]:
+    # lower-cased keys, values in order, like the case-insensitive lookup of mutagen
+    comments:dict[str,list[str]] = {}
+    vendor_length = int.from_bytes(block[0:4],"little")
+    offset = 4 + vendor_length
+    count = int.from_bytes(block[offset:offset + 4],"little")
+    offset += 4
+    for _ in range(count):
+        length = int.from_bytes(block[offset:offset + 4],"little")
+        offset += 4
+        entry = block[offset:offset + length]
+        offset += length
+        if len(entry) != length or offset > len(block):
+            raise _UnusualHeader("truncated vorbis comment")
+        key,separator,value = entry.partition(b"=")
+        if not separator or not key.isascii():
+            raise _UnusualHeader("malformed vorbis comment")
+        if any(char < 0x20 or char > 0x7D for char in key):
+            # invalid keys are dropped by mutagen
+            continue
+        comments.setdefault(key.decode("ascii").lower(),[]).append(value.decode("utf-8","replace"))
+    return comments
+
+def _id3_size(raw:bytes) -> int:
+    # syncsafe integer, 7 bit per byte
+    if any(byte & 0x80 for byte in raw):
+        raise _UnusualHeader("size is not syncsafe")
+    return (raw[0] << 21) | (raw[1] << 14) | (raw[2] << 7) | raw[3]
+
+_ID3_ENCODINGS = {0:("latin1",b"\x00"),1:("utf-16",b"\x00\x00"),2:("utf-16-be",b"\x00\x00"),3:("utf-8",b"\x00")}
+
+def _split_id3_text(raw:bytes,encoding:int) -> list[str]:
+    # values separated by the terminator of the encoding, aligned for UTF-16
+    if encoding not in _ID3_ENCODINGS:
+        raise _UnusualHeader("unknown text encoding")
+    codec,terminator = _ID3_ENCODINGS[encoding]
+    values = []
+    while raw:
+        end = raw.find(terminator)
+        while end != -1 and len(terminator) == 2 and end % 2:
+            end = raw.find(terminator,end + 1)
+        if end == -1:
+            value,raw = raw,b""
+        else:
+            value,raw = raw[:end],raw[end + len(terminator):]
+        if encoding == 1 and value and value[:2] not in (b"\xff\xfe",b"\xfe\xff"):
+            raise _UnusualHeader("UTF-16 without BOM")
+        values.append(value.decode(codec))
+    return values
+
+def _read_id3_frames(data:mmap.mmap) -> tuple[dict[str,str],int]:
+    '''
+    text of the ID3_FRAMES inside the leading ID3v2.3/2.4 tag,
+    and the offset of the audio following the tag
+    '''
+    if data[:3] != b"ID3":
+        raise _UnusualHeader("no ID3v2 tag")
+    version,tag_flags = data[3],data[5]
+    if version not in (3,4):
+        raise _UnusualHeader("ID3v2 version not supported")
+    if tag_flags & 0xF0:
+        # unsynchronisation, extended header, footer
+        raise _UnusualHeader("ID3v2 tag flags not supported")
+    tag_size = _id3_size(data[6:10])
+    if tag_size == 0 or 10 + tag_size > len(data):
+        raise _UnusualHeader("invalid tag size")
+    if data[-128:-125] == b"TAG":
+        # ID3v1 values are merged into the tag by mutagen
+        raise _UnusualHeader("ID3v1 tag present")
+    frames:dict[str,str] = {}
+    offset = 10
+    end_of_tag = 10 + tag_size
+    while offset + 10 <= end_of_tag:
+        header = data[offset:offset + 10]
+        if header[0] == 0:
+            # padding
+            break
+        frame_id = header[:4]
+        if not all(0x30 <= char <= 0x39 or 0x41 <= char <= 0x5A for char in frame_id):
+            raise _UnusualHeader("invalid frame id")
+        frame_size = _id3_size(header[4:8]) if version == 4 else int.from_bytes(header[4:8],"big")
+        if header[9]:
+            # compression, encryption, grouping, unsynchronisation
+            raise _UnusualHeader("frame flags not supported")
+        body = data[offset + 10:offset + 10 + frame_size]
+        offset += 10 + frame_size
+        if offset > end_of_tag:
+            raise _UnusualHeader("frame exceeds tag")
+        if frame_id in (b"TIT2",b"TPE1",b"TALB"):
+            key = frame_id.decode("ascii")
+            text = "\u0000".join(_split_id3_text(body[1:],body[0])) if body else None
+        elif frame_id == b"TXXX" and body:
+            # description followed by the values
+            description,*values = _split_id3_text(body[1:],body[0]) or [""]
+            key = f"TXXX:{description}"
+            text = "\u0000".join(values)
+        elif frame_id == b"UFID":
+            owner,_,identifier = body.partition(b"\x00")
+            key = f"UFID:{owner.decode('latin1')}"
+            text = identifier.decode("utf-8")
+        else:
+            continue
+        if key not in ID3_FRAMES:
+            continue
+        if key in frames or not text:
+            # duplicates and empty frames are resolved differently by mutagen
+            raise _UnusualHeader(f"ambiguous frame {key}")
+        frames[key] = text
+    return frames,end_of_tag
+
+# sample rates by MPEG version bits (2.5, reserved, 2, 1)
+_MPEG_SAMPLE_RATES = {0:(11025,12000,8000),2:(22050,24000,16000),3:(44100,48000,32000)}
+
+def _read_mpeg_length(data:mmap.mmap,offset:int) -> float:
+    '''
+    length in s from the Xing/Info or VBRI header of the first MPEG frame at offset,
+    the same way mutagen computes it (including LAME encoder delay and padding)
+    '''
+    header = data[offset:offset + 4]
+    if len(header) != 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        raise _UnusualHeader("no MPEG frame after the tag")
+    version = (header[1] >> 3) & 0x3
+    layer = (header[1] >> 1) & 0x3
+    bitrate = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x3
+    mode = header[3] >> 6
+    if version == 1 or layer != 1 or sample_rate_index == 3 or bitrate in (0,0xF):
+        # only layer 3 carries Xing/VBRI headers
+        raise _UnusualHeader("MPEG frame not supported")
+    sample_rate = _MPEG_SAMPLE_RATES[version][sample_rate_index]
+    frame_size = 1152 if version == 3 else 576
+
+    if version == 3:
+        xing_offset = offset + (21 if mode == 3 else 36)
+    else:
+        xing_offset = offset + (13 if mode == 3 else 21)
+    if data[xing_offset:xing_offset + 4] in (b"Xing",b"Info"):
+        flags = int.from_bytes(data[xing_offset + 4:xing_offset + 8],"big")
+        if not flags & 0x1:
+            # without a frame count the length is estimated from the file size
+            raise _UnusualHeader("Xing header without frame count")
+        samples = frame_size * int.from_bytes(data[xing_offset + 8:xing_offset + 12],"big")
+        lame_offset = xing_offset + 8 + 4 * bin(flags & 0xB).count("1") + (100 if flags & 0x4 else 0)
+        delay,padding = _read_lame_delay(data[lame_offset:lame_offset + 36])
+        return max(0,samples - delay - padding) / float(sample_rate)
+    vbri = data[offset + 36:offset + 36 + 18]
+    if vbri[:4] == b"VBRI":
+        if int.from_bytes(vbri[4:6],"big") != 1:
+            raise _UnusualHeader("VBRI version not supported")
+        return float(frame_size * int.from_bytes(vbri[14:18],"big")) / sample_rate
+    # CBR streams without header are estimated by mutagen after checking several frames
+    raise _UnusualHeader("no Xing/VBRI header")
+
+def _read_lame_delay(lame:bytes) -> tuple[int,int]:
+    # encoder delay and padding of the LAME extension, (0,0) if there is none
+    if not lame.startswith((b"LAME",b"L3.99")):
+        return 0,0
+    version = lame[:20].lstrip(b"EMAL")
+    major,version = version[0:1],version[1:].lstrip(b".")
+    minor = b""
+    while version[:1].isdigit():
+        minor,version = minor + version[:1],version[1:]
+    if not major.isdigit() or not minor:
+        return 0,0
+    major,minor = int(major),int(minor)
+    if (major,minor) < (3,90) or ((major,minor) == (3,90) and version[-11:-10] == b"(") or len(version) < 11:
+        # old versions write no extension
+        return 0,0
+    extension = lame[9:36]
+    if len(extension) != 27 or extension[0] >> 4 != 0:
+        return 0,0
+    delay = (extension[12] << 4) | (extension[13] >> 4)
+    padding = ((extension[13] & 0xF) << 8) | extension[14]
+    return delay,padding
+
+def get_metadata_from_file_header(audio_path:str) -> song_metadata|None:
+    '''
+    same result as get_metadata_from_file, but FLAC and MP3 files are memory-mapped
+    and only their tag headers are read; unusual files are parsed by mutagen
+    '''
+    file_ext = os.path.splitext(audio_path)[1].lower()
+    if file_ext not in ('.flac','.mp3'):
+        return get_metadata_from_file(audio_path)
+    try:
+        with open(audio_path,"rb") as file, mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ) as data:
+            if file_ext == '.flac':
+                return _read_flac_header(data)
+            frames,audio_offset = _read_id3_frames(data)
+            return metadata_from_id3_frames(frames,_read_mpeg_length(data,audio_offset))
+    except (_UnusualHeader,ValueError,OSError):
+        # ValueError covers empty files (mmap) and undecodable text
+        return get_metadata_from_file(audio_path)
+
+def read_expected_length(audio_path:str) -> int|None:
+    '''
+    track length spotrec tagged the recording with, None for other files
+    '''
+    try:
+        audio = mutagen.File(audio_path)
+    except mutagen.MutagenError:
+        return None
+    if audio is None or audio.tags is None:
+        return None
+    for key,value in audio.tags.items():
+        # vorbis comments: (key,[values]), ID3: (TXXX:key,frame)
+        if key.lower() in (expected_length_tag,f"txxx:{expected_length_tag}"):
+            values = value.text if hasattr(value,"text") else value
+            try:
+                return int(values[0])
+            except (ValueError,IndexError):
+                return None
+    return None
+
+def music_range(audio_path:str,track_length:int,next_recording_path:str|None=None) -> tuple[float,float]|None:
+    '''
+    (start, end) in ms of the song within the recording. the recording starts early, so the song
+    ends track_length after the detected start; a detected end close to that is taken as sample accurate.
+    audio of the next recording (next_recording_path) found in the tail ends the song in any case.
+    None if neither is found: without the start, track_length says nothing about where the song ends
+    '''
+    start_in_ms:float = 0
+    end_in_ms:float|None = None
+    try:
+        boundaries = detect_music_boundaries(audio_path)
+        if boundaries is None:
+            print_warning("recording is silent")
+        else:
+            start_in_ms = boundaries.start_in_ms
+            expected_end_in_ms = boundaries.start_in_ms + track_length
+            if abs(boundaries.end_in_ms - expected_end_in_ms) <= cross_check_tolerance_in_ms:
+                end_in_ms = boundaries.end_in_ms
+            else:
+                print_info(f"detected end at {boundaries.end_in_ms:.0f} ms, {expected_end_in_ms:.0f} ms expected, using the latter")
+                end_in_ms = expected_end_in_ms
+    except BoundaryDetectionError as error:
+        print_warning(f"no boundary detection: {error}")
+
+    if next_recording_path is not None and os.path.isfile(next_recording_path):
+        try:
+            bleed = find_bleed_in_recordings(audio_path,next_recording_path)
+        except (BoundaryDetectionError,OSError) as error:
+            print_warning(f"no bleed detection: {error}")
+            bleed = None
+        if bleed is not None and (end_in_ms is None or bleed.start_in_ms < end_in_ms):
+            print_info(f"next song starts at {bleed.start_in_ms:.0f} ms, cutting there"
+                       + (f" instead of {end_in_ms:.0f} ms" if end_in_ms is not None else ""))
+            end_in_ms = bleed.start_in_ms
+    if end_in_ms is None:
+        return None
+    return start_in_ms,end_in_ms
+
+def _restore_tags(audio_path:str,original:mutagen.FileType|None):
+    '''
+    writes the tags of the file before re-encoding (all of them, pictures included) back to audio_path
+    '''
+    if original is None or original.tags is None:
+        return
+    if isinstance(original,flac.FLAC):
+        reencoded = flac.FLAC(audio_path)
+        if reencoded.tags is None:
+            reencoded.add_tags()
+        reencoded.tags.clear()
+        reencoded.tags.extend(original.tags)
+        reencoded.clear_pictures()
+        for picture in original.pictures:
+            reencoded.add_picture(picture)
+        reencoded.save()
+    elif isinstance(original.tags,id3.ID3):
+        original.tags.save(audio_path)
+    else:
+        print_warning(f"can not copy {type(original.tags).__name__} tags, they are lost")
+
+def open_and_shorten_song(audio_path:str,priority:int=PRIORITY_BACKLOG,expected_length_in_ms:int|None=None,
+                          cross_check:bool=False,next_recording_path:str|None=None) -> str:
+    '''
+    returns the path of the file after processing (it may be renamed).
+    the length reported by the player (expected_length_in_ms or the tag) is used without any request,
+    MusicBrainz is asked without it or to cross-check it; priority of its requests, see mod_musicbrainz_scheduler.
+    next_recording_path is the recording of the following song, its start is cut from the end of this one
+    '''
     if not os.path.isfile(audio_path):
         raise Exception(f"no valid file given {audio_path}")
     if os.path.basename(audio_path).startswith(unchecked_file_prefix):
         print_warning("found file that has been processed already, skipping")
-        return 
+        return audio_path
     
     # Get metadata based on file type
     song_info = get_metadata_from_file(audio_path)
 
     if song_info is None:
-        return
+        return audio_path
 
-    # decide whether to query with trackid or artist/title
-    track_length = None
-    # try:
-    if song_info.track_id is not None: 
-        track_length = song_track_length_by_id(song_info.track_id)
-    else: 
-        track_length = song_track_length_by_artist(song_info)
+    track_length = expected_length_in_ms if expected_length_in_ms is not None else read_expected_length(audio_path)
+    if track_length is None or cross_check:
+        # decide whether to query with trackid or artist/title
+        try:
+            if song_info.track_id is not None: 
+                musicbrainz_length = song_track_length_by_id(song_info.track_id,priority,song_info.album,song_info.artist)
+            else: 
+                musicbrainz_length = song_track_length_by_artist(song_info,priority)
+        except musicbrainzngs.WebServiceError as error:
+            if track_length is None:
+                raise
+            # the cross-check is optional, the player's length is used without it
+            print_warning(f"could not cross-check length of {song_info.title} with MusicBrainz: {error}")
+            musicbrainz_length = None
+        if track_length is None:
+            track_length = musicbrainz_length
+        elif musicbrainz_length is not None and abs(musicbrainz_length - track_length) > cross_check_tolerance_in_ms:
+            print_warning(f"player reports {track_length} ms, MusicBrainz {musicbrainz_length} ms for {song_info.title}")
     
-    if True:
-    #if track_length is None:
+    if track_length is None:
         # saving the file again, but with different name -> indicating unchecked state of length etc.
         target_dir = os.path.dirname(audio_path)
         file_name  = os.path.basename(audio_path)
@@ -266,7 +746,7 @@ def open_and_shorten_song(audio_path:str):
         print_info("No track length found, saving unchecked")
         # print_info(f"Saving To {new_path}")
         shutil.move(src=audio_path,dst=new_path)
-        return
+        return new_path
     
     # if track_length == song_info.song_length_in_ms:
         # print_info("Track Length already Correct")
@@ -276,16 +756,26 @@ def open_and_shorten_song(audio_path:str):
     # cuts and overwrites file accordingly
     print_info(f"Found length of {track_length} ms, original length is {song_info.song_length_in_ms}")
     print_info(f"received_metadata:{song_info}")
-    metadata_as_dict:dict[str,str] = {
-        "artist":song_info.artist,
-        "title":song_info.title,
-        "album":song_info.album if song_info.album is not None else "",
-        "source":song_info.source if song_info.source is not None else ""
-    }
+    song_range = music_range(audio_path,track_length,next_recording_path)
+    if song_range is None:
+        # cutting track_length from the start would drop the end of the song behind the pre-roll
+        print_warning("start of the song not found, leaving the recording untrimmed")
+        return audio_path
+    start_in_ms,end_in_ms = song_range
+    try:
+        # cut behind a frame, the file is not decoded and encoded again; the head stays as it is
+        new_length_in_ms = trim_file(audio_path,end_in_ms)
+        print_info(f"Trimmed to {new_length_in_ms:.0f} ms")
+        return audio_path
+    except TrimNotSupported as error:
+        print_warning(f"can not trim without decoding ({error}), re-encoding")
+    original = mutagen.File(audio_path)
     # print_info("Cutting to length")
     as_segment = AudioSegment.from_file(audio_path)
-    cut_down_version = as_segment[:track_length]
-    cut_down_version.export(audio_path, format="flac",tags=metadata_as_dict)
+    cut_down_version = as_segment[start_in_ms:end_in_ms]
+    cut_down_version.export(audio_path, format=os.path.splitext(audio_path)[1][1:].lower() or "flac")
+    _restore_tags(audio_path,original)
+    return audio_path
 
 def print_info(content:str):
     print(f"| - [Info]: {content}")
@@ -0,0 +1,394 @@
+# |-- Trimming recordings without decoding them
+# FLAC and MP3 files are cut in place at frame boundaries (MP3 also at the head): metadata blocks and tags stay untouched,
+# only the headers stating the length of the audio are rewritten; memory use does not grow with the file
+
+# External Imports
+from typing import NamedTuple
+import mmap
+import math
+import os
+import re
+
+
+class TrimNotSupported(Exception):
+    '''
+    layout the trimmer does not handle, callers fall back to decoding the file
+    '''
+    pass
+
+
+# |--- CRCs
+def _crc_table(polynomial:int,width:int,reflected:bool) -> list[int]:
+    table = []
+    top_bit = 1 << (width - 1)
+    mask = (1 << width) - 1
+    for byte in range(256):
+        if reflected:
+            crc = byte
+            for _ in range(8):
+                crc = (crc >> 1) ^ polynomial if crc & 1 else crc >> 1
+        else:
+            crc = byte << (width - 8)
+            for _ in range(8):
+                crc = ((crc << 1) ^ polynomial) & mask if crc & top_bit else (crc << 1) & mask
+        table.append(crc)
+    return table
+
+# FLAC frame headers: CRC-8, polynomial x^8 + x^2 + x + 1
+_CRC8_TABLE = _crc_table(0x07,8,False)
+# LAME tag: CRC-16/ARC
+_CRC16_ARC_TABLE = _crc_table(0xA001,16,True)
+
+def _crc8(data:bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+def _crc16_arc(data:bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC16_ARC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+# |--- FLAC
+_FLAC_SYNC = re.compile(rb"\xff[\xf8\xf9]")
+# block size codes 1-5, 8-15 of the frame header (6 and 7 are read from the header end)
+_FLAC_BLOCK_SIZES = {1:192,2:576,3:1152,4:2304,5:4608,**{code:256 << (code - 8) for code in range(8,16)}}
+# frames are looked for this far behind the previous one
+_FLAC_MAX_FRAME_DISTANCE = 1 << 20
+
+class _FlacLayout(NamedTuple):
+    stream_info_offset:int
+    seektable_offset:int|None
+    seektable_length:int
+    audio_offset:int
+    sample_rate:int
+    total_samples:int
+    # blocking strategy bit all frame headers carry
+    variable_blocksize:bool
+    blocksize:int
+
+class _FlacFrame(NamedTuple):
+    offset:int
+    first_sample:int
+    blocksize:int
+
+def _read_flac_layout(data:mmap.mmap) -> _FlacLayout:
+    if data[:4] != b"fLaC":
+        raise TrimNotSupported("no FLAC marker at the file start")
+    offset = 4
+    stream_info_offset = None
+    seektable_offset,seektable_length = None,0
+    is_last = False
+    while not is_last:
+        header = data[offset:offset + 4]
+        if len(header) != 4:
+            raise TrimNotSupported("truncated metadata block")
+        is_last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7F
+        block_length = int.from_bytes(header[1:4],"big")
+        offset += 4
+        if block_type == 0:
+            stream_info_offset = offset
+        elif block_type == 3:
+            seektable_offset,seektable_length = offset,block_length
+        offset += block_length
+    if stream_info_offset is None:
+        raise TrimNotSupported("no STREAMINFO")
+    stream_info = data[stream_info_offset:stream_info_offset + 34]
+    min_blocksize,max_blocksize = int.from_bytes(stream_info[0:2],"big"),int.from_bytes(stream_info[2:4],"big")
+    packed = int.from_bytes(stream_info[10:18],"big")
+    sample_rate,total_samples = packed >> 44,packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        raise TrimNotSupported("STREAMINFO without sample rate or length")
+    first_sync = _FLAC_SYNC.match(data,offset)
+    if first_sync is None:
+        raise TrimNotSupported("no audio frame behind the metadata")
+    return _FlacLayout(stream_info_offset,seektable_offset,seektable_length,offset,sample_rate,total_samples,
+                       bool(data[offset + 1] & 0x1),max_blocksize if min_blocksize == max_blocksize else 0)
+
+def _read_utf8_number(data:mmap.mmap,offset:int) -> tuple[int,int]|None:
+    # frame/sample number coded like UTF-8 (up to 36 bit), returns (number, length)
+    first = data[offset]
+    if first < 0x80:
+        return first,1
+    length = 8 - (first ^ 0xFF).bit_length()
+    if not 2 <= length <= 7:
+        return None
+    number = first & (0x7F >> length)
+    for byte in data[offset + 1:offset + length]:
+        if byte & 0xC0 != 0x80:
+            return None
+        number = (number << 6) | (byte & 0x3F)
+    return number,length
+
+def _read_flac_frame(data:mmap.mmap,offset:int,layout:_FlacLayout) -> _FlacFrame|None:
+    '''
+    frame starting at offset, None if the bytes there only look like a sync code
+    '''
+    header = data[offset:offset + 4]
+    if len(header) != 4 or bool(header[1] & 0x1) != layout.variable_blocksize:
+        return None
+    blocksize_code,sample_rate_code = header[2] >> 4,header[2] & 0xF
+    if blocksize_code == 0 or sample_rate_code == 0xF or header[3] >> 4 > 10 or header[3] & 0x1:
+        return None
+    number = _read_utf8_number(data,offset + 4) if offset + 4 < len(data) else None
+    if number is None:
+        return None
+    end = offset + 4 + number[1]
+    if blocksize_code == 6:
+        blocksize,end = data[end] + 1,end + 1
+    elif blocksize_code == 7:
+        blocksize,end = int.from_bytes(data[end:end + 2],"big") + 1,end + 2
+    else:
+        blocksize = _FLAC_BLOCK_SIZES[blocksize_code]
+    end += {12:1,13:2,14:2}.get(sample_rate_code,0)
+    if end >= len(data) or _crc8(data[offset:end]) != data[end]:
+        return None
+    first_sample = number[0] if layout.variable_blocksize else number[0] * layout.blocksize
+    return _FlacFrame(offset,first_sample,blocksize)
+
+def _next_flac_frame(data:mmap.mmap,offset:int,layout:_FlacLayout) -> _FlacFrame|None:
+    '''
+    first frame starting at or behind offset; a header only counts if the next frame
+    continues its sample numbering (or it is the last one), random sync codes in the audio do not
+    '''
+    search_end = min(len(data),offset + _FLAC_MAX_FRAME_DISTANCE)
+    for match in _FLAC_SYNC.finditer(data,offset,search_end):
+        frame = _read_flac_frame(data,match.start(),layout)
+        if frame is None:
+            continue
+        next_sample = frame.first_sample + frame.blocksize
+        if next_sample >= layout.total_samples:
+            return frame
+        for next_match in _FLAC_SYNC.finditer(data,frame.offset + 2,min(len(data),frame.offset + _FLAC_MAX_FRAME_DISTANCE)):
+            next_frame = _read_flac_frame(data,next_match.start(),layout)
+            if next_frame is not None and next_frame.first_sample == next_sample:
+                return frame
+    return None
+
+def _find_flac_cut(data:mmap.mmap,layout:_FlacLayout,target_samples:int) -> tuple[_FlacFrame|None,_FlacFrame|None]:
+    # bisects the file for the first frame starting at or behind target_samples, returns (frame before, that frame)
+    low,high = layout.audio_offset,len(data)
+    before,cut = None,None
+    while low < high:
+        middle = (low + high) // 2
+        frame = _next_flac_frame(data,middle,layout)
+        if frame is None or frame.first_sample >= target_samples:
+            if frame is not None:
+                cut = frame
+            high = middle
+        else:
+            before = frame
+            low = frame.offset + 1
+    return before,cut
+
+def trim_flac(path:str,length_in_ms:float) -> float:
+    '''
+    drops the frames behind length_in_ms, the last frame is kept whole
+    (at most one block, ~100 ms, longer than asked).
+    STREAMINFO gets the new sample count and an unset MD5 (it would require decoding),
+    seek points behind the cut become placeholders.
+
+    returns the new length in ms
+    '''
+    with open(path,"rb") as file, mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ) as data:
+        layout = _read_flac_layout(data)
+        target_samples = math.ceil(length_in_ms * layout.sample_rate / 1000)
+        if target_samples >= layout.total_samples:
+            return layout.total_samples * 1000 / layout.sample_rate
+        before,cut = _find_flac_cut(data,layout,target_samples)
+        if cut is None:
+            if before is not None and before.first_sample + before.blocksize >= layout.total_samples:
+                # the cut falls into the last frame
+                return layout.total_samples * 1000 / layout.sample_rate
+            raise TrimNotSupported("no frame boundary found behind the cut")
+        stream_info = bytearray(data[layout.stream_info_offset:layout.stream_info_offset + 34])
+        seektable = bytearray(data[layout.seektable_offset:layout.seektable_offset + layout.seektable_length]) \
+            if layout.seektable_offset is not None else None
+
+    packed = int.from_bytes(stream_info[10:18],"big")
+    stream_info[10:18] = ((packed & ~0xFFFFFFFFF) | cut.first_sample).to_bytes(8,"big")
+    stream_info[18:34] = bytes(16)
+    with open(path,"r+b") as file:
+        file.seek(layout.stream_info_offset)
+        file.write(stream_info)
+        if seektable is not None:
+            for point in range(0,len(seektable) - 17,18):
+                if int.from_bytes(seektable[point:point + 8],"big") >= cut.first_sample:
+                    # placeholders sort behind all seek points, as do the points behind the cut
+                    seektable[point:point + 18] = b"\xff" * 8 + bytes(10)
+            file.seek(layout.seektable_offset)
+            file.write(seektable)
+        file.truncate(cut.offset)
+    return cut.first_sample * 1000 / layout.sample_rate
+
+
+# |--- MP3
+_MPEG_SAMPLE_RATES = {0:(11025,12000,8000),2:(22050,24000,16000),3:(44100,48000,32000)}
+_MPEG1_L3_BITRATES = (0,32,40,48,56,64,80,96,112,128,160,192,224,256,320)
+_MPEG2_L3_BITRATES = (0,8,16,24,32,40,48,56,64,80,96,112,128,144,160)
+# decoders add this to the encoder delay of the LAME tag
+_DECODER_DELAY = 529
+
+def _read_mpeg_frame(data:mmap.mmap,offset:int) -> tuple[int,int,int]|None:
+    '''
+    (frame length, samples per frame, sample rate) of the layer 3 frame at offset
+    '''
+    header = data[offset:offset + 4]
+    if len(header) != 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version,layer = (header[1] >> 3) & 0x3,(header[1] >> 1) & 0x3
+    bitrate_index,sample_rate_index = header[2] >> 4,(header[2] >> 2) & 0x3
+    if version == 1 or layer != 1 or sample_rate_index == 3 or bitrate_index in (0,0xF):
+        return None
+    sample_rate = _MPEG_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 0x1
+    if version == 3:
+        return 144000 * _MPEG1_L3_BITRATES[bitrate_index] // sample_rate + padding,1152,sample_rate
+    return 72000 * _MPEG2_L3_BITRATES[bitrate_index] // sample_rate + padding,576,sample_rate
+
+def _mp3_audio_range(data:mmap.mmap) -> tuple[int,int]:
+    # between the ID3v2 tag and APE / ID3v1 tags at the end
+    start = 0
+    if data[:3] == b"ID3":
+        raw = data[6:10]
+        start = 10 + ((raw[0] << 21) | (raw[1] << 14) | (raw[2] << 7) | raw[3]) + (10 if data[5] & 0x10 else 0)
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    if end >= 32 and data[end - 32:end - 24] == b"APETAGEX":
+        flags = int.from_bytes(data[end - 12:end - 8],"little")
+        end -= int.from_bytes(data[end - 20:end - 16],"little") + (32 if flags & 0x80000000 else 0)
+    return start,end
+
+def _move_bytes(file,source:int,target:int,length:int,chunk_size:int=1 << 20):
+    # copies length bytes from source to the lower offset target, front to back
+    for position in range(0,length,chunk_size):
+        file.seek(source + position)
+        chunk = file.read(min(chunk_size,length - position))
+        file.seek(target + position)
+        file.write(chunk)
+
+def trim_mp3(path:str,length_in_ms:float,start_in_ms:float=0.0) -> float:
+    '''
+    drops the frames behind length_in_ms and, with start_in_ms, the frames before it.
+    with a LAME tag the cuts are sample accurate for gapless decoders: the end padding covers
+    the surplus of the last frame, the encoder delay the surplus of the first ones. one frame more
+    than needed is kept at the head, its bit reservoir lies in the dropped frames and it is skipped
+    as part of the delay. Xing frame and byte counts, TOC and the LAME tag (with its CRC) are rewritten;
+    the music CRC is left as it is, nothing checks it. ID3v2 stays in front, APE and ID3v1 tags
+    are moved behind the new end.
+
+    returns the new length in ms (as computed by mutagen)
+    '''
+    with open(path,"rb") as file, mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ) as data:
+        audio_start,audio_end = _mp3_audio_range(data)
+        first = _read_mpeg_frame(data,audio_start)
+        if first is None:
+            raise TrimNotSupported("no MPEG layer 3 frame behind the tag")
+        _,samples_per_frame,sample_rate = first
+        mono = data[audio_start + 3] >> 6 == 3
+        xing_offset = audio_start + 4 + ((17 if mono else 32) if samples_per_frame == 1152 else (9 if mono else 17))
+        info_frame = None
+        if data[xing_offset:xing_offset + 4] in (b"Xing",b"Info"):
+            info_frame = bytearray(data[audio_start:audio_start + first[0]])
+
+        frame_offsets = []
+        offset = audio_start + (first[0] if info_frame is not None else 0)
+        while offset < audio_end:
+            frame = _read_mpeg_frame(data,offset)
+            if frame is None:
+                if audio_end - offset < 4:
+                    break
+                raise TrimNotSupported(f"invalid MPEG frame at byte {offset}")
+            frame_offsets.append(offset)
+            offset += frame[0]
+        audio_end = min(offset,len(data))
+        tail = data[audio_end:]
+
+    delay,padding,lame_offset = 0,0,None
+    if info_frame is not None:
+        xing = xing_offset - audio_start
+        flags = int.from_bytes(info_frame[xing + 4:xing + 8],"big")
+        lame_offset = xing + 8 + 4 * bin(flags & 0xB).count("1") + (100 if flags & 0x4 else 0)
+        if info_frame[lame_offset:lame_offset + 4] == b"LAME" and len(info_frame) >= lame_offset + 36:
+            delay = (info_frame[lame_offset + 21] << 4) | (info_frame[lame_offset + 22] >> 4)
+            padding = ((info_frame[lame_offset + 22] & 0xF) << 8) | info_frame[lame_offset + 23]
+        else:
+            lame_offset = None
+    target_samples = math.ceil(length_in_ms * sample_rate / 1000)
+    # the last kept frame also has to cover the decoder delay
+    amount_frames = math.ceil((target_samples + delay + (_DECODER_DELAY if lame_offset is not None else 0)) / samples_per_frame)
+    start_samples = max(0,math.floor(start_in_ms * sample_rate / 1000))
+    # without a LAME tag the head is cut at a frame boundary before start_in_ms
+    first_frame = max(0,(start_samples + delay) // samples_per_frame - 1)
+    if amount_frames >= len(frame_offsets):
+        amount_frames = len(frame_offsets)
+        if first_frame == 0:
+            return (amount_frames * samples_per_frame - delay - padding) * 1000 / sample_rate
+    elif lame_offset is not None:
+        padding = amount_frames * samples_per_frame - delay - target_samples
+    if first_frame >= amount_frames:
+        raise TrimNotSupported("the start lies behind the end")
+    if lame_offset is not None:
+        # at most two frames, fits the 12 bits of the field
+        delay += start_samples - first_frame * samples_per_frame
+    head_offset = frame_offsets[first_frame]
+    cut_offset = frame_offsets[amount_frames] if amount_frames < len(frame_offsets) else audio_end
+    kept_frames = amount_frames - first_frame
+    info_length = len(info_frame) if info_frame is not None else 0
+
+    if info_frame is not None:
+        field = xing + 8
+        stream_bytes = info_length + cut_offset - head_offset
+        if flags & 0x1:
+            stored = int.from_bytes(info_frame[field:field + 4],"big")
+            # encoders differ in counting the info frame, the difference is kept
+            info_frame[field:field + 4] = (stored - len(frame_offsets) + kept_frames).to_bytes(4,"big")
+            field += 4
+        if flags & 0x2:
+            info_frame[field:field + 4] = stream_bytes.to_bytes(4,"big")
+            field += 4
+        if flags & 0x4:
+            info_frame[field:field + 100] = bytes(
+                min(255,256 * (info_length + frame_offsets[first_frame + kept_frames * index // 100] - head_offset) // stream_bytes)
+                for index in range(100))
+        if lame_offset is not None:
+            info_frame[lame_offset + 21] = delay >> 4
+            info_frame[lame_offset + 22] = ((delay & 0xF) << 4) | (padding >> 8)
+            info_frame[lame_offset + 23] = padding & 0xFF
+            info_frame[lame_offset + 28:lame_offset + 32] = stream_bytes.to_bytes(4,"big")
+            info_frame[lame_offset + 34:lame_offset + 36] = _crc16_arc(info_frame[:lame_offset + 34]).to_bytes(2,"big")
+
+    with open(path,"r+b") as file:
+        if info_frame is not None:
+            file.seek(audio_start)
+            file.write(info_frame)
+        new_cut_offset = audio_start + info_length + cut_offset - head_offset
+        if head_offset != audio_start + info_length:
+            _move_bytes(file,head_offset,audio_start + info_length,cut_offset - head_offset)
+        file.seek(new_cut_offset)
+        file.write(tail)
+        file.truncate(new_cut_offset + len(tail))
+    return (kept_frames * samples_per_frame - delay - padding) * 1000 / sample_rate
+
+
+def trim_file(path:str,length_in_ms:float,start_in_ms:float=0.0) -> float:
+    '''
+    cuts path to length_in_ms (FLAC or MP3) without decoding it, MP3 also before start_in_ms
+    (both measured from the start of the file)
+
+    returns the new length in ms
+    '''
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".flac":
+        if start_in_ms > 0:
+            # frames carry their position, dropping some at the head means rewriting all of them
+            raise TrimNotSupported("FLAC is only trimmed at the end")
+        return trim_flac(path,length_in_ms)
+    if suffix == ".mp3":
+        return trim_mp3(path,length_in_ms,start_in_ms)
+    raise TrimNotSupported(f"no stream-copy trimming for {suffix} files")
@@ -23,9 +23,13 @@ import requests
 import sqlite3
 
 # |---- Internal Imports
-from mod_post_process_picard import open_and_shorten_song
-from mod_db_interface import song_is_in_db,insert_new_song,initialize_database,SOURCES
+from mod_post_process_picard import open_and_shorten_song,get_metadata_from_file_header,set_lookup_cache,set_request_scheduler,set_mirror,user_agent,release_tracklists,expected_length_tag
+from mod_musicbrainz_cache import MusicBrainzCache,DAY_IN_S
+from mod_musicbrainz_scheduler import MusicBrainzScheduler,PRIORITY_RECORDING
+from mod_musicbrainz_mirror import MusicBrainzMirror
+from mod_db_interface import ConnectionManager,RecordedSongSet,SOURCES
 from mod_data_representation import song_metadata
+from mod_bleed_detection import RecordingChain
 # Deps:
 # 'python'
 # 'python-dbus'
@@ -53,6 +57,12 @@ _audio_codec = "flac"
 _add_cover_art = False
 _download_source = "Spotify"
 _recording_db:str = "songs.db"
+_dedupe_cache:str = "off"
+_async_db_writes = False
+_musicbrainz_cache:str = "musicbrainz_cache.db"
+_musicbrainz_ttl_days = 30
+_musicbrainz_mirror:str|None = None
+_musicbrainz_cross_check = False
 
 # Hard-coded settings
 _pa_recording_sink_name = "spotrec"
@@ -71,6 +81,18 @@ is_first_playing = True
 pa_spotify_sink_input_id = -1
 internal_track_counter = 1
 is_shutting_down = False
+_db_manager:ConnectionManager|None = None
+_lookup_cache:MusicBrainzCache|None = None
+_request_scheduler:MusicBrainzScheduler|None = None
+
+
+def start_post_processing(file_path:str, expected_length_in_ms:int|None, next_recording_path:str|None) -> Thread:
+    thread_post_process = PostProcessThread(file_path, expected_length_in_ms, next_recording_path)
+    thread_post_process.start()
+    return thread_post_process
+
+# recordings wait here until the next one finished, see mod_bleed_detection
+_post_process_chain = RecordingChain(start_post_processing)
 
 
 def main():
@@ -90,7 +112,27 @@ def main():
         print()
 
     init_log()
-    _connection_db = initialize_database(_recording_db)
+    # one connection for the whole session, shared by GLib-loop and RecordThreads
+    global _db_manager
+    recorded_songs = None
+    if _dedupe_cache != "off":
+        recorded_songs = RecordedSongSet(use_bloom_filter=_dedupe_cache == "bloom")
+    _db_manager = ConnectionManager(_recording_db,recorded_songs)
+    if _async_db_writes:
+        _db_manager.start_writer()
+    # post processing asks MusicBrainz (or a local mirror of it) for track lengths
+    if _musicbrainz_mirror is not None:
+        set_mirror(MusicBrainzMirror(_musicbrainz_mirror))
+    global _lookup_cache
+    if _musicbrainz_cache != "off" and _musicbrainz_mirror is None:
+        _lookup_cache = MusicBrainzCache(_musicbrainz_cache, ttl_s=_musicbrainz_ttl_days * DAY_IN_S)
+        set_lookup_cache(_lookup_cache)
+    # all post processing threads share one rate limit
+    global _request_scheduler
+    if _musicbrainz_mirror is None:
+        _request_scheduler = MusicBrainzScheduler(user_agent=user_agent)
+        _request_scheduler.start()
+        set_request_scheduler(_request_scheduler)
 
     # Create the output directory
     Path(_output_directory).mkdir(
@@ -122,9 +164,30 @@ def doExit():
     # Kill all FFmpeg subprocesses
     FFmpeg.killAll()
 
+    # The last finished recording has no successor, process it before exiting
+    last_post_process = _post_process_chain.flush()
+    if last_post_process is not None:
+        last_post_process.join()
+
     # Unload PulseAudio sink
     PulseAudio.unload_sink()
 
+    # Flush pending songs and close connection to recording db
+    if _db_manager is not None:
+        for song, error in _db_manager.close():
+            log.warning(f"[{app_name}] Song not written to the recording db: {song.artist} - {song.title} ({error})")
+
+    if _request_scheduler is not None:
+        statistics = _request_scheduler.statistics()
+        log.info(f"[{app_name}] MusicBrainz requests: {statistics['requests']} sent, {statistics['coalesced']} coalesced, "
+                 f"{statistics['queue_depth']} still queued, average wait {statistics['average_wait_ms']:.0f} ms")
+        log.info(f"[{app_name}] Album tracklists answered {release_tracklists.hit_rate():.0%} of lookups without request")
+
+    if _lookup_cache is not None:
+        statistics = _lookup_cache.statistics()
+        log.info(f"[{app_name}] MusicBrainz cache: {statistics['hits'] + statistics['negative_hits']} hits, {statistics['misses']} misses")
+        _lookup_cache.close()
+
     log.info(f"[{app_name}] Bye")
 
     # Have to use os exit here, because otherwise GLib would print a strange error message
@@ -147,6 +210,12 @@ def handle_command_line():
     global _add_cover_art
     global _download_source
     global _recording_db
+    global _dedupe_cache
+    global _async_db_writes
+    global _musicbrainz_cache
+    global _musicbrainz_ttl_days
+    global _musicbrainz_mirror
+    global _musicbrainz_cross_check
 
     parser = argparse.ArgumentParser(
         description=app_name + " v" + app_version, formatter_class=argparse.RawTextHelpFormatter)
@@ -175,6 +244,21 @@ def handle_command_line():
     
     parser.add_argument("-src", "--download-source", help="Metadata: Where Song was downloaded from\n{}".format(SOURCES), default=_download_source)
     parser.add_argument("-db", "--database", help="Path To Database that contains information on downloaded songs.",required=True, default=_recording_db)
+    parser.add_argument("-dc", "--dedupe-cache", help="Keep recorded songs in memory to skip them without querying the database\n"
+                                                      "Available: off, set, bloom (for very large libraries)\n"
+                                                      "Default: " + _dedupe_cache, choices=["off", "set", "bloom"], default=_dedupe_cache)
+    parser.add_argument("-aw", "--async-db-writes", help="Commit recorded songs to the database in a background thread,\n"
+                                                         "so the next recording does not wait for the disk",
+                        action="store_true", default=_async_db_writes)
+    parser.add_argument("-mbc", "--musicbrainz-cache", help="File to cache MusicBrainz track-length lookups in, 'off' to disable\n"
+                                                            "Default: " + _musicbrainz_cache, default=_musicbrainz_cache)
+    parser.add_argument("-mbt", "--musicbrainz-ttl-days", help="Days until cached MusicBrainz lookups are requested again\n"
+                                                               "Default: " + str(_musicbrainz_ttl_days), type=float, default=_musicbrainz_ttl_days)
+    parser.add_argument("-mbm", "--musicbrainz-mirror", help="Look up track lengths in a local index built by tool_import_musicbrainz_dump\n"
+                                                             "instead of the MusicBrainz API", default=_musicbrainz_mirror)
+    parser.add_argument("-mbx", "--musicbrainz-cross-check", help="Also look up the track length on MusicBrainz when Spotify reports it\n"
+                                                                  "and warn if they differ",
+                        action="store_true", default=_musicbrainz_cross_check)
 
     args = parser.parse_args()
     _debug_logging              = args.debug
@@ -188,6 +272,12 @@ def handle_command_line():
     _add_cover_art              = args.add_cover_art
     _download_source            = args.download_source
     _recording_db               = args.database
+    _dedupe_cache               = args.dedupe_cache
+    _async_db_writes            = args.async_db_writes
+    _musicbrainz_cache          = args.musicbrainz_cache
+    _musicbrainz_ttl_days       = args.musicbrainz_ttl_days
+    _musicbrainz_mirror         = args.musicbrainz_mirror
+    _musicbrainz_cross_check    = args.musicbrainz_cross_check
 
 
 def init_log():
@@ -273,13 +363,27 @@ class Spotify:
 
         log.info(f"[{app_name}] Spotify DBus listener stopped")
 
+    def get_song_metadata(self) -> song_metadata:
+        return song_metadata(
+            artist=self.metadata_artist,
+            title=self.metadata_title,
+            track_id=str(self.trackid) if self.trackid else None,
+            album=self.metadata_album,
+            song_length_in_ms=self.metadata_length_in_ms,
+            source=_download_source
+        )
+
     def get_metadata_for_ffmpeg(self):
-        return {
+        metadata = {
             "artist": self.metadata_artist,
             "album": self.metadata_album,
             "title": self.metadata_title,
             "cover_url": self.metadata_artUrl,
         }
+        if self.metadata_length_in_ms is not None:
+            # lets post processing trim files without asking MusicBrainz, also when run again later
+            metadata[expected_length_tag] = str(self.metadata_length_in_ms)
+        return metadata
 
     def get_track(self):
         if _underscored_filenames:
@@ -373,7 +477,8 @@ class Spotify:
                 print("[Debug] found metadata from dbust")
                 ff.record(self.out_dir,
                           self.parent.track,
-                          metadata
+                          metadata,
+                          self.parent.get_song_metadata()
                           ) 
 
                 # Give FFmpeg some time to start up before starting the song
@@ -389,19 +494,13 @@ class Spotify:
         # Stop the oldest FFmpeg instance (from recording of song before) (if one is running)
         if len(instances) > 0:
             time.sleep(_recording_time_after_song)
-            # Stop the recording
-            song_infos = song_metadata(
-                self.metadata_artist,
-                self.metadata_title,
-                None,
-                self.metadata_album,
-                None,
-                _download_source
-            )
+            # Stop the recording; the player already moved on, the song is the one the recording was started with
+            song_infos = instances[0].song
             instances[0].stop_blocking()
-            #FIXME maybe collect data of running song here? 
-            connection = initialize_database(_recording_db)
-            insert_new_song(connection,song_infos)
+            if song_infos is not None:
+                start_time = time.perf_counter()
+                _db_manager.record_song(song_infos)
+                log.debug(f"[DB] insert took {(time.perf_counter() - start_time) * 1000:.2f} ms")
             # -> Adding to the database here give the benefit, that songs will only get added once their recording has been finished entirely
 
     # This gets called whenever Spotify sends the playingUriChanged signal
@@ -434,17 +533,12 @@ class Spotify:
     def playing_song_changed(self):
         log.info("[Spotify] Song changed: " + self.track)
         self.send_dbus_cmd("Pause")
-        song_info = song_metadata(
-            artist=self.metadata_artist,
-            title=self.metadata_title,
-            track_id=None,
-            album=self.metadata_album,
-            song_length_in_ms=None,
-            source=_download_source
-        )
+        song_info = self.get_song_metadata()
         print(f"[DEBUG] Found Song Infos From Song:\n{song_info}")
-        db_connection = initialize_database(_recording_db)
-        if song_is_in_db(db_connection,song_info):
+        start_time = time.perf_counter()
+        is_recorded = _db_manager.song_is_recorded(song_info)
+        log.debug(f"[DB] lookup took {(time.perf_counter() - start_time) * 1000:.2f} ms")
+        if is_recorded:
             log.info("[Song Change Spotify] Song already recorded, found in db")
             log.info("[Song Change Spotify] Skipping adding entry")
             self.stop_old_recording(FFmpeg.instances.copy())
@@ -469,6 +563,9 @@ class Spotify:
         self.metadata_title = self.metadata.get(dbus.String(u'xesam:title'))
         self.metadata_trackNumber = str(self.metadata.get(
             dbus.String(u'xesam:trackNumber'))).zfill(2)
+        # exact track duration in microseconds, the primary length for trimming
+        length_in_us = self.metadata.get(dbus.String(u'mpris:length'))
+        self.metadata_length_in_ms = round(int(length_in_us) / 1000) if length_in_us else None
         # https://github.com/patrickziegler/SpotifyRecorder/blob/4c1cc0a5449d0ca8bfb409ef98f4c7a21c73fe0f/spotify_recorder/track.py#L88
         # https://community.spotify.com/t5/Desktop-Linux/MPRIS-cover-art-url-file-not-found/m-p/4929877/highlight/true#M19504
         self.metadata_artUrl = str(self.metadata.get(dbus.String(u'mpris:artUrl'))).replace(
@@ -497,8 +594,10 @@ class FFmpeg:
     instances = []
 
 
-    def record(self, out_dir: str, file: str, metadata_for_file={}):
+    def record(self, out_dir: str, file: str, metadata_for_file={}, song: song_metadata | None = None):
         self.out_dir = out_dir
+        # song being recorded, registered with the file in stop_blocking
+        self.song = song
 
         self.pulse_input = _pa_recording_sink_name + ".monitor"
 
@@ -564,9 +663,16 @@ class FFmpeg:
                         shutil.move(tmp_file, new_file)
                         log.info(
                             f"[FFmpeg] [{self.pid}] Successfully renamed {self.filename}")
-                        # post processing file!
-                        thread_post_process = PostProcessThread(new_file)
-                        thread_post_process.start()
+                        # registering the file before post processing may move it
+                        if self.song is not None:
+                            try:
+                                maybe_metadata = get_metadata_from_file_header(new_file)
+                                _db_manager.record_file(self.song, new_file, _audio_codec,
+                                                        maybe_metadata.song_length_in_ms if maybe_metadata else None)
+                            except (OSError, sqlite3.Error) as error:
+                                log.warning(f"[FFmpeg] [{self.pid}] Failed registering recording {new_file}: {error}")
+                        # post processing file! the recording before is processed now, this one once the next finished
+                        _post_process_chain.add(new_file, self.song.song_length_in_ms if self.song is not None else None)
                         # adding song to database
                         # connection = initialize_database(_recording_db)
                         # insert_new_song(connection,metadata)
@@ -667,15 +773,29 @@ class FFmpeg:
         log.info("[FFmpeg] All instances killed")
 
 class PostProcessThread(Thread):
-    def __init__(self, file_path:str):
+    def __init__(self, file_path:str, expected_length_in_ms:int|None=None, next_recording_path:str|None=None):
         Thread.__init__(self)
         self.file_path = file_path
+        # mpris:length of the recorded song
+        self.expected_length_in_ms = expected_length_in_ms
+        # finished recording of the following song, its start is cut from the end of this one
+        self.next_recording_path = next_recording_path
 
     def run(self):
         # Call your post-processing function here
         # For example: open_and_shorten_song(self.file_path)
         print(f"| -- [Post Processsing] --")
-        open_and_shorten_song(self.file_path)
+        # the song that just finished goes before any backlog reprocessing
+        processed_path = open_and_shorten_song(self.file_path, PRIORITY_RECORDING,
+                                               self.expected_length_in_ms, _musicbrainz_cross_check,
+                                               self.next_recording_path)
+        if processed_path != self.file_path:
+            _db_manager.move_file(self.file_path, processed_path)
+        # the file is final now, hashed here instead of on the RecordThread
+        try:
+            _db_manager.update_file(processed_path)
+        except (OSError, sqlite3.Error) as error:
+            log.warning(f"[Post Processing] Failed hashing recording {processed_path}: {error}")
 
         pass
 
@@ -0,0 +1,74 @@
+# |-- Tests of the bleed detection on synthetic PCM
+# run with: python -m unittest test_bleed_detection (or pytest)
+
+# |--- Internal Imports
+from mod_bleed_detection import find_offset,find_bleed,min_score
+
+# |--- External Imports
+import unittest
+import numpy as np
+
+# |--- Variables
+SAMPLE_RATE:int = 8000
+AMPLITUDE:float = 3000.0
+
+
+def _noise(rng:np.random.Generator,length:int) -> np.ndarray:
+    return rng.standard_normal(length) * AMPLITUDE
+
+def _tail_scoring(rng:np.random.Generator,head:np.ndarray,score:float,offset:int) -> np.ndarray:
+    '''
+    noise with head at offset, mixed with noise orthogonal to it so the match scores exactly score
+    '''
+    mixed = _noise(rng,len(head))
+    mixed -= head * np.dot(mixed,head) / np.dot(head,head)
+    mixed *= (1 / score ** 2 - 1) ** 0.5 * np.linalg.norm(head) / np.linalg.norm(mixed)
+    return np.concatenate((_noise(rng,offset),head + mixed,_noise(rng,1000)))
+
+
+class FindOffsetTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+        self.head = _noise(self.rng,4000)
+
+    def test_threshold(self):
+        # the documented threshold: matches scoring 0.8 or more are cut
+        self.assertEqual(min_score,0.8)
+
+    def test_match_just_above_the_threshold_is_found(self):
+        offset,score = find_offset(_tail_scoring(self.rng,self.head,min_score + 0.01,1500),self.head,SAMPLE_RATE,decimation=1)
+        self.assertEqual(offset,1500)
+        self.assertAlmostEqual(score,min_score + 0.01,places=6)
+
+    def test_match_just_below_the_threshold_is_rejected(self):
+        tail = _tail_scoring(self.rng,self.head,min_score - 0.01,1500)
+        self.assertIsNone(find_offset(tail,self.head,SAMPLE_RATE,decimation=1))
+        offset,score = find_offset(tail,self.head,SAMPLE_RATE,decimation=1,min_score=0.0)
+        self.assertEqual(offset,1500)
+        self.assertAlmostEqual(score,min_score - 0.01,places=6)
+
+
+class FindBleedTest(unittest.TestCase):
+    def test_cut_at_the_start_of_the_next_song(self):
+        rng = np.random.default_rng(3)
+        song_n,song_next = _noise(rng,SAMPLE_RATE),_noise(rng,2 * SAMPLE_RATE)
+        leak = SAMPLE_RATE // 2
+        # N holds the first half second of N+1, then silence; N+1 starts after a silent pre-roll
+        tail = np.concatenate((song_n,song_next[:leak],np.zeros(SAMPLE_RATE)))
+        pre_roll = SAMPLE_RATE // 4
+        head = np.concatenate((np.zeros(pre_roll),song_next))
+        total_samples = 10 * SAMPLE_RATE + len(tail)
+        bleed = find_bleed(tail,total_samples,head,SAMPLE_RATE)
+        self.assertIsNotNone(bleed)
+        self.assertEqual(bleed.start_sample,10 * SAMPLE_RATE + len(song_n))
+        self.assertEqual(bleed.offset_sample,bleed.start_sample - pre_roll)
+        self.assertGreater(bleed.score,0.99)
+
+    def test_unrelated_songs_do_not_match(self):
+        rng = np.random.default_rng(5)
+        tail,head = _noise(rng,2 * SAMPLE_RATE),_noise(rng,2 * SAMPLE_RATE)
+        self.assertIsNone(find_bleed(tail,len(tail),head,SAMPLE_RATE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+# |-- Tests of song_match_key
+# run with: python -m unittest test_data_representation (or pytest)
+
+# |--- Internal Imports
+from mod_data_representation import song_match_key
+
+# |--- External Imports
+import unittest
+
+
+class SongMatchKeyTest(unittest.TestCase):
+    def assertSameKey(self,first:tuple[str,str,str],second:tuple[str,str,str]):
+        self.assertEqual(song_match_key(*first),song_match_key(*second))
+
+    def assertOtherKey(self,first:tuple[str,str,str],second:tuple[str,str,str]):
+        self.assertNotEqual(song_match_key(*first),song_match_key(*second))
+
+    def test_mpris_artist_list_is_keyed_like_featuring(self):
+        # spotrec joins xesam:artist with ", ", tags of other sources name the guest with "feat."
+        self.assertSameKey(("A, B","Song","Album"),("A feat. B","Song","Album"))
+        self.assertSameKey(("Queen, David Bowie","Under Pressure","Hot Space"),("Queen ft. David Bowie","Under Pressure","Hot Space"))
+        self.assertSameKey(("A, B, C","Song","Album"),("A","Song","Album"))
+
+    def test_band_names_stay_whole(self):
+        self.assertOtherKey(("Simon & Garfunkel","Song","Album"),("Simon","Song","Album"))
+        self.assertOtherKey(("AC/DC","Song","Album"),("AC","Song","Album"))
+
+    def test_versions_of_the_same_recording(self):
+        self.assertSameKey(("Beyoncé","Halo - Remastered 2011","I Am... Sasha Fierce (Deluxe Edition)"),
+                           ("beyonce","HALO","I Am... Sasha Fierce"))
+        self.assertSameKey(("A","Song (feat. B)","Album"),("A","Song","Album"))
+
+    def test_other_recordings_keep_their_suffix(self):
+        self.assertOtherKey(("A","Song - Live / Remastered 2011","Album"),("A","Song","Album"))
+        self.assertOtherKey(("A","Song (Remix)","Album"),("A","Song","Album"))
+
+
+if __name__ == "__main__":
+    unittest.main()
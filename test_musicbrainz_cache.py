@@ -0,0 +1,185 @@
+# |-- Offline tests of the MusicBrainz lookup cache
+# musicbrainzngs is replaced by a stub answering from dicts and counting requests,
+# run with: python -m unittest test_musicbrainz_cache (or pytest)
+
+# |--- Internal Imports
+from mod_data_representation import song_metadata
+from mod_musicbrainz_cache import MusicBrainzCache,ReleaseTracklists,id_key,search_key
+import mod_post_process_picard as picard
+
+# |--- External Imports
+from unittest import mock
+import tempfile
+import unittest
+import os
+
+
+class StubMusicBrainz:
+    '''
+    the parts of musicbrainzngs the lookups use; requests are recorded in `requests`
+    '''
+    class WebServiceError(Exception):
+        pass
+
+    class ResponseError(WebServiceError):
+        pass
+
+    def __init__(self,recordings:dict[str,dict]|None=None,search_results:list[dict]|None=None,
+                 releases:dict[str,dict]|None=None):
+        self.recordings = recordings or {}
+        self.search_results = search_results or []
+        self.releases = releases or {}
+        self.requests:list[tuple] = []
+        self.is_offline = False
+
+    def set_useragent(self,*_):
+        pass
+
+    def _request(self,*request):
+        self.requests.append(request)
+        if self.is_offline:
+            raise self.WebServiceError("network unreachable")
+
+    def get_recording_by_id(self,track_id:str,includes:list[str]|None=None) -> dict:
+        self._request("recording",track_id)
+        if track_id not in self.recordings:
+            raise self.ResponseError("404")
+        return {"recording":self.recordings[track_id]}
+
+    def search_recordings(self,**query) -> dict:
+        self._request("search",query["artist"],query["recording"],query["release"])
+        return {"recording-list":[recording for recording in self.search_results
+                                  if recording["title"].lower() == query["recording"].lower()
+                                  and recording["artist-credit"][0]["name"].lower() == query["artist"].lower()]}
+
+    def get_release_by_id(self,release_id:str,includes:list[str]|None=None) -> dict:
+        self._request("release",release_id)
+        return {"release":self.releases[release_id]}
+
+
+def _song(artist:str,title:str,album:str,track_id:str|None=None) -> song_metadata:
+    return song_metadata(artist=artist,title=title,track_id=track_id,album=album,song_length_in_ms=0,source=None)
+
+def _search_result(artist:str,title:str,album:str,release_id:str,length:int) -> dict:
+    return {"title":title,"length":str(length),"artist-credit":[{"name":artist}],
+            "release-list":[{"id":release_id,"title":album}]}
+
+def _release(*tracks:tuple[str,str,int]) -> dict:
+    return {"medium-list":[{"track-list":[{"title":title,"recording":{"id":recording_id,"title":title,"length":str(length)}}
+                                          for recording_id,title,length in tracks]}]}
+
+
+class MusicBrainzCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name,"cache.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_found_and_not_found_are_cached(self):
+        cache = MusicBrainzCache(self.path)
+        fetches = []
+        def fetch(length:int|None):
+            fetches.append(length)
+            return length
+        self.assertEqual(cache.lookup("a",lambda: fetch(1000)),1000)
+        self.assertEqual(cache.lookup("a",lambda: fetch(2000)),1000)
+        self.assertIsNone(cache.lookup("b",lambda: fetch(None)))
+        self.assertIsNone(cache.lookup("b",lambda: fetch(3000)))
+        self.assertEqual(fetches,[1000,None])
+        statistics = cache.statistics()
+        self.assertEqual((statistics["hits"],statistics["negative_hits"],statistics["misses"]),(1,1,2))
+        cache.close()
+
+    def test_expired_entries_are_fetched_again(self):
+        cache = MusicBrainzCache(self.path,ttl_s=-1,negative_ttl_s=-1)
+        cache.put("a",1000)
+        self.assertEqual(cache.get("a"),(False,None))
+        self.assertEqual(cache.statistics()["expired"],1)
+        cache.close()
+
+    def test_least_recently_used_is_evicted(self):
+        cache = MusicBrainzCache(self.path,max_entries=2)
+        cache.put("a",1)
+        cache.put("b",2)
+        with mock.patch("mod_musicbrainz_cache.time.time",return_value=cache.db.execute("SELECT MAX(last_used) FROM lookups;").fetchone()[0] + 1):
+            cache.get("a")
+        cache.put("c",3)
+        self.assertEqual(cache.get("a"),(True,1))
+        self.assertEqual(cache.get("b"),(False,None))
+        self.assertEqual(cache.statistics()["evicted"],1)
+        cache.close()
+
+    def test_entries_and_totals_survive_reopening(self):
+        cache = MusicBrainzCache(self.path)
+        cache.lookup("a",lambda: 1000)
+        cache.lookup("a",lambda: 2000)
+        cache.close()
+        cache = MusicBrainzCache(self.path)
+        self.assertEqual(cache.lookup("a",lambda: 3000),1000)
+        statistics = cache.statistics()
+        self.assertEqual((statistics["hits"],statistics["total_hits"],statistics["total_misses"],statistics["entries"]),(1,2,1,1))
+        cache.close()
+
+
+class CachedLookupTest(unittest.TestCase):
+    '''
+    song_track_length_by_id / _by_artist of mod_post_process_picard against the stub
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = MusicBrainzCache(os.path.join(self.tmp_dir.name,"cache.db"))
+        self.stub = StubMusicBrainz(
+            recordings={"rec-1":{"length":"201000","release-list":[]}},
+            search_results=[_search_result("Queen","Intro","Greatest Hits","rel-queen",120000),
+                            _search_result("ABBA","Intro","Greatest Hits","rel-abba",90000)],
+            releases={"rel-queen":_release(("q-1","Intro",120000),("q-2","Outro",150000)),
+                      "rel-abba":_release(("a-1","Intro",90000),("a-2","Outro",95000))},
+        )
+        for patch in (mock.patch.object(picard,"musicbrainzngs",self.stub),
+                      mock.patch.object(picard,"release_tracklists",ReleaseTracklists()),
+                      mock.patch.object(picard,"_mirror",None),
+                      mock.patch.object(picard,"_request_scheduler",None),
+                      mock.patch.object(picard,"_lookup_cache",self.cache)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_lookup_by_id_is_requested_once(self):
+        self.assertEqual(picard.song_track_length_by_id("rec-1"),201000)
+        self.assertEqual(picard.song_track_length_by_id("REC-1 "),201000)
+        self.assertEqual(self.stub.requests,[("recording","rec-1")])
+        self.assertEqual(self.cache.get(id_key("rec-1")),(True,201000))
+
+    def test_unknown_id_is_cached_as_not_found(self):
+        self.assertIsNone(picard.song_track_length_by_id("missing"))
+        self.assertIsNone(picard.song_track_length_by_id("missing"))
+        self.assertEqual(len(self.stub.requests),1)
+
+    def test_network_errors_are_not_cached(self):
+        self.stub.is_offline = True
+        with self.assertRaises(self.stub.WebServiceError):
+            picard.song_track_length_by_id("rec-1")
+        self.stub.is_offline = False
+        self.assertEqual(picard.song_track_length_by_id("rec-1"),201000)
+        self.assertEqual(len(self.stub.requests),2)
+
+    def test_album_tracklist_answers_the_same_artist_only(self):
+        song = _song("Queen","Intro","Greatest Hits")
+        self.assertEqual(picard.song_track_length_by_artist(song),120000)
+        self.assertEqual(self.stub.requests,[("search","Queen","Intro","Greatest Hits"),("release","rel-queen")])
+        self.assertEqual(self.cache.get(search_key(song)),(True,120000))
+        # the second track comes from the prefetched tracklist
+        self.assertEqual(picard.song_track_length_by_artist(_song("Queen","Outro","Greatest Hits")),150000)
+        self.assertEqual(len(self.stub.requests),2)
+        # an album of the same name by another artist is looked up on its own
+        self.assertEqual(picard.song_track_length_by_artist(_song("ABBA","Intro","Greatest Hits")),90000)
+        self.assertEqual(self.stub.requests[2],("search","ABBA","Intro","Greatest Hits"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# |-- Offline tests of the MusicBrainz mirror index
+# imports the tiny dump in fixtures/mbdump (same table layout as a MusicBrainz mbdump)
+# and looks songs up in it, run with: python -m unittest test_musicbrainz_mirror (or pytest)
+
+# |--- Internal Imports
+from mod_data_representation import song_metadata
+from mod_musicbrainz_mirror import MusicBrainzMirror
+from tool_import_musicbrainz_dump import import_dump
+import mod_post_process_picard as picard
+
+# |--- External Imports
+from unittest import mock
+import tempfile
+import unittest
+import time
+import os
+
+# |--- Variables
+FIXTURE_DUMP:str = os.path.join(os.path.dirname(os.path.abspath(__file__)),"fixtures","mbdump")
+BOHEMIAN_RHAPSODY:str = "b1a9c0de-0000-4000-8000-000000000011"
+
+
+def _song(artist:str,title:str,album:str,track_id:str|None=None) -> song_metadata:
+    return song_metadata(artist=artist,title=title,track_id=track_id,album=album,song_length_in_ms=0,source=None)
+
+
+class MusicBrainzMirrorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp_dir.name,"mirror.db")
+        cls.statistics = import_dump(FIXTURE_DUMP,cls.path)
+        cls.mirror = MusicBrainzMirror(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mirror.close()
+        cls.tmp_dir.cleanup()
+
+    def test_import_keeps_rows_with_a_length(self):
+        # the demo recording and its track have no length
+        self.assertEqual(self.statistics,{"recordings":5,"tracks":6})
+
+    def test_import_replaces_an_existing_index(self):
+        path = os.path.join(self.tmp_dir.name,"again.db")
+        import_dump(FIXTURE_DUMP,path)
+        self.assertEqual(import_dump(FIXTURE_DUMP,path),self.statistics)
+
+    def test_length_by_id(self):
+        self.assertEqual(self.mirror.length_by_id(BOHEMIAN_RHAPSODY),354320)
+        # the dump holds it in upper case, ids are compared lower case and stripped
+        self.assertEqual(self.mirror.length_by_id(f" {BOHEMIAN_RHAPSODY.upper()} "),354320)
+        self.assertIsNone(self.mirror.length_by_id("b1a9c0de-0000-4000-8000-000000000015"))
+        self.assertIsNone(self.mirror.length_by_id("00000000-0000-0000-0000-000000000000"))
+
+    def test_length_by_song_prefers_the_release_named_like_the_album(self):
+        self.assertEqual(self.mirror.length_by_song(_song("Queen","Bohemian Rhapsody","A Night at the Opera")),355000)
+        self.assertEqual(self.mirror.length_by_song(_song("Queen","Bohemian Rhapsody","Greatest Hits")),354000)
+        self.assertIn(self.mirror.length_by_song(_song("Queen","Bohemian Rhapsody","Live Aid")),(354000,355000))
+
+    def test_length_by_song_falls_back_to_title_and_album(self):
+        # credited to "Queen & David Bowie", the track has no length of its own
+        self.assertEqual(self.mirror.length_by_song(_song("Queen & David Bowie","Under Pressure","Greatest Hits")),248000)
+        self.assertEqual(self.mirror.length_by_song(_song("Queen","Under Pressure","Greatest Hits")),248000)
+        self.assertIsNone(self.mirror.length_by_song(_song("Queen","Under Pressure","Hot Space")))
+
+    def test_names_are_unescaped_and_normalized(self):
+        self.assertEqual(self.mirror.length_by_song(_song("ABBA","Tab\tName","Greatest Hits")),100000)
+        self.assertEqual(self.mirror.length_by_song(_song("  beyoncé ","HALO","i am... sasha fierce")),261000)
+        self.assertIsNone(self.mirror.length_by_song(_song("ABBA","Waterloo","Greatest Hits")))
+
+    def test_lookups_take_less_than_a_millisecond(self):
+        song = _song("ABBA","Dancing Queen","Greatest Hits")
+        amount_lookups = 2000
+        start_time = time.perf_counter()
+        for _ in range(amount_lookups):
+            self.mirror.length_by_id(BOHEMIAN_RHAPSODY)
+            self.mirror.length_by_song(song)
+        self.assertLess((time.perf_counter() - start_time) / (2 * amount_lookups),0.001)
+
+    def test_post_processing_asks_the_mirror_only(self):
+        # any use of musicbrainzngs fails on the empty spec
+        with mock.patch.object(picard,"_mirror",self.mirror),mock.patch.object(picard,"musicbrainzngs",mock.Mock(spec=[])):
+            self.assertEqual(picard.song_track_length_by_id(BOHEMIAN_RHAPSODY),354320)
+            self.assertEqual(picard.song_track_length_by_artist(_song("ABBA","Dancing Queen","Greatest Hits")),231000)
+
+
+if __name__ == "__main__":
+    unittest.main()
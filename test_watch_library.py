@@ -0,0 +1,80 @@
+# |-- Offline tests of the debounced batches of tool_watch_library
+# inotify is replaced by a stub replaying scripted events on a fake clock,
+# run with: python -m unittest test_watch_library (or pytest)
+
+# |--- Internal Imports
+from mod_inotify import inotify_event,IN_CLOSE_WRITE
+import tool_watch_library
+
+# |--- External Imports
+from unittest import mock
+import tempfile
+import unittest
+
+
+class StubInotify:
+    '''
+    replays (time_in_s,name) writes of folder wd 1; read_events advances the clock
+    to the next write, or by the whole timeout when none is due before
+    '''
+    def __init__(self,writes:list[tuple[float,str]]):
+        self.writes = sorted(writes)
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def read_events(self,timeout_s:float|None) -> list[inotify_event]:
+        if self.writes and self.writes[0][0] <= self.now + timeout_s:
+            time_in_s,name = self.writes.pop(0)
+            self.now = max(self.now,time_in_s)
+            return [inotify_event(1,IN_CLOSE_WRITE,0,name)]
+        self.now += timeout_s
+        return []
+
+    def close(self):
+        pass
+
+
+class DebounceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def _run(self,writes:list[tuple[float,str]],stop_after_s:float) -> list[tuple[float,list[str]]]:
+        '''
+        returns (time,paths) of every applied batch
+        '''
+        watcher = tool_watch_library.LibraryWatcher(None,self.tmp_dir.name,None,debounce_ms=1000,max_delay_ms=10_000)
+        watcher.inotify.close()
+        stub = StubInotify(writes)
+        watcher.inotify = stub
+        watcher.watched = {1:watcher.collection_path}
+        batches = []
+        def apply():
+            batches.append((stub.now,sorted(watcher.touched)))
+            watcher.touched.clear()
+        with mock.patch.object(watcher,"rescan"),mock.patch.object(watcher,"_apply",apply),\
+             mock.patch.object(tool_watch_library.time,"monotonic",stub.monotonic):
+            watcher.run(stop_after_s=stop_after_s)
+        return batches
+
+    def test_other_files_do_not_open_a_batch(self):
+        # the cover was written long before the songs, it must not count towards max_delay
+        songs = [(30.0 + 0.2 * i,f"{i}.flac") for i in range(5)]
+        batches = self._run([(1.0,"cover.jpg")] + songs,stop_after_s=60.0)
+        self.assertEqual(len(batches),1)
+        applied_at,paths = batches[0]
+        self.assertGreaterEqual(applied_at,songs[-1][0] + 1.0)
+        self.assertEqual([path.rsplit("/",1)[1] for path in paths],[name for _,name in songs])
+
+    def test_long_bursts_are_applied_after_max_delay(self):
+        songs = [(1.0 + 0.5 * i,f"{i}.flac") for i in range(30)]
+        batches = self._run(songs,stop_after_s=60.0)
+        self.assertEqual(len(batches),2)
+        self.assertGreaterEqual(batches[0][0],11.0)
+        self.assertLess(batches[0][0],12.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
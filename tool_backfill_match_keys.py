@@ -0,0 +1,31 @@
+# Tool to (re-)compute the normalized match_key of songs in the database.
+# ---| needed after song_match_key changed, or for rows written by other tools
+
+import os
+import argparse
+from mod_db_interface import initialize_database,backfill_match_keys
+
+if __name__ == "__main__":
+    print("|--- Backfilling match keys")
+
+    parser = argparse.ArgumentParser(prog="Recording-Match-Key-Backfill",
+                                     usage="compute match keys of songs in database",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    parser.add_argument("-db","--database",
+                        help="path to recording.db",
+                        required=True
+                        )
+    parser.add_argument("-a","--all",
+                        help="recompute keys of all songs, not only of those without key",
+                        action="store_true",default=False)
+
+    arguments = parser.parse_args()
+
+    if not os.path.isfile(arguments.database):
+        print("|-[Warning] - database path invalid")
+        exit()
+
+    db_connection = initialize_database(arguments.database)
+    amount_updated = backfill_match_keys(db_connection,only_missing=not arguments.all)
+    print(f"|- updated {amount_updated} songs")
@@ -0,0 +1,777 @@
+# Benchmarks for the recording-db and the tooling around it.
+# ---| each subcommand fills a temporary db with synthetic songs and prints timings
+
+import argparse
+import array
+import contextlib
+import math
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import struct
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+from mutagen import id3,flac,mp3
+from pydub import AudioSegment
+
+from mod_db_interface import initialize_database,song_is_in_db,insert_new_song,query_artist_id,insert_songs_bulk,search_songs,ConnectionManager,RecordedSongSet
+from mod_data_representation import song_metadata,song_match_key
+from mod_post_process_picard import get_metadata_from_file,get_metadata_from_file_header,music_range
+from mod_trim import trim_file
+from mod_boundary_detection import detect_music_boundaries
+from mod_bleed_detection import find_bleed_in_session,RecordingChain
+from pathlib import Path
+from tool_recover_db_from_files import iter_metadata_from_songs,iter_songs_to_parse
+
+# ---|--- helpers
+def synthetic_song(index:int) -> song_metadata:
+    return song_metadata(
+        artist=f"Artist {index % 5000}",
+        title=f"Title {index}",
+        track_id=None,
+        album=f"Album {index // 12}",
+        song_length_in_ms=None,
+        source="Spotify",
+    )
+
+def fill_synthetic_db(db_path:str,amount_songs:int) -> sqlite3.Connection:
+    '''
+    creates a db at db_path holding amount_songs synthetic songs,
+    inserted directly to keep setup time low for large sizes
+    '''
+    db = initialize_database(db_path)
+    db.executemany("INSERT INTO artists (id, name) VALUES (?,?);",
+                   ((index,f"Artist {index}") for index in range(min(amount_songs,5000))))
+    db.executemany("INSERT INTO songs (artist_id, title, album, source_id, match_key) VALUES (?,?,?,3,?);",
+                   ((index % 5000,song.title,song.album,song_match_key(song.artist,song.title,song.album))
+                    for index,song in enumerate(map(synthetic_song,range(amount_songs)))))
+    db.commit()
+    return db
+
+def write_synthetic_flac(path:str,song:song_metadata,total_samples:int=44100 * 200,picture_bytes:int=0):
+    '''
+    writes a FLAC file holding only STREAMINFO, VORBIS_COMMENT and an optional PICTURE,
+    no audio frames; enough for tag readers
+    '''
+    def block(block_type:int,data:bytes,is_last:bool=False) -> bytes:
+        return bytes([(0x80 if is_last else 0) | block_type]) + len(data).to_bytes(3,"big") + data
+
+    # sample rate (20 bit), channels - 1 (3 bit), bits per sample - 1 (5 bit), total samples (36 bit)
+    stream_info = struct.pack(">HH",4096,4096) + bytes(6) \
+        + ((44100 << 44) | (1 << 41) | (15 << 36) | total_samples).to_bytes(8,"big") + bytes(16)
+    comments = [f"TITLE={song.title}",f"ARTIST={song.artist}",f"ALBUM={song.album}"]
+    if song.track_id is not None:
+        comments.append(f"MUSICBRAINZ_TRACKID={song.track_id}")
+    vendor = b"SpotRec synthetic"
+    vorbis_comment = struct.pack("<I",len(vendor)) + vendor + struct.pack("<I",len(comments)) \
+        + b"".join(struct.pack("<I",len(comment.encode())) + comment.encode() for comment in comments)
+    with open(path,"wb") as file:
+        if picture_bytes:
+            file.write(b"fLaC" + block(0,stream_info) + block(4,vorbis_comment) + block(6,bytes(picture_bytes),is_last=True))
+        else:
+            file.write(b"fLaC" + block(0,stream_info) + block(4,vorbis_comment,is_last=True))
+
+def write_synthetic_mp3(path:str,song:song_metadata,amount_frames:int=100,id3_version:int=4,
+                        text_encoding:int=3,vbr_header:bool=True,picture_bytes:int=0):
+    '''
+    writes an MP3 file of silent MPEG-1 layer 3 frames (128 kbit/s, 44.1 kHz)
+    with a Xing/LAME header in the first frame and an ID3v2 tag
+    '''
+    frame_header = bytes((0xFF,0xFB,0x90,0x00))
+    frame_length = 417
+    audio = bytearray()
+    if vbr_header:
+        # frames, bytes, toc, vbr scale, then the LAME extension with 576 delay and 1000 padding
+        xing = b"Xing" + struct.pack(">IIII",0xF,amount_frames,amount_frames * frame_length,0) \
+            + bytes(96) + struct.pack(">I",50)
+        lame = b"LAME3.100" + bytes(12) + bytes((576 >> 4,((576 & 0xF) << 4) | (1000 >> 8),1000 & 0xFF)) + bytes(12)
+        first_frame = frame_header + bytes(32) + xing + lame
+        audio += first_frame + bytes(frame_length - len(first_frame))
+    for _ in range(amount_frames):
+        audio += frame_header + bytes(frame_length - 4)
+    with open(path,"wb") as file:
+        file.write(audio)
+
+    tags = id3.ID3()
+    tags.add(id3.TIT2(encoding=text_encoding,text=song.title))
+    tags.add(id3.TPE1(encoding=text_encoding,text=song.artist))
+    tags.add(id3.TALB(encoding=text_encoding,text=song.album))
+    if song.track_id is not None:
+        tags.add(id3.UFID(owner="http://musicbrainz.org",data=song.track_id.encode()))
+        tags.add(id3.TXXX(encoding=text_encoding,desc="MusicBrainz Release Track Id",text=song.track_id))
+    if picture_bytes:
+        tags.add(id3.APIC(encoding=3,mime="image/jpeg",type=3,desc="Cover",data=bytes(picture_bytes)))
+    tags.save(path,v2_version=id3_version)
+
+def _crc16_flac_table() -> list[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+_CRC16_FLAC_TABLE = _crc16_flac_table()
+
+def _crc16_flac(data:bytes,crc:int=0) -> int:
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_FLAC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+def _crc8_flac(data:bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+def tone_block(frequency_cycles:int,blocksize:int=4096,amplitude:float=0.5) -> bytes:
+    '''
+    interleaved stereo int16 PCM (little endian) of one block holding
+    frequency_cycles whole sine periods, so repeated blocks continue seamlessly
+    '''
+    samples = array.array("h")
+    for index in range(blocksize):
+        value = int(32767 * amplitude * math.sin(2 * math.pi * frequency_cycles * index / blocksize))
+        samples.extend((value,value))
+    return samples.tobytes()
+
+def write_pcm_flac(path:str,song:song_metadata,blocks:list[bytes],sample_rate:int=44100,blocksize:int=4096):
+    '''
+    writes blocks of interleaved stereo int16 PCM as a real FLAC stream (verbatim subframes,
+    fixed block size, seektable every 10 s); the frame CRCs are computed once per distinct block
+    '''
+    total_samples = sum(len(block) // 4 for block in blocks)
+    stream_info = struct.pack(">HH",blocksize,blocksize) + bytes(6) \
+        + ((sample_rate << 44) | (1 << 41) | (15 << 36) | total_samples).to_bytes(8,"big") + bytes(16)
+    comments = [f"TITLE={song.title}",f"ARTIST={song.artist}",f"ALBUM={song.album}"]
+    vendor = b"SpotRec synthetic"
+    vorbis_comment = struct.pack("<I",len(vendor)) + vendor + struct.pack("<I",len(comments)) \
+        + b"".join(struct.pack("<I",len(comment.encode())) + comment.encode() for comment in comments)
+    seek_samples = list(range(0,total_samples,10 * sample_rate // blocksize * blocksize))
+
+    # crc(header + payload) = crc(payload) ^ crc(crc(header), zeros); the latter is linear in crc(header)
+    payload_crcs:dict[bytes,tuple[int,list[int]]] = {}
+    def frame_crc(header:bytes,payload:bytes) -> int:
+        if payload not in payload_crcs:
+            zeros = bytes(len(payload))
+            payload_crcs[payload] = (_crc16_flac(payload),[_crc16_flac(zeros,1 << bit) for bit in range(16)])
+        payload_crc,columns = payload_crcs[payload]
+        header_crc = _crc16_flac(header)
+        for bit in range(16):
+            if header_crc >> bit & 1:
+                payload_crc ^= columns[bit]
+        return payload_crc
+
+    frames = bytearray()
+    frame_offsets = []
+    for number,block in enumerate(blocks):
+        samples = array.array("h",block)
+        samples.byteswap()
+        amount_samples = len(samples) // 2
+        # verbatim subframe (type 1) per channel, big endian samples
+        payload = b"\x02" + samples[0::2].tobytes() + b"\x02" + samples[1::2].tobytes()
+        # frame numbers use the UTF-8 scheme, surrogate values included
+        coded_number = chr(number).encode("utf-8","surrogatepass")
+        if amount_samples == blocksize:
+            # block size 4096 (code 12), 44.1 kHz (code 9), independent stereo, 16 bit
+            header = bytes((0xFF,0xF8,0xC9,0x18)) + coded_number
+        else:
+            header = bytes((0xFF,0xF8,0x79,0x18)) + coded_number + (amount_samples - 1).to_bytes(2,"big")
+        header += bytes((_crc8_flac(header),))
+        frame_offsets.append(len(frames))
+        frames += header + payload + frame_crc(header,payload).to_bytes(2,"big")
+    seektable = b"".join(struct.pack(">QQH",sample,frame_offsets[sample // blocksize],blocksize) for sample in seek_samples)
+
+    def block(block_type:int,data:bytes,is_last:bool=False) -> bytes:
+        return bytes([(0x80 if is_last else 0) | block_type]) + len(data).to_bytes(3,"big") + data
+    with open(path,"wb") as file:
+        file.write(b"fLaC" + block(0,stream_info) + block(3,seektable) + block(4,vorbis_comment,is_last=True))
+        file.write(frames)
+
+def write_tag_corpus(dir_path:str,amount_files:int,picture_bytes:int) -> list[str]:
+    '''
+    FLAC and MP3 files with a mix of ID3 versions and text encodings,
+    every tenth MP3 has no Xing header (read by the mutagen fallback)
+    '''
+    paths = []
+    for index in range(amount_files):
+        song = synthetic_song(index)._replace(
+            title=f"Tïtle {index} (feat. Ärtist)" if index % 3 == 0 else f"Title {index}",
+            track_id=f"00000000-0000-4000-8000-{index:012d}" if index % 4 < 2 else None,
+        )
+        path = os.path.join(dir_path,f"{index:06d}")
+        if index % 2 == 0:
+            path += ".flac"
+            write_synthetic_flac(path,song,picture_bytes=picture_bytes)
+        else:
+            path += ".mp3"
+            write_synthetic_mp3(path,song,id3_version=3 + (index // 2) % 2,text_encoding=(index // 4) % 4,
+                                vbr_header=index % 10 != 1,picture_bytes=picture_bytes)
+        paths.append(path)
+    return paths
+
+def write_synthetic_corpus(dir_path:str,amount_files:int,files_per_album:int=12) -> list[str]:
+    paths = []
+    for index in range(amount_files):
+        song = synthetic_song(index)
+        album_dir = os.path.join(dir_path,song.artist,song.album)
+        os.makedirs(album_dir,exist_ok=True)
+        path = os.path.join(album_dir,f"{index % files_per_album:02d} {song.title}.flac")
+        write_synthetic_flac(path,song)
+        paths.append(path)
+    return paths
+
+def print_timings(label:str,timings_in_s:list[float]):
+    as_ms = sorted(t * 1000 for t in timings_in_s)
+    p50 = as_ms[len(as_ms) // 2]
+    p99 = as_ms[min(len(as_ms) - 1,int(len(as_ms) * 0.99))]
+    print(f"|- {label:<40} n={len(as_ms):<8} mean={statistics.fmean(as_ms):8.3f} ms  p50={p50:8.3f} ms  p99={p99:8.3f} ms")
+
+# ---|--- benchmarks
+def bench_connection(amount_songs:int):
+    '''
+    per-song lookup + insert as done on every track change:
+    fresh connection per call (old behaviour) vs. shared ConnectionManager
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir,"fresh.db")
+        initialize_database(db_path).close()
+        lookups,commits = [],[]
+        for index in range(amount_songs):
+            song = synthetic_song(index)
+            start = time.perf_counter()
+            song_is_in_db(initialize_database(db_path),song)
+            lookups.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            insert_new_song(initialize_database(db_path),song)
+            commits.append(time.perf_counter() - start)
+        print_timings("fresh connection | lookup",lookups)
+        print_timings("fresh connection | insert",commits)
+
+        manager = ConnectionManager(os.path.join(tmp_dir,"shared.db"))
+        lookups,commits = [],[]
+        for index in range(amount_songs):
+            song = synthetic_song(index)
+            start = time.perf_counter()
+            with manager.connection() as db:
+                song_is_in_db(db,song)
+            lookups.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            with manager.connection() as db:
+                insert_new_song(db,song)
+            commits.append(time.perf_counter() - start)
+        manager.close()
+        print_timings("shared connection (WAL) | lookup",lookups)
+        print_timings("shared connection (WAL) | insert",commits)
+
+def _legacy_song_is_in_db(db:sqlite3.Connection,song:song_metadata) -> bool:
+    # two-query lookup used before the songs index existed
+    maybe_artist_id = query_artist_id(db,song.artist)
+    if maybe_artist_id is None:
+        return False
+    cursor = db.cursor()
+    cursor.execute("SELECT artist_id,title,album,source_id  FROM songs WHERE title = ? AND album = ? AND artist_id = ?;",(song.title,song.album,maybe_artist_id,))
+    return cursor.fetchone() is not None
+
+def bench_lookup(sizes:list[int],amount_lookups:int):
+    '''
+    song_is_in_db on synthetic dbs of increasing size,
+    half of the lookups hit, half miss
+    '''
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = fill_synthetic_db(os.path.join(tmp_dir,"lookup.db"),size)
+            songs = [synthetic_song(random.randrange(size * 2)) for _ in range(amount_lookups)]
+            timings = []
+            for song in songs:
+                start = time.perf_counter()
+                song_is_in_db(db,song)
+                timings.append(time.perf_counter() - start)
+            print_timings(f"{size} rows | indexed lookup",timings)
+
+            # legacy lookup is a full scan (no index on artist_id, title, album) -> limit amount of lookups
+            timings = []
+            for song in songs[:max(10,amount_lookups // 100)]:
+                start = time.perf_counter()
+                _legacy_song_is_in_db(db,song)
+                timings.append(time.perf_counter() - start)
+            print_timings(f"{size} rows | legacy, no index",timings)
+            db.close()
+
+def bench_dedupe(size:int,amount_lookups:int):
+    '''
+    load time, memory footprint and membership check of RecordedSongSet
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = fill_synthetic_db(os.path.join(tmp_dir,"dedupe.db"),size)
+        songs = [synthetic_song(random.randrange(size * 2)) for _ in range(amount_lookups)]
+        for use_bloom_filter in (False,True):
+            label = "bloom filter" if use_bloom_filter else "hash set"
+            recorded_songs = RecordedSongSet(use_bloom_filter=use_bloom_filter)
+            start = time.perf_counter()
+            recorded_songs.load(db)
+            load_time = time.perf_counter() - start
+            # second load under tracemalloc, which would distort the load time
+            tracemalloc.start()
+            recorded_songs = RecordedSongSet(use_bloom_filter=use_bloom_filter)
+            recorded_songs.load(db)
+            footprint,peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"|- {size} rows | {label}: load {load_time:.2f} s, footprint {footprint / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB")
+            timings = []
+            for song in songs:
+                start = time.perf_counter()
+                recorded_songs.might_contain(song)
+                timings.append(time.perf_counter() - start)
+            print_timings(f"{size} rows | {label} membership",timings)
+        db.close()
+
+def bench_bulk(amount_songs:int,chunk_size:int):
+    '''
+    rebuilding a library: insert_new_song per song vs. insert_songs_bulk
+    '''
+    songs = [synthetic_song(index) for index in range(amount_songs)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = initialize_database(os.path.join(tmp_dir,"per_song.db"))
+        start = time.perf_counter()
+        for song in songs:
+            insert_new_song(db,song)
+        print(f"|- {amount_songs} songs | insert_new_song: {time.perf_counter() - start:.2f} s")
+        db.close()
+
+        db = initialize_database(os.path.join(tmp_dir,"bulk.db"))
+        start = time.perf_counter()
+        inserted,skipped = insert_songs_bulk(db,songs,chunk_size)
+        print(f"|- {amount_songs} songs | insert_songs_bulk: {time.perf_counter() - start:.2f} s ({inserted} inserted, {skipped} skipped)")
+        start = time.perf_counter()
+        inserted,skipped = insert_songs_bulk(db,songs,chunk_size)
+        print(f"|- {amount_songs} songs | insert_songs_bulk, all known: {time.perf_counter() - start:.2f} s ({inserted} inserted, {skipped} skipped)")
+        db.close()
+
+def bench_writer(amount_songs:int,synchronous:str):
+    '''
+    latency of record_song() seen by the recording thread:
+    synchronous commit vs. queued to the SongWriter
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for use_writer in (False,True):
+            label = "group-commit writer" if use_writer else "synchronous commit"
+            manager = ConnectionManager(os.path.join(tmp_dir,f"writer_{use_writer}.db"))
+            with manager.connection() as db:
+                db.execute(f"PRAGMA synchronous = {synchronous};")
+            if use_writer:
+                manager.start_writer()
+            timings = []
+            start_total = time.perf_counter()
+            for index in range(amount_songs):
+                song = synthetic_song(index)
+                start = time.perf_counter()
+                manager.record_song(song)
+                timings.append(time.perf_counter() - start)
+                assert manager.song_is_recorded(song)
+            manager.close()
+            print_timings(f"synchronous={synchronous} | {label}",timings)
+            print(f"|- {'':<40} total incl. flush {time.perf_counter() - start_total:.2f} s")
+
+def bench_normalize(amount_songs:int):
+    '''
+    throughput of song_match_key on varied synthetic titles
+    '''
+    decorations = ["", " - Remastered 2011", " (feat. Someone Else)", " [Deluxe Edition]", " - Live", " (Radio Edit)"]
+    songs = [
+        (f"Ärtist {index % 977}, Guest {index % 13}",f"Tïtle {index}{decorations[index % len(decorations)]}",f"Album {index // 12}{decorations[index % 4]}")
+        for index in range(amount_songs)
+    ]
+    start = time.perf_counter()
+    for artist,title,album in songs:
+        song_match_key(artist,title,album)
+    duration = time.perf_counter() - start
+    print(f"|- song_match_key: {amount_songs} keys in {duration:.2f} s -> {amount_songs / duration:,.0f} keys/s")
+
+def bench_search(size:int,amount_queries:int):
+    '''
+    full text search via songs_fts vs. LIKE scans over songs/artists
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start = time.perf_counter()
+        db = fill_synthetic_db(os.path.join(tmp_dir,"search.db"),size)
+        print(f"|- {size} rows | filled incl. fts triggers in {time.perf_counter() - start:.2f} s")
+        terms = [str(random.randrange(size)) for _ in range(amount_queries)]
+        timings = []
+        for term in terms:
+            start = time.perf_counter()
+            for _ in search_songs(db,f'"{term}"'):
+                pass
+            timings.append(time.perf_counter() - start)
+        print_timings(f"{size} rows | fts5 match",timings)
+        timings = []
+        for term in terms:
+            start = time.perf_counter()
+            for _ in db.execute("""SELECT songs.title, artists.name, songs.album FROM songs
+                                JOIN artists ON artists.id = songs.artist_id
+                                WHERE songs.title LIKE ?1 OR songs.album LIKE ?1 OR artists.name LIKE ?1;""",(f"%{term}%",)):
+                pass
+            timings.append(time.perf_counter() - start)
+        print_timings(f"{size} rows | LIKE scan",timings)
+        db.close()
+
+def bench_extract(amount_files:int,jobs:list[int],latency_ms:float):
+    '''
+    files/s of iter_metadata_from_songs for different amounts of workers,
+    latency_ms emulates the round trip of a network mount per file
+    '''
+    def extract(path:str) -> song_metadata|None:
+        time.sleep(latency_ms / 1000)
+        return get_metadata_from_file(path)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_synthetic_corpus(tmp_dir,amount_files)
+        for amount_jobs in jobs:
+            start = time.perf_counter()
+            # the extraction prints per file
+            with contextlib.redirect_stdout(open(os.devnull,"w")):
+                amount_extracted = sum(1 for _ in iter_metadata_from_songs(paths,amount_jobs,extract=extract))
+            duration = time.perf_counter() - start
+            print(f"|- {amount_files} files, {latency_ms} ms latency | jobs={amount_jobs:<3} {amount_extracted / duration:8.0f} files/s")
+
+def _legacy_collect_songs(dir_path:str,ignore_paths:list[str]|None) -> list[str]:
+    # rglob over the whole tree, filtering afterwards (used before iter_songs_to_parse)
+    p = Path(dir_path)
+    collected_songs = []
+    for f in p.rglob("*"):
+        if not f.is_file() or f.suffix.lower() not in (".flac",".mp3"):
+            continue
+        rel_parts = f.relative_to(p).parts
+        if any(part.startswith('.') for part in rel_parts):
+            continue
+        if ignore_paths:
+            ignore_set = {s.lower().strip() for s in ignore_paths}
+            if any(part.lower() in ignore_set for part in rel_parts):
+                continue
+        collected_songs.append(str(f.resolve()))
+    collected_songs.sort()
+    return collected_songs
+
+def write_wide_tree(dir_path:str,amount_artists:int,amount_junk:int):
+    # artists with two albums of six (empty) songs each, plus a hidden and an ignored folder full of junk
+    for artist in range(amount_artists):
+        for album in range(2):
+            album_dir = os.path.join(dir_path,f"Artist {artist}",f"Album {album}")
+            os.makedirs(album_dir)
+            for track in range(6):
+                open(os.path.join(album_dir,f"{track:02d} Title.flac"),"w").close()
+            open(os.path.join(album_dir,"cover.jpg"),"w").close()
+    for junk_dir in (".git/objects","Trash"):
+        for index in range(amount_junk):
+            sub_dir = os.path.join(dir_path,junk_dir,f"{index % 256:02x}")
+            os.makedirs(sub_dir,exist_ok=True)
+            open(os.path.join(sub_dir,f"{index}.flac"),"w").close()
+
+def bench_walk(amount_artists:int,amount_junk:int,jobs:int):
+    '''
+    collecting songs of a wide tree with a large hidden and ignored folder:
+    rglob + filtering (old) vs. pruning scandir generator,
+    followed by the end-to-end throughput of walking and parsing
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_wide_tree(tmp_dir,amount_artists,amount_junk)
+        ignore_paths = ["trash"]
+
+        start = time.perf_counter()
+        legacy_songs = _legacy_collect_songs(tmp_dir,ignore_paths)
+        duration = time.perf_counter() - start
+        print(f"|- rglob + filter        {len(legacy_songs)} songs {duration * 1000:9.1f} ms")
+
+        start = time.perf_counter()
+        walker = iter_songs_to_parse(tmp_dir,ignore_paths)
+        next(walker)
+        first_path = time.perf_counter() - start
+        amount_songs = 1 + sum(1 for _ in walker)
+        duration = time.perf_counter() - start
+        print(f"|- scandir generator     {amount_songs} songs {duration * 1000:9.1f} ms  (first path after {first_path * 1000:.2f} ms)")
+        assert sorted(iter_songs_to_parse(tmp_dir,ignore_paths)) == legacy_songs
+
+        # empty files carry no metadata, the walk still feeds every one of them to the parser
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull,"w")):
+            for _ in iter_metadata_from_songs(iter_songs_to_parse(tmp_dir,ignore_paths),jobs):
+                pass
+        duration = time.perf_counter() - start
+        print(f"|- walk + parse jobs={jobs:<3}  {amount_songs / duration:8.0f} files/s")
+
+def bench_tags(amount_files:int,picture_bytes:int):
+    '''
+    header-only tag reader vs. full mutagen parse on a generated corpus,
+    results of both have to be equal
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = write_tag_corpus(tmp_dir,amount_files,picture_bytes)
+        results = {}
+        for label,extract in (("mutagen",get_metadata_from_file),("header-only (mmap)",get_metadata_from_file_header)):
+            start = time.perf_counter()
+            # the extraction prints per file
+            with contextlib.redirect_stdout(open(os.devnull,"w")):
+                results[label] = [extract(path) for path in paths]
+            duration = time.perf_counter() - start
+            print(f"|- {label:<20} {amount_files} files, {picture_bytes} B cover | {amount_files / duration:8.0f} files/s")
+        mismatches = [path for path,full,header in zip(paths,*results.values()) if full != header]
+        print(f"|- {amount_files - len(mismatches)}/{amount_files} results equal")
+        for path in mismatches[:5]:
+            print(f"|-[Warning] - mismatch for {path}")
+
+def bench_trim(length_in_s:int,repeats:int):
+    '''
+    stream-copy trimming of a length_in_s FLAC and MP3 to 2/3 of their length vs. pydub
+    decoding, slicing and exporting the same PCM (as WAV, pydub reads and writes it without ffmpeg;
+    the FLAC re-encode of the post-processing adds the encoder on top)
+    '''
+    song = synthetic_song(0)
+    blocks = [tone_block(40)] * (length_in_s * 44100 // 4096)
+    target_in_ms = length_in_s * 1000 * 2 // 3
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        originals = {"flac":os.path.join(tmp_dir,"original.flac"),"mp3":os.path.join(tmp_dir,"original.mp3"),
+                     "wav":os.path.join(tmp_dir,"original.wav")}
+        write_pcm_flac(originals["flac"],song,blocks)
+        write_synthetic_mp3(originals["mp3"],song,amount_frames=length_in_s * 44100 // 1152)
+        with wave.open(originals["wav"],"wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(44100)
+            file.writeframes(b"".join(blocks))
+
+        def trim_with_pydub(path:str,length_in_ms:float) -> float:
+            segment = AudioSegment.from_file(path,format="wav")[:length_in_ms]
+            segment.export(path,format="wav")
+            return len(segment)
+
+        for label,suffix,trim in (("stream copy",  "flac",trim_file),("stream copy","mp3",trim_file),
+                                  ("pydub decode","wav",trim_with_pydub)):
+            path = os.path.join(tmp_dir,f"trimmed.{suffix}")
+            timings = []
+            for _ in range(repeats):
+                shutil.copyfile(originals[suffix],path)
+                start = time.perf_counter()
+                new_length_in_ms = trim(path,target_in_ms)
+                timings.append(time.perf_counter() - start)
+            shutil.copyfile(originals[suffix],path)
+            tracemalloc.start()
+            trim(path,target_in_ms)
+            _,peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"|- {label:<12} {suffix:<4} {os.path.getsize(originals[suffix]) / 2**20:6.1f} MiB -> {target_in_ms} ms "
+                  f"(got {new_length_in_ms:.0f} ms) | median {statistics.median(timings) * 1000:8.2f} ms, peak {peak / 2**20:7.2f} MiB")
+        print(f"|- tags kept: {flac.FLAC(os.path.join(tmp_dir,'trimmed.flac')).tags['title'] == [song.title]}, "
+              f"{str(mp3.MP3(os.path.join(tmp_dir,'trimmed.mp3')).tags['TIT2']) == song.title}")
+
+def write_tone_and_silence_wav(path:str,parts:list[tuple[float,int]],sample_rate:int=44100) -> int:
+    '''
+    writes a 16 bit stereo WAV of parts (seconds, tone frequency in Hz or 0 for silence)
+
+    returns the amount of samples per channel
+    '''
+    total_samples = 0
+    with wave.open(path,"wb") as file:
+        file.setnchannels(2)
+        file.setsampwidth(2)
+        file.setframerate(sample_rate)
+        for length_in_s,frequency in parts:
+            amount_samples = round(length_in_s * sample_rate)
+            # written a second at a time, the fixtures are longer than memory should hold at once
+            for start in range(0,amount_samples,sample_rate):
+                time_in_s = np.arange(start,min(amount_samples,start + sample_rate)) / sample_rate
+                samples = (0.3 * 32767 * np.sin(2 * np.pi * frequency * time_in_s)).astype("<i2")
+                file.writeframes(np.repeat(samples,2).tobytes())
+            total_samples += amount_samples
+    return total_samples
+
+def bench_boundaries(length_in_s:int,repeats:int):
+    '''
+    music boundary detection on tone-and-silence fixtures of length_in_s, read from WAV,
+    against the known edges; speed as multiple of realtime on one core
+    '''
+    sample_rate = 44100
+    # (label, parts, expected start / end in s)
+    fixtures = (
+        ("silence around the song",[(1.5,0),(length_in_s,440),(2.5,0)],1.5,1.5 + length_in_s),
+        ("previous and next song bleed",[(1.0,300),(0.5,0),(length_in_s,440),(0.4,0),(2.1,600)],1.5,1.5 + length_in_s),
+        ("pause near the end",[(0.2,0),(length_in_s,440),(0.5,0),(1.0,440),(2.5,0)],0.2,1.7 + length_in_s),
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label,parts,expected_start_in_s,expected_end_in_s in fixtures:
+            path = os.path.join(tmp_dir,"fixture.wav")
+            total_samples = write_tone_and_silence_wav(path,parts,sample_rate)
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                boundaries = detect_music_boundaries(path)
+                timings.append(time.perf_counter() - start)
+            # the sine starts at 0, its first sample above the threshold is the second one
+            start_error = boundaries.start_sample - 1 - round(expected_start_in_s * sample_rate)
+            end_error = boundaries.end_sample - round(expected_end_in_s * sample_rate)
+            print(f"|- {label:<30} start off by {start_error:3d}, end off by {end_error:3d} samples | "
+                  f"median {statistics.median(timings) * 1000:7.1f} ms, {total_samples / sample_rate / statistics.median(timings):6.0f}x realtime")
+
+def write_session(dir_path:str,amount_songs:int,song_in_s:int,leak_in_s:float=0.3,pre_roll_in_s:float=1.5,
+                  after_song_in_s:float=2.5,sample_rate:int=44100) -> tuple[list[str],list[int]]:
+    '''
+    writes the recordings of a session as WAV, following spotrec: each recording starts with a silent
+    pre-roll, holds its song and goes on for after_song_in_s, during which the next song plays for
+    leak_in_s until the pause takes effect; the next recording plays that song again from its start
+
+    returns the paths and where the next song starts in each recording (samples)
+    '''
+    random_generator = np.random.default_rng(0)
+    def song(amount_samples:int) -> np.ndarray:
+        time_in_s = np.arange(amount_samples) / sample_rate
+        samples = sum(0.1 * np.sin(2 * np.pi * frequency * time_in_s + random_generator.uniform(0,6))
+                      for frequency in random_generator.uniform(100,2000,6))
+        samples += 0.05 * random_generator.normal(size=amount_samples)
+        return (0.8 * 32767 * samples).astype("<i2")
+
+    pre_roll = np.zeros(int(pre_roll_in_s * sample_rate),dtype="<i2")
+    songs = [song(song_in_s * sample_rate) for _ in range(amount_songs + 1)]
+    leak_samples = int(leak_in_s * sample_rate)
+    paused = np.zeros(int(after_song_in_s * sample_rate) - leak_samples,dtype="<i2")
+    paths,next_song_starts = [],[]
+    for index in range(amount_songs):
+        path = os.path.join(dir_path,f"recording_{index}.wav")
+        with wave.open(path,"wb") as file:
+            file.setnchannels(2)
+            file.setsampwidth(2)
+            file.setframerate(sample_rate)
+            file.writeframes(np.repeat(np.concatenate((pre_roll,songs[index],songs[index + 1][:leak_samples],paused)),2).tobytes())
+        paths.append(path)
+        next_song_starts.append(len(pre_roll) + len(songs[index]))
+    return paths,next_song_starts
+
+def bench_bleed(amount_songs:int,song_in_s:int,jobs:list[int]):
+    '''
+    finding the next song in the tail of each recording of a session, per amount of workers;
+    speed as multiple of realtime, memory as peak of the python heap
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths,next_song_starts = write_session(tmp_dir,amount_songs,song_in_s)
+        for amount_jobs in jobs:
+            start = time.perf_counter()
+            bleeds = find_bleed_in_session(paths,amount_jobs)
+            duration = time.perf_counter() - start
+            errors = [bleed.start_sample - expected for bleed,expected in zip(bleeds,next_song_starts) if bleed is not None]
+            print(f"|- {amount_jobs:2d} workers | {len(errors)}/{amount_songs - 1} found, max error {max(map(abs,errors),default=0)} samples | "
+                  f"{duration:6.2f} s, {amount_songs * song_in_s / duration:5.0f}x realtime")
+        # as spotrec does: each recording is processed once the next one finished, the last one without successor
+        song_length_in_ms = song_in_s * 1000
+        cuts:list[float] = []
+        chain = RecordingChain(lambda path,expected_length_in_ms,next_path:
+                               cuts.append((music_range(path,expected_length_in_ms,next_path) or (0,math.nan))[1]))
+        start = time.perf_counter()
+        for path in paths:
+            chain.add(path,song_length_in_ms)
+        chain.flush()
+        duration = time.perf_counter() - start
+        # without a successor the leak of the last recording stays
+        errors = [cut - expected * 1000 / 44100 for cut,expected in zip(cuts[:-1],next_song_starts)]
+        print(f"|- chain     | {len(cuts)}/{amount_songs} cut, max error {max(map(abs,errors),default=0):.2f} ms before the last | "
+              f"{duration:6.2f} s, {amount_songs * song_in_s / duration:5.0f}x realtime")
+        tracemalloc.start()
+        find_bleed_in_session(paths[:2],1)
+        _,peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"|- peak per pair {peak / 2**20:.1f} MiB (recordings of {song_in_s} s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Recording-DB-Benchmark",
+                                     usage="benchmark recording-db operations",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    subparsers = parser.add_subparsers(dest="benchmark",required=True)
+
+    connection_parser = subparsers.add_parser("connection",help="per-song lookup/insert with fresh vs. shared connection")
+    connection_parser.add_argument("-n","--songs",type=int,default=2000)
+
+    lookup_parser = subparsers.add_parser("lookup",help="song_is_in_db p50/p99 on growing dbs")
+    lookup_parser.add_argument("-s","--sizes",type=int,nargs="+",default=[10_000,100_000,1_000_000])
+    lookup_parser.add_argument("-n","--lookups",type=int,default=10_000)
+
+    dedupe_parser = subparsers.add_parser("dedupe",help="load time / memory of the in-memory dedupe set")
+    dedupe_parser.add_argument("-s","--size",type=int,default=1_000_000)
+    dedupe_parser.add_argument("-n","--lookups",type=int,default=10_000)
+
+    bulk_parser = subparsers.add_parser("bulk",help="per-song vs. bulk insertion")
+    bulk_parser.add_argument("-n","--songs",type=int,default=60_000)
+    bulk_parser.add_argument("-c","--chunk-size",type=int,default=5000)
+
+    writer_parser = subparsers.add_parser("writer",help="record_song latency with and without the background writer")
+    writer_parser.add_argument("-n","--songs",type=int,default=2000)
+    writer_parser.add_argument("--synchronous",default="FULL",help="PRAGMA synchronous to emulate slow disks")
+
+    normalize_parser = subparsers.add_parser("normalize",help="throughput of the match-key normalizer")
+    normalize_parser.add_argument("-n","--songs",type=int,default=200_000)
+
+    search_parser = subparsers.add_parser("search",help="fts5 search vs. LIKE scans")
+    search_parser.add_argument("-s","--size",type=int,default=1_000_000)
+    search_parser.add_argument("-n","--queries",type=int,default=50)
+
+    extract_parser = subparsers.add_parser("extract",help="metadata extraction throughput per amount of workers")
+    extract_parser.add_argument("-n","--files",type=int,default=5000)
+    extract_parser.add_argument("-j","--jobs",type=int,nargs="+",default=[1,4,16])
+    extract_parser.add_argument("-l","--latency-ms",type=float,default=0.0,help="emulated per-file latency of a network mount")
+
+    walk_parser = subparsers.add_parser("walk",help="collecting songs of a wide tree, rglob vs. pruning scandir walk")
+    walk_parser.add_argument("-a","--artists",type=int,default=2000)
+    walk_parser.add_argument("-k","--junk",type=int,default=50_000,help="files inside the hidden and the ignored folder each")
+    walk_parser.add_argument("-j","--jobs",type=int,default=4)
+
+    tags_parser = subparsers.add_parser("tags",help="header-only tag reader vs. mutagen, speed and equivalence")
+    tags_parser.add_argument("-n","--files",type=int,default=2000)
+    tags_parser.add_argument("-p","--picture-bytes",type=int,default=256 * 1024,help="size of the embedded cover")
+
+    trim_parser = subparsers.add_parser("trim",help="stream-copy trimming vs. decoding with pydub")
+    trim_parser.add_argument("-l","--length-s",type=int,default=300,help="length of the recordings")
+    trim_parser.add_argument("-r","--repeats",type=int,default=5)
+
+    boundaries_parser = subparsers.add_parser("boundaries",help="music boundary detection on tone-and-silence fixtures")
+    boundaries_parser.add_argument("-l","--length-s",type=int,default=300,help="length of the song in the fixtures")
+    boundaries_parser.add_argument("-r","--repeats",type=int,default=5)
+
+    bleed_parser = subparsers.add_parser("bleed",help="finding the next song in the tail of recordings of a session")
+    bleed_parser.add_argument("-n","--songs",type=int,default=20)
+    bleed_parser.add_argument("-l","--length-s",type=int,default=240,help="length of the songs")
+    bleed_parser.add_argument("-j","--jobs",type=int,nargs="+",default=[1,4])
+
+    arguments = parser.parse_args()
+    if arguments.benchmark == "connection":
+        bench_connection(arguments.songs)
+    elif arguments.benchmark == "lookup":
+        bench_lookup(arguments.sizes,arguments.lookups)
+    elif arguments.benchmark == "dedupe":
+        bench_dedupe(arguments.size,arguments.lookups)
+    elif arguments.benchmark == "bulk":
+        bench_bulk(arguments.songs,arguments.chunk_size)
+    elif arguments.benchmark == "writer":
+        bench_writer(arguments.songs,arguments.synchronous)
+    elif arguments.benchmark == "normalize":
+        bench_normalize(arguments.songs)
+    elif arguments.benchmark == "search":
+        bench_search(arguments.size,arguments.queries)
+    elif arguments.benchmark == "extract":
+        bench_extract(arguments.files,arguments.jobs,arguments.latency_ms)
+    elif arguments.benchmark == "walk":
+        bench_walk(arguments.artists,arguments.junk,arguments.jobs)
+    elif arguments.benchmark == "tags":
+        bench_tags(arguments.files,arguments.picture_bytes)
+    elif arguments.benchmark == "trim":
+        bench_trim(arguments.length_s,arguments.repeats)
+    elif arguments.benchmark == "boundaries":
+        bench_boundaries(arguments.length_s,arguments.repeats)
+    elif arguments.benchmark == "bleed":
+        bench_bleed(arguments.songs,arguments.length_s,arguments.jobs)
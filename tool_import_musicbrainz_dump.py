@@ -0,0 +1,124 @@
+# Tool to build the local MusicBrainz mirror index (see mod_musicbrainz_mirror)
+# ---| reads the tab-separated tables of a MusicBrainz dump (mbdump/) and keeps
+# ---| only what track-length lookups need: recording lengths by MBID and
+# ---| normalized (artist, title, release) of every track
+
+import sqlite3
+import os
+import re
+import time
+import argparse
+from typing import Iterator
+from mod_musicbrainz_cache import normalize_name
+from mod_musicbrainz_mirror import create_mirror_tables,create_mirror_indexes
+
+# dump tables and the columns used of them (by position, see the MusicBrainz schema)
+DUMP_COLUMNS:dict[str,dict[str,int]] = {
+    "artist_credit":{"id":0,"name":1},
+    "recording":{"id":0,"gid":1,"length":4},
+    "release":{"id":0,"name":2},
+    # tracks belong to media, media to releases
+    "medium":{"id":0,"release":1},
+    "track":{"recording":2,"medium":3,"name":6,"artist_credit":7,"length":8},
+}
+
+# postgres COPY text format
+_ESCAPE = re.compile(r"\\(.)")
+_ESCAPED = {"t":"\t","n":"\n","r":"\r","\\":"\\"}
+
+def _unescape(field:str) -> str|None:
+    if field == "\\N":
+        return None
+    if "\\" not in field:
+        return field
+    return _ESCAPE.sub(lambda match: _ESCAPED.get(match.group(1),match.group(1)),field)
+
+def iter_dump_rows(path:str,columns:dict[str,int]) -> Iterator[tuple[str|None,...]]:
+    '''
+    yields the given columns of each line of a dump table
+    '''
+    positions = tuple(columns.values())
+    with open(path,encoding="utf-8") as file:
+        for line in file:
+            fields = line.rstrip("\n").split("\t")
+            yield tuple(_unescape(fields[position]) for position in positions)
+
+def import_dump(dump_dir:str,path_to_index:str) -> dict[str,int]:
+    '''
+    builds a new index at path_to_index from the dump tables in dump_dir.
+    the tables are staged as they are and joined in sqlite
+
+    returns amount of rows per table of the index
+    '''
+    for table in DUMP_COLUMNS:
+        if not os.path.isfile(os.path.join(dump_dir,table)):
+            raise FileNotFoundError(f"dump table {table} missing in {dump_dir}")
+    if os.path.exists(path_to_index):
+        os.remove(path_to_index)
+    db = sqlite3.connect(path_to_index)
+    # a failed import is built again from scratch, no journal needed
+    db.execute("PRAGMA journal_mode = OFF;")
+    db.execute("PRAGMA synchronous = OFF;")
+    db.execute("PRAGMA temp_store = FILE;")
+    create_mirror_tables(db)
+    db.create_function("normalize_name",1,normalize_name,deterministic=True)
+
+    for table,columns in DUMP_COLUMNS.items():
+        start_time = time.perf_counter()
+        # staging tables keyed by the dump ids, so the joins below seek
+        names = ", ".join(f"{name} {'INTEGER PRIMARY KEY' if name == 'id' else 'TEXT' if name in ('name','gid') else 'INTEGER'}"
+                          for name in columns)
+        db.execute(f"CREATE TEMP TABLE dump_{table} ({names});")
+        db.executemany(f"INSERT INTO dump_{table} VALUES ({','.join('?' * len(columns))});",
+                       iter_dump_rows(os.path.join(dump_dir,table),columns))
+        print(f"|- staged {table} ({time.perf_counter() - start_time:.1f} s)")
+
+    start_time = time.perf_counter()
+    db.execute("""
+    INSERT OR REPLACE INTO recordings (mbid, length_in_ms)
+    SELECT lower(gid), CAST(length AS INTEGER) FROM dump_recording WHERE length IS NOT NULL;
+               """)
+    db.execute("""
+    INSERT INTO tracks (artist, title, release, length_in_ms)
+    SELECT normalize_name(dump_artist_credit.name), normalize_name(dump_track.name), normalize_name(dump_release.name),
+           CAST(COALESCE(dump_track.length, dump_recording.length) AS INTEGER)
+    FROM dump_track
+    JOIN dump_medium ON dump_medium.id = dump_track.medium
+    JOIN dump_release ON dump_release.id = dump_medium.release
+    JOIN dump_artist_credit ON dump_artist_credit.id = dump_track.artist_credit
+    LEFT JOIN dump_recording ON dump_recording.id = dump_track.recording
+    WHERE COALESCE(dump_track.length, dump_recording.length) IS NOT NULL;
+               """)
+    print(f"|- joined tracks ({time.perf_counter() - start_time:.1f} s)")
+    start_time = time.perf_counter()
+    create_mirror_indexes(db)
+    db.commit()
+    print(f"|- indexed ({time.perf_counter() - start_time:.1f} s)")
+    statistics = {table:db.execute(f"SELECT COUNT(*) FROM {table};").fetchone()[0] for table in ("recordings","tracks")}
+    db.close()
+    return statistics
+
+if __name__ == "__main__":
+    print("|--- Importing MusicBrainz Dump")
+
+    parser = argparse.ArgumentParser(prog="MusicBrainz-Mirror-Import",
+                                     usage="build the local track-length index from a MusicBrainz dump",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    parser.add_argument("-dump","--dump-directory",
+                        help="mbdump folder holding the tables artist_credit, recording, release, medium, track",
+                        required=True)
+    parser.add_argument("-o","--output",
+                        help="path of the resulting index, replaced if it exists",
+                        required=True)
+
+    arguments = parser.parse_args()
+
+    if not os.path.isdir(arguments.dump_directory):
+        print("|-[Warning] - path to dump invalid")
+        exit()
+
+    start_time = time.perf_counter()
+    statistics = import_dump(arguments.dump_directory,arguments.output)
+    print(f"|- {statistics['recordings']} recordings, {statistics['tracks']} tracks in {arguments.output} "
+          f"({time.perf_counter() - start_time:.1f} s)")
@@ -1,63 +1,122 @@
 # Tool To add / import new songs from directory given
+# ---| walks the directory, extracts metadata and inserts the songs missing in the database
 
 # |--- internal imports
-from mod_db_interface import initialize_database,query_song_id,query_artist_id,insert_new_song,insert_new_artist
+from mod_db_interface import initialize_database,insert_songs_bulk,diff_songs_against_db
 from mod_data_representation import song_metadata
-from mod_post_process_picard import receive_metadata_from_flac,get_metadata_from_file
+from mod_post_process_picard import get_metadata_from_file,get_metadata_from_file_header
+from tool_recover_db_from_files import iter_songs_to_parse,iter_metadata_with_paths
 
 # |--- external imports
 import os
-import pathlib
-from mutagen import flac,wave,mp3
+import sys
+import time
+import argparse
+import contextlib
+from typing import Callable, Iterator
 
 
+# |-- Variables
+ALLOWED_FILES_SUFFIXES = (".mp3",".wav",".flac")
+
 # |----
-def extract_from_flac(path:str) -> song_metadata|None:
-    as_flac_file = flac.Open(path)
-    return receive_metadata_from_flac(as_flac_file)
-def extract_from_mp3(path:str) -> song_metadata|None:
-    return None
-def extract_from_wav(path:str) -> song_metadata|None:
-    return None
+def print_progress(amount_done:int,amount_total:int,start_time:float,final:bool=False):
+    '''
+    single line with files/s and estimated remaining time, rewritten in place (stderr)
+    '''
+    duration = time.perf_counter() - start_time
+    rate = amount_done / duration if duration > 0 else 0.0
+    remaining_s = (amount_total - amount_done) / rate if rate > 0 else 0.0
+    print(f"\r|- {amount_done}/{amount_total} files | {rate:7.0f} files/s | ETA {int(remaining_s // 60)}:{int(remaining_s % 60):02d}",
+          end="\n" if final else "",file=sys.stderr,flush=True)
 
-# |-- Variables
-ALLOWED_FILES_SUFFIXES = [".mp3",".wav","flac"]
+def extract_with_progress(paths:list[str],jobs:int,extract:Callable[[str],song_metadata|None],
+                          interval_s:float=0.5) -> Iterator[song_metadata]:
+    '''
+    yields metadata of paths, reporting progress every interval_s
+    '''
+    start_time = time.perf_counter()
+    last_report = start_time
+    for amount_done,(_,maybe_metadata) in enumerate(iter_metadata_with_paths(paths,jobs,extract=extract),start=1):
+        if maybe_metadata:
+            yield maybe_metadata
+        if time.perf_counter() - last_report >= interval_s:
+            last_report = time.perf_counter()
+            print_progress(amount_done,len(paths),start_time)
+    print_progress(len(paths),len(paths),start_time,final=True)
 
 if __name__ == "__main__":
     print("|---[Running Tool To Parse Songs From Directory]")
-    db_path = "/home/evelyn/Nextcloud/tech-cluster/Programming/projects/SpotRec-Fork/recording.db"
-    dir_to_traverse ="/home/evelyn/Music_Collection/"
 
-    if not os.path.isdir(dir_to_traverse):
+    parser = argparse.ArgumentParser(prog="Recording-DB-Import",
+                                     usage="insert the songs of a directory missing in the database",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    parser.add_argument("-db","--database",
+                        help="path to recording.db",
+                        required=True
+                        )
+    parser.add_argument("-dir","--directory",
+                        help="directory to import songs from",
+                        required=True)
+    parser.add_argument("-s","--source",
+                        help="Set source of music to Spotify,None otherwise",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("-ignore","--ignore_folders",
+                        help="write liste of folders to ignore; divided by ;",
+                        required=False
+                        )
+    parser.add_argument("-n","--dry-run",
+                        help="only print the songs that would be inserted",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("-fr","--full-read",
+                        help="parse files completely with mutagen instead of reading only their tag headers",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("-j","--jobs",
+                        help="amount of files parsed in parallel, default 1",
+                        type=int,default=1,
+                        required=False)
+    parser.add_argument("-v","--verbose",
+                        help="print the output of the metadata extraction per file",
+                        action="store_true",default=False,
+                        required=False)
+
+    arguments = parser.parse_args()
+
+    if not os.path.isdir(arguments.directory):
         print("|- invalid path to traverse")
         exit()
-    
-    if not os.path.isfile(db_path):
+
+    if not os.path.isfile(arguments.database):
         print("|- invalid path to DB")
         exit()
 
     # |--- ---|
-    connection = initialize_database(db_path)
-
-    new_songs:list[song_metadata] = []
-    for base_path,subdirs,files in os.walk(dir_to_traverse):
-        absolute_path = os.path.join(dir_to_traverse,base_path)
-        # print(f"|-----[{absolute_path}]--|")
-        for subdir in subdirs:
-            # print(f"|---<{subdir}>")
-            #run this code again
-            continue
-        
-        # files 
-        for file in files:
-            filepath = os.path.join(absolute_path,file)
-            # print(f"|-- {filepath}")
-            if pathlib.Path(filepath).suffix in ALLOWED_FILES_SUFFIXES:
-                continue
-            maybe_info = get_metadata_from_file(filepath)
-            if maybe_info:
-                new_songs.append(maybe_info)
-    # print(new_songs)
-    # print(len(new_songs))
+    connection = initialize_database(arguments.database)
+    extract = get_metadata_from_file if arguments.full_read else get_metadata_from_file_header
+    ignore_paths = arguments.ignore_folders.split(";") if arguments.ignore_folders else None
 
+    paths = list(iter_songs_to_parse(arguments.directory,ignore_paths,suffixes=ALLOWED_FILES_SUFFIXES))
+    print(f"|- found {len(paths)} files")
+    # the extraction prints per file, which would bury the progress line
+    with contextlib.nullcontext() if arguments.verbose else contextlib.redirect_stdout(open(os.devnull,"w")):
+        found_songs = list(extract_with_progress(paths,arguments.jobs,extract))
+    if arguments.source:
+        found_songs = [song._replace(source="Spotify") for song in found_songs]
+
+    # one set-based query instead of song_is_in_db per song
+    new_songs,known_songs = diff_songs_against_db(connection,found_songs)
+    amount_incomplete = len(found_songs) - len(new_songs) - len(known_songs)
+    if arguments.dry_run:
+        for song in new_songs:
+            print(f"would insert | {song.title} -- {song.artist} -- {song.album}")
+        print(f"|- {len(new_songs)} new songs, {len(known_songs)} already in db, "
+              f"{amount_incomplete} without artist/title/album, {len(paths) - len(found_songs)} files without metadata")
+        exit()
 
+    inserted,skipped = insert_songs_bulk(connection,new_songs)
+    print(f"|- inserted {inserted} songs, skipped {skipped + len(known_songs) + amount_incomplete} "
+          f"({len(known_songs)} already in db, {amount_incomplete} without artist/title/album)")
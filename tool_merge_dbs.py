@@ -0,0 +1,105 @@
+# Tool to merge recording databases of several machines into one.
+# ---| attaches each database and copies artists, sources and missing songs with set-based statements
+
+import sqlite3
+import os
+import time
+import argparse
+from mod_db_interface import initialize_database,apply_pragmas,CONNECTION_PRAGMAS,SOURCES,SCHEMA_MIGRATIONS
+from mod_data_representation import song_match_key
+
+# ---|---
+def merge_database(db_connection:sqlite3.Connection,path_to_other:str) -> dict[str,int]:
+    '''
+    copies all songs of the database at path_to_other into db_connection,
+    remapping artist and source ids by name. songs already present
+    (same match_key or track_uri) are skipped.
+    the other database is only read (no migrations), older schemas are accepted.
+
+    returns statistics: songs, inserted, duplicates, new_artists
+    '''
+    db_connection.create_function("song_match_key",3,song_match_key,deterministic=True)
+    cursor = db_connection.cursor()
+    cursor.execute("ATTACH DATABASE ? AS other;",(path_to_other,))
+    try:
+        columns = [row[1] for row in cursor.execute("PRAGMA other.table_info(songs);")]
+        track_uri_column = "other_songs.track_uri" if "track_uri" in columns else "NULL"
+        # keys stored by an older song_match_key (or none at all) are computed on the fly
+        other_version = cursor.execute("PRAGMA other.user_version;").fetchone()[0]
+        keys_are_current = "match_key" in columns and other_version >= len(SCHEMA_MIGRATIONS)
+        match_key_column = "other_songs.match_key" if keys_are_current else "song_match_key(other_artists.name, other_songs.title, other_songs.album)"
+        duration_column = "other_songs.duration_in_ms" if "duration_in_ms" in columns else "NULL"
+        default_source_id = cursor.execute("SELECT id FROM main.sources WHERE name = ?;",(SOURCES[1],)).fetchone()[0]
+
+        cursor.execute("BEGIN;")
+        amount_artists = cursor.execute("SELECT COUNT(*) FROM main.artists;").fetchone()[0]
+        cursor.execute("INSERT OR IGNORE INTO main.artists (name) SELECT name FROM other.artists;")
+        cursor.execute("INSERT OR IGNORE INTO main.sources (name) SELECT name FROM other.sources;")
+        new_artists = cursor.execute("SELECT COUNT(*) FROM main.artists;").fetchone()[0] - amount_artists
+
+        # songs of other with ids remapped to main
+        cursor.execute(f"""
+        CREATE TEMP TABLE merge_songs AS
+        SELECT main_artists.id AS artist_id, other_songs.title AS title, other_songs.album AS album,
+               COALESCE(main_sources.id, {default_source_id}) AS source_id,
+               {track_uri_column} AS track_uri, {match_key_column} AS match_key, {duration_column} AS duration_in_ms
+        FROM other.songs AS other_songs
+        JOIN other.artists AS other_artists ON other_artists.id = other_songs.artist_id
+        JOIN main.artists AS main_artists ON main_artists.name = other_artists.name
+        LEFT JOIN other.sources AS other_sources ON other_sources.id = other_songs.source_id
+        LEFT JOIN main.sources AS main_sources ON main_sources.name = other_sources.name;
+                       """)
+        cursor.execute("CREATE INDEX temp.idx_merge_songs_match_key ON merge_songs (match_key);")
+        amount_songs = cursor.execute("SELECT COUNT(*) FROM merge_songs;").fetchone()[0]
+        # first occurrence of a match_key wins, OR IGNORE drops taken track_uris
+        cursor.execute("""
+        INSERT OR IGNORE INTO main.songs (artist_id, title, album, source_id, track_uri, match_key, duration_in_ms)
+        SELECT artist_id, title, album, source_id, track_uri, match_key, duration_in_ms FROM merge_songs
+        WHERE rowid IN (SELECT MIN(rowid) FROM merge_songs GROUP BY match_key)
+        AND NOT EXISTS (SELECT 1 FROM main.songs WHERE main.songs.match_key = merge_songs.match_key)
+        AND (track_uri IS NULL OR NOT EXISTS (SELECT 1 FROM main.songs WHERE main.songs.track_uri = merge_songs.track_uri));
+                       """)
+        amount_inserted = cursor.rowcount
+        db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.merge_songs;")
+        cursor.execute("DETACH DATABASE other;")
+    return {
+        "songs":amount_songs,
+        "inserted":amount_inserted,
+        "duplicates":amount_songs - amount_inserted,
+        "new_artists":new_artists,
+    }
+
+if __name__ == "__main__":
+    print("|--- Merging Recording Databases")
+
+    parser = argparse.ArgumentParser(prog="Recording-DB-Merge",
+                                     usage="merge several recording databases into one",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    parser.add_argument("-db","--database",
+                        help="path to resulting recording.db, created if missing",
+                        required=True
+                        )
+    parser.add_argument("-m","--merge",
+                        help="databases to merge into --database",
+                        nargs="+",required=True)
+
+    arguments = parser.parse_args()
+
+    db_connection = initialize_database(arguments.database)
+    # large page cache keeps the index updates of big merges in memory (256 MiB)
+    apply_pragmas(db_connection,{**CONNECTION_PRAGMAS,"cache_size":"-262144"})
+    for path_to_other in arguments.merge:
+        if not os.path.isfile(path_to_other):
+            print(f"|-[Warning] - skipping invalid database path {path_to_other}")
+            continue
+        start_time = time.perf_counter()
+        statistics = merge_database(db_connection,path_to_other)
+        print(f"|- {path_to_other}: {statistics['songs']} songs, {statistics['inserted']} inserted, "
+              f"{statistics['duplicates']} duplicates, {statistics['new_artists']} new artists "
+              f"({time.perf_counter() - start_time:.2f} s)")
@@ -0,0 +1,155 @@
+# Tool to reconcile the recordings table with the files on disk.
+# ---| reports (and with --fix repairs) recordings whose file is gone or changed
+# ---| and files below the given folders that were never registered
+
+import sqlite3
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from mod_db_interface import (initialize_database,insert_songs_bulk,insert_recording,link_recordings,hash_file,
+                              diff_recordings,unregistered_files,remove_recordings,update_recording_files,remove_orphaned_songs)
+from mod_post_process_picard import get_metadata_from_file_header
+from tool_recover_db_from_files import iter_songs_to_parse,iter_metadata_with_paths,pruning_refused,MAX_REMOVED_SHARE
+
+# ---|---
+def _size_or_none(path:str) -> tuple[str,int|None]:
+    try:
+        return path,os.stat(path).st_size
+    except OSError:
+        return path,None
+
+def stat_recordings(db:sqlite3.Connection,jobs:int=8) -> list[tuple[str,int|None]]:
+    '''
+    (path,size) of every registered file, size None if it is missing.
+    stat mostly waits on the disk (or network share), so it runs on a thread pool
+    '''
+    paths = [row[0] for row in db.execute("SELECT path FROM recordings;")]
+    if jobs <= 1:
+        return [_size_or_none(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_size_or_none,paths,chunksize=256))
+
+def hash_missing_recordings(db:sqlite3.Connection,jobs:int=8) -> int:
+    '''
+    fills in the content hash of recordings registered without one (SpotRec leaves it to
+    the post processing, which may not have run); files are read on a thread pool
+
+    returns amount of hashed files
+    '''
+    paths = [row[0] for row in db.execute("SELECT path FROM recordings WHERE content_hash IS NULL;")
+             if os.path.isfile(row[0])]
+    with ThreadPoolExecutor(max_workers=max(jobs,1)) as pool:
+        update_recording_files(db,pool.map(lambda path: (path,os.path.getsize(path),hash_file(path)),paths))
+    return len(paths)
+
+def register_files(db:sqlite3.Connection,paths:list[str],jobs:int=1) -> int:
+    '''
+    parses the tag headers of paths, inserts missing songs and registers the files as recordings
+    (without hash, see hash_missing_recordings)
+
+    returns amount of registered files
+    '''
+    parsed = list(iter_metadata_with_paths(paths,jobs,extract=get_metadata_from_file_header))
+    insert_songs_bulk(db,(metadata for _,metadata in parsed if metadata))
+    for path,maybe_metadata in parsed:
+        insert_recording(db,maybe_metadata,path,os.path.splitext(path)[1].lstrip(".").lower() or None,
+                         maybe_metadata.song_length_in_ms if maybe_metadata else None)
+    return len(parsed)
+
+def reconcile(db:sqlite3.Connection,directories:list[str],ignore_paths:list[str]|None,jobs:int=8,
+              fix:bool=False,verbose:bool=False,max_removed_share:float=MAX_REMOVED_SHARE) -> dict[str,int]:
+    '''
+    compares recordings with the disk in both directions, with fix:
+    drops recordings of missing files (and their songs if nothing else holds them),
+    refreshes size and hash of changed files, registers unregistered files and hashes files registered without one.
+    missing files are kept while a directory is missing or empty (an unmounted share)
+    or when more than max_removed_share of the recordings are missing at once.
+
+    returns statistics: linked, missing, changed, unregistered, deleted, hashed
+    '''
+    amount_linked = link_recordings(db)
+    file_sizes = stat_recordings(db,jobs)
+    missing,changed = diff_recordings(db,file_sizes)
+    unregistered = unregistered_files(db,(path for directory in directories
+                                          for path in iter_songs_to_parse(directory,ignore_paths,sort=False)))
+    if verbose:
+        for path in missing:
+            print(f"missing      | {path}")
+        for path in changed:
+            print(f"changed      | {path}")
+        for path in unregistered:
+            print(f"unregistered | {path}")
+
+    amount_deleted,amount_hashed = 0,0
+    if fix:
+        refusal = pruning_refused(directories,len(missing),len(file_sizes),max_removed_share)
+        if refusal is not None:
+            print(f"|-[Warning] - not removing recordings of missing files: {refusal}")
+        else:
+            removed_keys = remove_recordings(db,missing)
+            amount_deleted = remove_orphaned_songs(db,removed_keys) if removed_keys else 0
+        with ThreadPoolExecutor(max_workers=max(jobs,1)) as pool:
+            update_recording_files(db,pool.map(lambda path: (path,os.path.getsize(path),hash_file(path)),changed))
+        register_files(db,unregistered,jobs)
+        amount_hashed = hash_missing_recordings(db,jobs)
+    return {
+        "linked":amount_linked,
+        "missing":len(missing),
+        "changed":len(changed),
+        "unregistered":len(unregistered),
+        "deleted":amount_deleted,
+        "hashed":amount_hashed,
+    }
+
+if __name__ == "__main__":
+    print("|--- Reconciling Recordings")
+
+    parser = argparse.ArgumentParser(prog="Recording-DB-Reconcile",
+                                     usage="compare recorded files of database with disk",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    parser.add_argument("-db","--database",
+                        help="name of database",
+                        required=True
+                        )
+    parser.add_argument("-dir","--directory",
+                        help="folders to look for unregistered files; divided by ;",
+                        required=False)
+    parser.add_argument("-ignore","--ignore_folders",
+                        help="write liste of folders to ignore; divided by ;",
+                        required=False
+                        )
+    parser.add_argument("-j","--jobs",
+                        help="amount of files checked in parallel, default 8",
+                        type=int,default=8,
+                        required=False)
+    parser.add_argument("--fix",
+                        help="remove missing, update changed and register unregistered files",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("--max-removed-share",
+                        help=f"refuse removing recordings when more than this share of them is missing, default {MAX_REMOVED_SHARE}",
+                        type=float,default=MAX_REMOVED_SHARE,
+                        required=False)
+    parser.add_argument("-v","--verbose",
+                        help="print every file that is out of sync",
+                        action="store_true",default=False,
+                        required=False)
+
+    arguments = parser.parse_args()
+
+    directories = arguments.directory.split(";") if arguments.directory else []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            print(f"|-[Warning] - path to folder invalid: {directory}")
+            exit()
+
+    start_time = time.perf_counter()
+    statistics = reconcile(initialize_database(f"{arguments.database}.db"),directories,
+                           arguments.ignore_folders.split(";") if arguments.ignore_folders else None,
+                           arguments.jobs,arguments.fix,arguments.verbose,arguments.max_removed_share)
+    print(f"|- {statistics['missing']} missing, {statistics['changed']} changed, {statistics['unregistered']} unregistered files, "
+          f"{statistics['linked']} recordings linked to songs"
+          + (f" | fixed, {statistics['deleted']} songs deleted, {statistics['hashed']} files hashed" if arguments.fix else "")
+          + f" ({time.perf_counter() - start_time:.2f} s)")
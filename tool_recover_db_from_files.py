@@ -4,65 +4,219 @@
 import sqlite3
 import os
 import argparse
+from itertools import islice
 # external imports
-from mod_db_interface import song_is_in_db,initialize_database,insert_new_song
+from mod_db_interface import initialize_database,insert_songs_bulk,diff_scan_cache,update_scan_cache,remove_orphaned_songs,count_scan_cache
 from mod_data_representation import song_metadata
-from mod_post_process_picard import get_metadata_from_file
+from mod_post_process_picard import get_metadata_from_file,get_metadata_from_file_header
 
 # -----
     # parsing and traversing collection
 from pathlib import Path
 from collections import defaultdict
-from typing import Dict, List, Union
+from typing import Dict, List, Union, Iterable, Iterator, Callable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def collect_songs_to_parse(dir_path:str, ignore_paths: list[str] | None) -> list[str]:
+SONG_SUFFIXES = (".flac", ".mp3")
+# share of the known files that may disappear at once before deleting songs is refused
+MAX_REMOVED_SHARE = 0.5
+
+def is_available_root(dir_path:str) -> bool:
+    """
+    the folder exists and holds anything; an unmounted share leaves an empty mount point
+    """
+    try:
+        with os.scandir(dir_path) as entries:
+            return next(entries, None) is not None
+    except OSError:
+        return False
+
+def pruning_refused(root_paths:list[str], amount_removed:int, amount_known:int,
+                    max_removed_share:float=MAX_REMOVED_SHARE) -> str|None:
+    """
+    reason to keep songs of disappeared files, None if deleting them looks safe:
+    a root is missing, unmounted or empty, or more than max_removed_share of the known files are gone at once
     """
-    Traverse dir_path and collect .flac/.mp3 files while skipping hidden paths
-    and any folder names contained in ignore_paths.
+    for root_path in root_paths:
+        if not is_available_root(root_path):
+            return f"{root_path} is missing or empty (unmounted?)"
+    if amount_removed and amount_removed > max_removed_share * amount_known:
+        return f"{amount_removed} of {amount_known} known files disappeared (more than {max_removed_share:.0%})"
+    return None
 
-    ignore_paths: list of folder names (not full paths). Matching is case-insensitive
-    against any path component under the base directory.
+def is_ignored_name(name:str, ignore_set:set[str]) -> bool:
     """
-    collected_songs:list[str] = []
+    hidden entries and folders named in ignore_set (lower-cased) are skipped
+    """
+    return name.startswith(".") or name.lower() in ignore_set
+
+def walk_collection(dir_path:str, ignore_paths: list[str] | None, sort:bool=True,
+                    suffixes:tuple[str,...]=SONG_SUFFIXES) -> Iterator[tuple[str,list[str]]]:
+    """
+    Lazily walk dir_path and yield (absolute folder path, files ending with suffixes in it)
+    for dir_path and every folder below.
+    Hidden entries and folders named in ignore_paths are pruned before
+    descending into them, symlinked folders are not followed.
 
-    # traversing files 
-    p = Path(dir_path)
-    if not p.is_dir():
+    ignore_paths: list of folder names (not full paths). Matching is case-insensitive.
+    sort: yield entries of each directory by name, folders depth-first in order.
+    """
+    root = Path(dir_path)
+    if not root.is_dir():
         raise NotADirectoryError(f"{dir_path!r} is not a directory")
+    ignore_set = {s.lower().strip() for s in ignore_paths} if ignore_paths else set()
 
-    for f in p.rglob("*"):
-        if not f.is_file():
-            continue
-        if f.suffix.lower() not in (".flac", ".mp3"):
-            continue
-        # skip hidden files and directories
+    # explicit stack, deep trees do not hit the recursion limit
+    pending_dirs = [str(root.resolve())]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
         try:
-            rel_parts = f.relative_to(p).parts
-        except Exception:
-            rel_parts = f.parts
-        if any(part.startswith('.') for part in rel_parts):
+            with os.scandir(current_dir) as scanned:
+                entries = list(scanned)
+        except OSError as error:
+            print(f"|-[Warning] - could not read {current_dir}: {error}")
             continue
-        # skip any paths that contain a component listed in ignore_paths
-        if ignore_paths:
-            # compare case-insensitive
-            ignore_set = {s.lower().strip() for s in ignore_paths}
-            if any(part.lower() in ignore_set for part in rel_parts):
+        if sort:
+            entries.sort(key=lambda entry: entry.name)
+        sub_dirs = []
+        songs = []
+        for entry in entries:
+            if entry.name.startswith("."):
                 continue
-        collected_songs.append(str(f.resolve()))
+            # file type comes from the directory listing, no stat per entry
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name.lower() not in ignore_set:
+                    sub_dirs.append(entry.path)
+            elif entry.name.lower().endswith(suffixes) and entry.is_file():
+                songs.append(entry.path)
+        yield current_dir,songs
+        # reversed so that the stack pops them in order
+        pending_dirs.extend(reversed(sub_dirs))
 
-    # sort for deterministic order
-    collected_songs.sort()
+def iter_songs_to_parse(dir_path:str, ignore_paths: list[str] | None, sort:bool=True,
+                        suffixes:tuple[str,...]=SONG_SUFFIXES) -> Iterator[str]:
+    """
+    Lazily walk dir_path and yield absolute paths of .flac/.mp3 files,
+    files of a folder before its subfolders, see walk_collection.
+    """
+    for _,songs in walk_collection(dir_path,ignore_paths,sort,suffixes):
+        yield from songs
 
-    return collected_songs 
+def collect_songs_to_parse(dir_path:str, ignore_paths: list[str] | None) -> list[str]:
+    """
+    sorted list of all songs of iter_songs_to_parse
+    """
+    return sorted(iter_songs_to_parse(dir_path,ignore_paths,sort=False))
 
-def collect_metadata_from_songs(list_of_songs:list[str]) -> list[song_metadata]:
-    retrieved_metadata:list[song_metadata] = []
+def stat_songs(songs:Iterable[str]) -> list[tuple[str,int,int,int]]:
+    '''
+    (path,mtime_ns,size,inode) of each song, key of the scan cache
+    '''
+    file_stats = []
+    for entry in songs:
+        try:
+            stat = os.stat(entry)
+        except OSError:
+            continue
+        file_stats.append((entry,stat.st_mtime_ns,stat.st_size,stat.st_ino))
+    return file_stats
+
+def iter_metadata_with_paths(songs:Iterable[str],jobs:int=1,max_in_flight:int|None=None,
+                             extract:Callable[[str],song_metadata|None]=get_metadata_from_file) -> Iterator[tuple[str,song_metadata|None]]:
+    '''
+    yields (path,metadata) of songs as soon as it was extracted, metadata may be None.
+    with jobs > 1 files are parsed on a thread pool (parsing mostly waits on I/O),
+    at most max_in_flight files (default: 4 per job) are queued at once,
+    results arrive in completion order.
+    '''
+    if jobs <= 1:
+        for entry in songs:
+            yield entry,extract(entry)
+        return
+
+    max_in_flight = max_in_flight or 4 * jobs
+    song_iterator = iter(songs)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        in_flight = {pool.submit(extract,entry):entry for entry in islice(song_iterator,max_in_flight)}
+        while in_flight:
+            done,_ = wait(in_flight,return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future),future.result()
+            for entry in islice(song_iterator,len(done)):
+                in_flight[pool.submit(extract,entry)] = entry
 
-    for entry in list_of_songs:
-        maybe_metadata = get_metadata_from_file(entry)
+def iter_metadata_from_songs(songs:Iterable[str],jobs:int=1,max_in_flight:int|None=None,
+                             extract:Callable[[str],song_metadata|None]=get_metadata_from_file) -> Iterator[song_metadata]:
+    for _,maybe_metadata in iter_metadata_with_paths(songs,jobs,max_in_flight,extract):
         if maybe_metadata:
-            retrieved_metadata.append(maybe_metadata)
-    return retrieved_metadata
+            yield maybe_metadata
+
+def collect_metadata_from_songs(list_of_songs:list[str],jobs:int=1) -> list[song_metadata]:
+    return list(iter_metadata_from_songs(list_of_songs,jobs))
+
+def parse_and_insert(db:sqlite3.Connection,songs:Iterable[str],file_stats:dict[str,tuple[str,int,int,int]]|None=None,
+                     jobs:int=1,extract:Callable[[str],song_metadata|None]=get_metadata_from_file,
+                     source:str|None=None) -> tuple[int,int,list[str]]:
+    '''
+    parses songs and streams their metadata into db in chunks while files are still parsed.
+    with file_stats ({path:(path,mtime_ns,size,inode)}) the scan cache is updated as well.
+
+    returns (inserted, skipped, match keys the files held before they were retagged)
+    '''
+    parsed_files:list[tuple[tuple[str,int,int,int],song_metadata|None]] = []
+    def collect_parsed(parsed:Iterator[tuple[str,song_metadata|None]]) -> Iterator[song_metadata]:
+        for path,maybe_metadata in parsed:
+            if file_stats is not None and path in file_stats:
+                parsed_files.append((file_stats[path],maybe_metadata))
+            if maybe_metadata:
+                yield maybe_metadata
+
+    metadata = collect_parsed(iter_metadata_with_paths(songs,jobs,extract=extract))
+    if source is not None:
+        # new instances with the updated `source` field instead of attempting
+        # to assign to the field which raises an error.
+        metadata = (entry._replace(source=source) for entry in metadata)
+
+    inserted,skipped = insert_songs_bulk(db,metadata,chunk_size=500)
+    replaced_keys = update_scan_cache(db,parsed_files) if parsed_files else []
+    return inserted,skipped,replaced_keys
+
+def scan_collection(db:sqlite3.Connection,collection_path:str,ignore_paths:list[str]|None,jobs:int=1,
+                    extract:Callable[[str],song_metadata|None]=get_metadata_from_file,
+                    source:str|None=None,remove_orphans:bool=False,
+                    max_removed_share:float=MAX_REMOVED_SHARE) -> dict[str,int]:
+    '''
+    incremental scan of the collection; only files that are new or changed since the
+    last scan are parsed, files are compared by (path,mtime_ns,size,inode).
+    with remove_orphans songs of deleted or retagged files are removed from db, unless
+    pruning_refused finds the deletions suspicious. a missing or empty collection is not scanned at all.
+
+    returns statistics: changed, unchanged, removed, inserted, skipped, deleted
+    '''
+    root_path = str(Path(collection_path).resolve())
+    if not is_available_root(root_path):
+        # the cache of an unmounted collection is kept, nothing would be found
+        print(f"|-[Warning] - {root_path} is missing or empty (unmounted?), not scanning")
+        return {"changed":0,"unchanged":0,"removed":0,"inserted":0,"skipped":0,"deleted":0}
+    amount_known = count_scan_cache(db,root_path)
+    file_stats = {entry[0]:entry for entry in stat_songs(iter_songs_to_parse(collection_path,ignore_paths,sort=False))}
+    changed,amount_unchanged,removed_keys = diff_scan_cache(db,file_stats.values(),root_path)
+    inserted,skipped,replaced_keys = parse_and_insert(db,changed,file_stats,jobs,extract,source)
+    amount_deleted = 0
+    if remove_orphans:
+        refusal = pruning_refused([root_path],len(removed_keys),amount_known,max_removed_share)
+        if refusal is not None:
+            print(f"|-[Warning] - not deleting songs of removed files: {refusal}")
+        else:
+            amount_deleted = remove_orphaned_songs(db,removed_keys + replaced_keys)
+    return {
+        "changed":len(changed),
+        "unchanged":amount_unchanged,
+        "removed":len(removed_keys),
+        "inserted":inserted,
+        "skipped":skipped,
+        "deleted":amount_deleted,
+    }
 
 if __name__ == "__main__":
     print("|- recoverying database from collection")
@@ -85,6 +239,18 @@ if __name__ == "__main__":
                         help="write liste of folders to ignore; divided by ;",
                         required=False
                         )
+    parser.add_argument("-nc","--no-cache",
+                        help="parse every file, even if it did not change since the last run",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("-fr","--full-read",
+                        help="parse files completely with mutagen instead of reading only their tag headers",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("-j","--jobs",
+                        help="amount of files parsed in parallel, default 1",
+                        type=int,default=1,
+                        required=False)
     
     arguments = parser.parse_args()
 
@@ -92,32 +258,28 @@ if __name__ == "__main__":
     collection_path = arguments.directory
     ignore_folders:str|None = arguments.ignore_folders
     add_spotify_as_source = arguments.source
+    jobs = arguments.jobs
+    use_scan_cache = not arguments.no_cache
+    extract = get_metadata_from_file if arguments.full_read else get_metadata_from_file_header
 
     if not os.path.isdir(collection_path):
         print("|-[Warning] - path to collection invalid")
         exit()
     
-    # traversing collection
+    ignore_as_list = None
     if ignore_folders: 
         ignore_as_list = ignore_folders.split(";")
         print(ignore_as_list)
-        songs = collect_songs_to_parse(collection_path,ignore_as_list)
-    else:
-        songs = collect_songs_to_parse(collection_path,None)
-
-    metadata = collect_metadata_from_songs(songs)
-
-    if add_spotify_as_source:
-        # new instances with the updated `source` field instead of attempting
-        # to assign to the field which raises an error.
-        metadata = [entry._replace(source="Spotify") for entry in metadata]
 
-    # adding to db
     db_connection = initialize_database(f"{db_path}.db")
-    for entry in metadata:
-        insert_new_song(db_connection,entry)
+    source = "Spotify" if add_spotify_as_source else None
 
-
-
-
-    
+    if use_scan_cache:
+        statistics = scan_collection(db_connection,collection_path,ignore_as_list,jobs,extract,source)
+        print(f"|- {statistics['changed']} new or changed files, {statistics['unchanged']} unchanged, {statistics['removed']} removed from cache")
+        inserted,skipped = statistics["inserted"],statistics["skipped"]
+    else:
+        # without the cache the walk stays lazy and files are parsed while it continues
+        songs = iter_songs_to_parse(collection_path,ignore_as_list)
+        inserted,skipped,_ = parse_and_insert(db_connection,songs,None,jobs,extract,source)
+    print(f"|- inserted {inserted} songs, skipped {skipped}")
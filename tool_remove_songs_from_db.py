@@ -3,22 +3,15 @@
 
 import sqlite3
 import os
+import time
 import argparse
-from mod_db_interface import song_is_in_db,initialize_database,query_artist_id,query_song_id
+from mod_db_interface import initialize_database
 
 # ---|---
 def remove_song_from_db(db_connection:sqlite3.Connection,title:str,artist:str|None) -> bool:
-    # does not require a specific title or artist, it should be find within the given query
-    artist_id:int|None = query_artist_id(db_connection,artist) if artist is not None else None
-    song_id:int|None   = query_song_id(db_connection,artist_id,title)
-
-    if not song_id:
-        return False
-    # remove from db
-    cursor = db_connection.cursor()
-    cursor.execute("DELETE FROM songs WHERE id = ?",(song_id,))
-    db_connection.commit()
-    return True
+    # removes every song with title (by artist if given), see remove_songs_bulk
+    matched,_ = remove_songs_bulk(db_connection,[(title,artist)])
+    return len(matched) > 0
 
 def parse_from_file(path_to_file:str) -> list[tuple[str,str|None]]:
     if not os.path.isfile(path_to_file):
@@ -28,20 +21,69 @@ def parse_from_file(path_to_file:str) -> list[tuple[str,str|None]]:
         content = file.readlines()
         for line in content:
             # parsing each entry
-            vals = line.split(",")
-            if len(vals) == 0:
+            if not line.strip():
                 continue
+            vals = line.split(",")
             artist = vals[1].strip() if len(vals) >1 else None
             title  = vals[0].strip()
             # print(f"title: {title}, artist: {artist}")
             result.append((title,artist))
     return result
     
-def parse_and_remove_files(path_to_file:str,db_connection:sqlite3.Connection):
-    songs = parse_from_file(path_to_file)
-    for title,artist in songs:
-        is_removed = remove_song_from_db(db_connection,title,artist)
-        print(f"result: {is_removed} | {title} -- {artist}")
+def remove_songs_bulk(db_connection:sqlite3.Connection,songs:list[tuple[str,str|None]],dry_run:bool=False) -> tuple[list[tuple],list[tuple[str,str|None]]]:
+    '''
+    removes all songs matching any (title,artist) entry with one joined DELETE;
+    entries without artist match by title only.
+
+    returns (matched songs as (id,title,artist,album), unmatched entries)
+    '''
+    cursor = db_connection.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS removals (title TEXT NOT NULL, artist TEXT);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS temp.idx_removals ON removals (title);")
+    try:
+        cursor.execute("DELETE FROM removals;")
+        cursor.executemany("INSERT INTO removals (title, artist) VALUES (?,?);",songs)
+        # songs has no index on title -> scan songs once (CROSS JOIN fixes the order)
+        # and probe the indexed removals instead of scanning songs per entry
+        cursor.execute("""
+        CREATE TEMP TABLE removal_matches AS
+        SELECT songs.id AS song_id, removals.rowid AS removal_id FROM songs
+        CROSS JOIN removals ON removals.title = songs.title
+        JOIN artists ON artists.id = songs.artist_id
+        WHERE removals.artist IS NULL OR removals.artist = artists.name;
+                       """)
+        matched = cursor.execute("""
+        SELECT songs.id, songs.title, artists.name, songs.album FROM songs
+        JOIN artists ON artists.id = songs.artist_id
+        WHERE songs.id IN (SELECT song_id FROM removal_matches);
+                                 """).fetchall()
+        unmatched = cursor.execute("""
+        SELECT title, artist FROM removals
+        WHERE rowid NOT IN (SELECT removal_id FROM removal_matches);
+                                   """).fetchall()
+        if not dry_run:
+            cursor.execute("DELETE FROM songs WHERE id IN (SELECT song_id FROM removal_matches);")
+        db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.removal_matches;")
+        cursor.execute("DROP TABLE IF EXISTS temp.removals;")
+    return matched,unmatched
+
+def parse_and_remove_files(path_to_file:str,db_connection:sqlite3.Connection,dry_run:bool=False):
+    remove_and_report(db_connection,parse_from_file(path_to_file),dry_run)
+
+def remove_and_report(db_connection:sqlite3.Connection,songs:list[tuple[str,str|None]],dry_run:bool=False):
+    start_time = time.perf_counter()
+    matched,unmatched = remove_songs_bulk(db_connection,songs,dry_run)
+    duration = time.perf_counter() - start_time
+    for _,title,artist,album in matched:
+        print(f"{'would remove' if dry_run else 'removed'} | {title} -- {artist} -- {album}")
+    for title,artist in unmatched:
+        print(f"no match | {title} -- {artist}")
+    print(f"|- {len(songs)} entries: {len(matched)} songs {'matched' if dry_run else 'removed'}, {len(unmatched)} entries unmatched ({duration:.3f} s)")
 
 if __name__ == "__main__":
     print("|--- Deletion of Songs in DB")
@@ -60,6 +102,9 @@ if __name__ == "__main__":
                         help="set title to remove")
     parser.add_argument("-a","--artist", 
                         help="set artist to query for")
+    parser.add_argument("-n","--dry-run",
+                        help="only print which songs would be removed",
+                        action="store_true",default=False)
     
     arguments = parser.parse_args()
 
@@ -67,10 +112,14 @@ if __name__ == "__main__":
     maybe_file = arguments.file
     maybe_title = arguments.title
     maybe_artist = arguments.artist
+    dry_run = arguments.dry_run
 
     if not maybe_file and not maybe_title and not maybe_artist:
         print("|-[Warning] - No File nor song info given")
         exit()
+    if not maybe_file and not maybe_title:
+        # removing all songs of an artist by accident is too easy
+        parser.error("--title is required without --file")
     if not os.path.isfile(db_path):
         print("|-[Warning] - database path invalid")
         exit()
@@ -80,6 +129,6 @@ if __name__ == "__main__":
         if not os.path.isfile(maybe_file):
             print("|-[Warning] - file path invalid")
             exit()
-        parse_and_remove_files(maybe_file,db_connection)
+        parse_and_remove_files(maybe_file,db_connection,dry_run)
     else:
-        remove_song_from_db(db_connection,maybe_title,maybe_artist)
+        remove_and_report(db_connection,[(maybe_title,maybe_artist)],dry_run)
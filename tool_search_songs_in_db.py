@@ -0,0 +1,90 @@
+# Tool to search the database for recorded songs, artists or albums.
+# ---| uses the full text index songs_fts, results are streamed as text, csv or json
+
+import sqlite3
+import os
+import sys
+import csv
+import json
+import argparse
+from mod_db_interface import initialize_database,search_songs
+
+# ---|---
+SEARCHABLE_COLUMNS = ["title","album","artist"]
+OUTPUT_FORMATS = ["text","csv","json"]
+
+def build_fts_query(terms:list[str],prefix:bool=False,phrase:bool=False,column:str|None=None) -> str:
+    '''
+    turns plain search terms into an FTS5 query,
+    quoting every term so user input is never parsed as query syntax.
+    all terms have to match; with phrase in the given order
+    '''
+    quoted = ['"' + term.replace('"','""') + '"' for term in terms if term]
+    if phrase:
+        quoted = ['"' + " ".join(term.replace('"','""') for term in terms if term) + '"']
+    if prefix:
+        quoted = [term + "*" for term in quoted]
+    query = " ".join(quoted)
+    if column is not None:
+        query = f"{column} : ({query})"
+    return query
+
+def write_results(rows:sqlite3.Cursor,output_format:str,out=sys.stdout) -> int:
+    # iterates the cursor, so results are never held in memory at once
+    amount_rows = 0
+    if output_format == "csv":
+        writer = csv.writer(out)
+        writer.writerow(["title","artist","album","source"])
+        for row in rows:
+            writer.writerow(row)
+            amount_rows += 1
+    elif output_format == "json":
+        out.write("[")
+        for row in rows:
+            out.write(("," if amount_rows else "") + "\n  " + json.dumps(dict(zip(["title","artist","album","source"],row)),ensure_ascii=False))
+            amount_rows += 1
+        out.write("\n]\n")
+    else:
+        for title,artist,album,source in rows:
+            out.write(f"{title} -- {artist} -- {album} [{source}]\n")
+            amount_rows += 1
+    return amount_rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="Recording-Song-Search",
+                                     usage="search songs, artists and albums in database",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    parser.add_argument("-db","--database",
+                        help="path to recording.db",
+                        required=True
+                        )
+    parser.add_argument("terms",nargs="+",
+                        help="words to search for, all have to match")
+    parser.add_argument("-p","--prefix",
+                        help="match words starting with the given terms",
+                        action="store_true",default=False)
+    parser.add_argument("-ph","--phrase",
+                        help="terms have to appear next to each other, in order",
+                        action="store_true",default=False)
+    parser.add_argument("-c","--column",
+                        help=f"only search in one column\nAvailable: {', '.join(SEARCHABLE_COLUMNS)}",
+                        choices=SEARCHABLE_COLUMNS,default=None)
+    parser.add_argument("-f","--format",
+                        help=f"output format\nAvailable: {', '.join(OUTPUT_FORMATS)}\nDefault: text",
+                        choices=OUTPUT_FORMATS,default="text")
+
+    arguments = parser.parse_args()
+
+    if not os.path.isfile(arguments.database):
+        print("|-[Warning] - database path invalid",file=sys.stderr)
+        exit()
+
+    db_connection = initialize_database(arguments.database)
+    fts_query = build_fts_query(arguments.terms,arguments.prefix,arguments.phrase,arguments.column)
+    try:
+        amount_rows = write_results(search_songs(db_connection,fts_query),arguments.format)
+    except sqlite3.OperationalError as e:
+        print(f"|-[Warning] - search failed: {e}",file=sys.stderr)
+        exit()
+    print(f"|- {amount_rows} songs found",file=sys.stderr)
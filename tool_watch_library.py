@@ -0,0 +1,274 @@
+# Tool to keep the recording database in sync with the music collection.
+# ---| follows inotify events below the collection root and applies them in debounced batches
+
+import sqlite3
+import os
+import time
+import argparse
+from typing import Callable
+from mod_db_interface import initialize_database,diff_scan_cache,rename_in_scan_cache,remove_from_scan_cache,remove_orphaned_songs,count_scan_cache
+from mod_data_representation import song_metadata
+from mod_post_process_picard import get_metadata_from_file,get_metadata_from_file_header
+from mod_inotify import (Inotify,IN_CLOSE_WRITE,IN_CREATE,IN_DELETE,IN_MOVED_FROM,IN_MOVED_TO,IN_DELETE_SELF,
+                         IN_ONLYDIR,IN_EXCL_UNLINK,IN_ISDIR,IN_IGNORED,IN_Q_OVERFLOW)
+from tool_recover_db_from_files import (SONG_SUFFIXES,MAX_REMOVED_SHARE,walk_collection,is_ignored_name,stat_songs,parse_and_insert,
+                                        scan_collection,pruning_refused)
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK
+
+# ---|---
+class LibraryWatcher:
+    '''
+    keeps songs and scan cache of db in sync with the files below collection_path.
+
+    events are only collected while they arrive; once no event came for debounce_ms
+    (or max_delay_ms passed during a long burst) the affected paths are compared with
+    the disk and the batch is applied: renames move cache entries without parsing,
+    new or rewritten files are parsed, songs of deleted files are removed (remove_deleted, off by default;
+    refused while the collection is missing or empty or when more than max_removed_share of it disappears).
+    '''
+    def __init__(self,db:sqlite3.Connection,collection_path:str,ignore_paths:list[str]|None,
+                 extract:Callable[[str],song_metadata|None]=get_metadata_from_file_header,jobs:int=1,
+                 source:str|None=None,remove_deleted:bool=False,max_removed_share:float=MAX_REMOVED_SHARE,
+                 debounce_ms:int=1000,max_delay_ms:int=10_000):
+        self.db = db
+        self.collection_path = os.path.realpath(collection_path)
+        self.ignore_paths = ignore_paths
+        self.ignore_set = {s.lower().strip() for s in ignore_paths} if ignore_paths else set()
+        self.extract = extract
+        self.jobs = jobs
+        self.source = source
+        self.remove_deleted = remove_deleted
+        self.max_removed_share = max_removed_share
+        self.debounce_s = debounce_ms / 1000
+        self.max_delay_s = max_delay_ms / 1000
+        self.inotify = Inotify()
+        self.watched:dict[int,str] = {}
+        # pending batch
+        self.renames:list[tuple[str,str,bool]] = []
+        self.touched:dict[str,bool] = {}
+        self.moved_from:dict[int,tuple[str,bool]] = {}
+        self.needs_rescan = False
+
+    def watch_tree(self,dir_path:str):
+        # inotify is not recursive, every folder gets its own watch
+        for folder,_ in walk_collection(dir_path,self.ignore_paths,sort=False):
+            try:
+                self.watched[self.inotify.add_watch(folder,WATCH_MASK)] = folder
+            except OSError as error:
+                print(f"|-[Warning] - could not watch {folder}: {error}")
+
+    def _rename_pending(self,old_path:str,new_path:str):
+        # later events of moved folders and paths collected before the move refer to the new location
+        old_prefix = os.path.join(old_path,"")
+        def renamed(path:str) -> str:
+            if path == old_path:
+                return new_path
+            if path.startswith(old_prefix):
+                return os.path.join(new_path,path[len(old_prefix):])
+            return path
+        for wd,folder in self.watched.items():
+            self.watched[wd] = renamed(folder)
+        self.touched = {renamed(path):is_dir for path,is_dir in self.touched.items()}
+
+    def _unwatch(self,dir_path:str):
+        # folders moved out of the collection would still report their events
+        prefix = os.path.join(dir_path,"")
+        for wd,folder in list(self.watched.items()):
+            if folder == dir_path or folder.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watched[wd]
+
+    def _collect(self,events):
+        for event in events:
+            if event.mask & IN_Q_OVERFLOW:
+                # events were lost, the scan cache finds whatever changed
+                self.needs_rescan = True
+                continue
+            if event.mask & IN_IGNORED:
+                self.watched.pop(event.wd,None)
+                continue
+            folder = self.watched.get(event.wd)
+            if folder is None or not event.name:
+                continue
+            is_dir = bool(event.mask & IN_ISDIR)
+            if is_ignored_name(event.name,self.ignore_set if is_dir else set()):
+                continue
+            if not is_dir and not event.name.lower().endswith(SONG_SUFFIXES):
+                continue
+            path = os.path.join(folder,event.name)
+            if event.mask & IN_MOVED_FROM:
+                self.moved_from[event.cookie] = (path,is_dir)
+            elif event.mask & IN_MOVED_TO and event.cookie in self.moved_from:
+                old_path,_ = self.moved_from.pop(event.cookie)
+                self.renames.append((old_path,path,is_dir))
+                self._rename_pending(old_path,path)
+            elif event.mask & IN_CREATE and is_dir:
+                # watched right away, files written before the watch exists are found by the walk
+                self.watch_tree(path)
+                self.touched[path] = True
+            else:
+                # written, deleted or moved in from outside; compared with the disk when applied
+                self.touched[path] = is_dir
+
+    def _apply(self):
+        start_time = time.perf_counter()
+        # moves without a counterpart left (or entered from) outside of the collection
+        for path,is_dir in self.moved_from.values():
+            self.touched[path] = is_dir
+        self.moved_from.clear()
+
+        amount_renamed = len(self.renames)
+        orphan_keys = rename_in_scan_cache(self.db,((old_path,new_path) for old_path,new_path,_ in self.renames))
+        for _,new_path,is_dir in self.renames:
+            if not is_dir:
+                # unchanged after the move, checked in case it was written as well
+                self.touched[new_path] = False
+        self.renames.clear()
+
+        songs:list[str] = []
+        removed_paths:list[str] = []
+        for path,is_dir in self.touched.items():
+            if os.path.isdir(path) if is_dir else os.path.isfile(path):
+                if is_dir:
+                    self.watch_tree(path)
+                    songs += (song for _,folder_songs in walk_collection(path,self.ignore_paths,sort=False) for song in folder_songs)
+                else:
+                    songs.append(path)
+            else:
+                if is_dir:
+                    self._unwatch(path)
+                removed_paths.append(path)
+        self.touched.clear()
+        amount_known = count_scan_cache(self.db,self.collection_path)
+        removed_keys = remove_from_scan_cache(self.db,removed_paths)
+        orphan_keys += removed_keys
+
+        file_stats = {entry[0]:entry for entry in stat_songs(songs)}
+        changed,_,_ = diff_scan_cache(self.db,file_stats.values(),None)
+        inserted,skipped,replaced_keys = parse_and_insert(self.db,changed,file_stats,self.jobs,self.extract,self.source)
+        orphan_keys += replaced_keys
+        amount_deleted = 0
+        if self.remove_deleted and orphan_keys:
+            refusal = pruning_refused([self.collection_path],len(removed_keys),amount_known,self.max_removed_share)
+            if refusal is not None:
+                print(f"|-[Warning] - not deleting songs of removed files: {refusal}")
+            else:
+                amount_deleted = remove_orphaned_songs(self.db,orphan_keys)
+        print(f"|- {amount_renamed} moved, {len(changed)} parsed, {len(removed_keys)} removed files | "
+              f"{inserted} songs inserted, {skipped} skipped, {amount_deleted} deleted "
+              f"({time.perf_counter() - start_time:.2f} s)")
+
+    def rescan(self):
+        start_time = time.perf_counter()
+        if not os.path.isdir(self.collection_path):
+            print(f"|-[Warning] - {self.collection_path} is missing (unmounted?), not rescanning")
+            return
+        self.watch_tree(self.collection_path)
+        statistics = scan_collection(self.db,self.collection_path,self.ignore_paths,self.jobs,self.extract,
+                                     self.source,remove_orphans=self.remove_deleted,max_removed_share=self.max_removed_share)
+        print(f"|- scan: {statistics['changed']} new or changed files, {statistics['unchanged']} unchanged, "
+              f"{statistics['removed']} removed | {statistics['inserted']} songs inserted, {statistics['deleted']} deleted "
+              f"({time.perf_counter() - start_time:.2f} s)")
+
+    def has_pending(self) -> bool:
+        return bool(self.touched or self.renames or self.moved_from or self.needs_rescan)
+
+    def run(self,stop_after_s:float|None=None):
+        '''
+        catches up with changes made while not watching, then follows events until interrupted
+        '''
+        self.rescan()
+        print(f"|- watching {len(self.watched)} folders below {self.collection_path}")
+        started = time.monotonic()
+        first_event = None
+        while stop_after_s is None or time.monotonic() - started < stop_after_s:
+            events = self.inotify.read_events(self.debounce_s if self.has_pending() else 1.0)
+            if events:
+                self._collect(events)
+                # events of other files (covers, ignored folders) do not open a batch
+                if self.has_pending():
+                    first_event = first_event or time.monotonic()
+                # keep collecting during a burst, unless it lasts longer than max_delay
+                if first_event is not None and time.monotonic() - first_event < self.max_delay_s:
+                    continue
+            if not self.has_pending():
+                first_event = None
+                continue
+            if self.needs_rescan:
+                print("|-[Warning] - inotify queue overflowed, rescanning collection")
+                self.needs_rescan = False
+                self.renames.clear()
+                self.touched.clear()
+                self.moved_from.clear()
+                self.rescan()
+            else:
+                self._apply()
+            first_event = None
+
+    def close(self):
+        self.inotify.close()
+
+if __name__ == "__main__":
+    print("|--- Watching Collection")
+
+    parser = argparse.ArgumentParser(prog="Recording-DB-Watch",
+                                     usage="keep database in sync with collection",
+                                     formatter_class=argparse.RawTextHelpFormatter
+                                     )
+    parser.add_argument("-db","--database",
+                        help="name of database",
+                        required=True
+                        )
+    parser.add_argument("-dir","--directory",
+                        help="receive path to collection",
+                        required=True)
+    parser.add_argument("-s","--source",
+                        help="Set source of music to Spotify,None otherwise",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("-ignore","--ignore_folders",
+                        help="write liste of folders to ignore; divided by ;",
+                        required=False
+                        )
+    parser.add_argument("--remove-deleted",
+                        help="remove songs from the database when their files are deleted",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("--max-removed-share",
+                        help=f"refuse removing songs when more than this share of the files disappears at once, default {MAX_REMOVED_SHARE}",
+                        type=float,default=MAX_REMOVED_SHARE,
+                        required=False)
+    parser.add_argument("-fr","--full-read",
+                        help="parse files completely with mutagen instead of reading only their tag headers",
+                        action="store_true",default=False,
+                        required=False)
+    parser.add_argument("-j","--jobs",
+                        help="amount of files parsed in parallel, default 1",
+                        type=int,default=1,
+                        required=False)
+    parser.add_argument("-d","--debounce-ms",
+                        help="wait for this long without events before applying them, default 1000",
+                        type=int,default=1000,
+                        required=False)
+
+    arguments = parser.parse_args()
+
+    if not os.path.isdir(arguments.directory):
+        print("|-[Warning] - path to collection invalid")
+        exit()
+
+    watcher = LibraryWatcher(initialize_database(f"{arguments.database}.db"),arguments.directory,
+                             arguments.ignore_folders.split(";") if arguments.ignore_folders else None,
+                             extract=get_metadata_from_file if arguments.full_read else get_metadata_from_file_header,
+                             jobs=arguments.jobs,
+                             source="Spotify" if arguments.source else None,
+                             remove_deleted=arguments.remove_deleted,
+                             max_removed_share=arguments.max_removed_share,
+                             debounce_ms=arguments.debounce_ms)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print("|- stopped watching")
+    finally:
+        watcher.close()